@@ -1,12 +1,25 @@
+import threading
+import time
+
 import solara
-from mesa.visualization import SolaraViz
+from mesa.visualization.solara_viz import ComponentsView, ModelCreator
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 import networkx as nx
+import numpy as np
+
+from typing import Optional
 
-from graph_utils import load_graphs, merge_graphs, create_subgraph_within_radius
+from graph_utils import load_graphs_and_merged_graph, create_subgraph_within_radius
+from csr_graph import CSRGraph, build_routing_graphs
+from route_cache import RouteCache
+from map_layer import get_map_layer
+import app_state
+from checkpoint import fork_model
+from simulation_runner import SimulationRunner
 from model import (
     SustainabilityModel,
+    ModelSnapshot,
     get_current_transport_usage_plot,
     get_co2_emissions_plot,
     get_co2_budget_plot,
@@ -18,8 +31,6 @@ from company_agent import POSSIBLE_COMPANY_POLICIES
 total_radius = 5000     # 1000m for developing, 5000m for actual simulations
 company_location_radius = total_radius // 5
 center = 41.1664384, -8.6016
-graphs = load_graphs(center, distance_meters=total_radius)
-merged_graph = merge_graphs(graphs)
 companies = {
     "policy0": 3,
     "policy1": 2,
@@ -29,44 +40,56 @@ companies = {
 }
 num_workers_per_company = 10
 
-model_params = {
-    "num_workers_per_company": {
-        "type": "SliderInt",
-        "value": 10,
-        "label": "Number of workers per Company",
-        "min": 2,
-        "max": 20,
-        "step": 1,
-    },
-    "graphs": graphs,
-    "merged_graph": merged_graph,
-    "center_position": center,
-    "company_location_radius": company_location_radius,
-    "agent_home_radius": total_radius,
-    "company_budget_per_employee": {
-        "type": "SliderInt",
-        "value": DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
-        "label": "Base CO2(g) Budget Per Employee",
-        "min": 500,
-        "max": 5000,
-        "step": 100,
-    },
-    "seed": 42,
-}
+# Seconds between redraws of the plots while the model runs
+FRAME_INTERVAL = 0.5
+
+# Key of the loader in the state shared by all sessions, and kept on hot reloads (see app_state.py)
+APP_LOADER_KEY = ("sustainability_app_loader", center, total_radius)
+
+
+def get_model_params(resources: dict) -> dict:
+    model_params = {
+        "num_workers_per_company": {
+            "type": "SliderInt",
+            "value": 10,
+            "label": "Number of workers per Company",
+            "min": 2,
+            "max": 20,
+            "step": 1,
+        },
+        "graphs": resources["graphs"],
+        "merged_graph": resources["merged_graph"],
+        "center_position": center,
+        "company_location_radius": company_location_radius,
+        "agent_home_radius": total_radius,
+        "company_budget_per_employee": {
+            "type": "SliderInt",
+            "value": DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
+            "label": "Base CO2(g) Budget Per Employee",
+            "min": 500,
+            "max": 5000,
+            "step": 100,
+        },
+        "seed": 42,
+        "routing_graphs": resources["routing_graphs"],
+        "route_cache": resources["route_cache"],
+        "visualization_graph": resources["visualization_graph"],
+    }
 
-for policy in POSSIBLE_COMPANY_POLICIES:
-    model_params.update(
-        {
-            policy: {
-                "type": "SliderInt",
-                "value": companies[policy],
-                "label": f"Number of companies with {policy}",
-                "min": 0,
-                "max": 5,
-                "step": 1,
+    for policy in POSSIBLE_COMPANY_POLICIES:
+        model_params.update(
+            {
+                policy: {
+                    "type": "SliderInt",
+                    "value": companies[policy],
+                    "label": f"Number of companies with {policy}",
+                    "min": 0,
+                    "max": 5,
+                    "step": 1,
+                }
             }
-        }
-    )
+        )
+    return model_params
 
 class InterfaceSustainabilityModel(SustainabilityModel):
     def __init__(
@@ -78,9 +101,15 @@ class InterfaceSustainabilityModel(SustainabilityModel):
         company_location_radius: int = 1000,
         agent_home_radius: int = 5000,
         company_budget_per_employee: int = DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
+        routing_graphs: dict[str, CSRGraph] = None,
+        route_cache: RouteCache = None,
+        visualization_graph: nx.Graph = None,
         **kwargs,
     ):
-        """This class is just used to make a constructor suitable for the interface sliders."""
+        """
+        This class is just used to make a constructor suitable for the interface sliders.
+        `visualization_graph` is the part of the merged graph that is drawn (all of it by default).
+        """
         for policy in POSSIBLE_COMPANY_POLICIES:
             companies[policy] = kwargs.get(policy, companies[policy])
         super().__init__(
@@ -92,24 +121,101 @@ class InterfaceSustainabilityModel(SustainabilityModel):
             company_location_radius,
             agent_home_radius,
             company_budget_per_employee,
+            routing_graphs=routing_graphs,
+            route_cache=route_cache,
         )
-        self.visualization_graph = (
-            self.grid.G
-            if agent_home_radius <= 1000
-            else create_subgraph_within_radius(
-                self.grid.G, center_position, distance_meters=company_location_radius
+        self.visualization_graph = visualization_graph if visualization_graph is not None else merged_graph
+
+
+class InterfaceModelSnapshot(ModelSnapshot):
+    """Snapshot of the model with the positions of the agents, which the map draws."""
+
+    def __init__(self, model: InterfaceSustainabilityModel):
+        super().__init__(model)
+        self.visualization_graph = model.visualization_graph
+        self.worker_nodes = np.array([agent.pos for agent in model.worker_agents], dtype=np.int64)
+        self.company_nodes = np.array([company.pos for company in model.company_agents], dtype=np.int64)
+
+
+class AppLoader:
+    """
+    Loads the graphs and the initial model of the app in a background thread,
+    so that the page is served while they load. `progress` (0 to 1) and `message` tell the current stage.
+    """
+
+    def __init__(self):
+        self.progress = 0.0
+        self.message = "Starting"
+        self.resources: Optional[dict] = None
+        self.error: Optional[Exception] = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self.__load, name="app-loader", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the loading finishes (or fails), returning whether it did."""
+        return self._done.wait(timeout)
+
+    def __set_stage(self, progress: float, message: str) -> None:
+        self.progress = progress
+        self.message = message
+
+    def __load(self) -> None:
+        try:
+            self.__set_stage(0.0, "Loading the street graphs (downloaded from OpenStreetMap the first time)")
+            graphs, merged_graph = load_graphs_and_merged_graph(center, distance_meters=total_radius)
+
+            self.__set_stage(0.5, "Building the routing graphs")
+            routing_graphs = build_routing_graphs(graphs)
+            route_cache = RouteCache()  # Avoids recomputing the routes when the model is rebuilt
+
+            self.__set_stage(0.6, "Selecting the area to draw")
+            if total_radius <= 1000:
+                visualization_graph = merged_graph
+            else:
+                visualization_graph = create_subgraph_within_radius(
+                    merged_graph, center, distance_meters=company_location_radius
+                )
+
+            self.__set_stage(0.7, "Creating the model")
+            model = InterfaceSustainabilityModel(
+                num_workers_per_company=num_workers_per_company,
+                graphs=graphs,
+                merged_graph=merged_graph,
+                center_position=center,
+                company_location_radius=company_location_radius,
+                agent_home_radius=total_radius,
+                company_budget_per_employee=DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
+                routing_graphs=routing_graphs,
+                route_cache=route_cache,
+                visualization_graph=visualization_graph,
             )
-        )
 
-model = InterfaceSustainabilityModel(
-    num_workers_per_company=num_workers_per_company,
-    graphs=graphs,
-    merged_graph=merged_graph,
-    center_position=center,
-    company_location_radius=company_location_radius,
-    agent_home_radius=total_radius,
-    company_budget_per_employee=DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
-)
+            self.__set_stage(0.9, "Drawing the map")
+            get_map_layer(visualization_graph)
+
+            self.resources = {
+                "graphs": graphs,
+                "merged_graph": merged_graph,
+                "routing_graphs": routing_graphs,
+                "route_cache": route_cache,
+                "visualization_graph": visualization_graph,
+                "model": model,
+            }
+            self.__set_stage(1.0, "Ready")
+        except Exception as error:
+            self.error = error
+        finally:
+            self._done.set()
+
+
+def get_app_loader() -> AppLoader:
+    """Loader shared by all sessions of the process, started by the first one (and again if it failed)."""
+    with app_state.lock:
+        loader = app_state.values.get(APP_LOADER_KEY)
+        if loader is None or loader.error is not None:
+            loader = app_state.values[APP_LOADER_KEY] = AppLoader()
+    return loader
 
 def convert_to_solara_figure(mpl_fig: Figure):
     solara_figure = solara.FigureMatplotlib(mpl_fig)
@@ -119,45 +225,21 @@ def convert_to_solara_figure(mpl_fig: Figure):
 
     return solara_figure
 
-def make_graph_plot(model: SustainabilityModel):
-    worker_agent_positions_state = model.get_worker_positions()
-    visualization_graph = model.visualization_graph
-
-    pos = {
-        node: (data["x"], data["y"])
-        for node, data in visualization_graph.nodes(data=True)
-    }
+def make_graph_plot(model: InterfaceModelSnapshot):
+    # The street network is drawn once per visualization graph, and only the agents on every refresh
+    layer = get_map_layer(model.visualization_graph)
+    fig, ax = layer.create_figure()
+    layer.draw(ax)
 
-    company_nodes = [
-        company.pos
-        for company in model.company_agents
-        if company.pos in visualization_graph.nodes
-    ]
-
-    worker_nodes = {}
-    for worker_node in worker_agent_positions_state.values():
-        if worker_node in visualization_graph.nodes:
-            worker_nodes[worker_node] = worker_nodes.get(worker_node, 0) + 1
-
-    fig, ax = plt.subplots()
-    nx.draw(
-        visualization_graph,
-        pos=pos,
-        ax=ax,
-        node_size=1,
-        node_color="black",
-        edge_color="black",
-        with_labels=False,
-        arrows=False,
-    )
+    worker_counts = layer.count_nodes(model.worker_nodes)
+    occupied = np.flatnonzero(worker_counts)
     min_size = 100
     max_size = 300
-    max_count = len(worker_agent_positions_state)
-    sizes = [min_size + (max_size - min_size) * (count / max_count) for count in worker_nodes.values()]
+    sizes = min_size + (max_size - min_size) * (worker_counts[occupied] / len(model.worker_nodes))
 
     ax.scatter(
-        [visualization_graph.nodes[worker_node]["x"] for worker_node in worker_nodes.keys()],
-        [visualization_graph.nodes[worker_node]["y"] for worker_node in worker_nodes.keys()],
+        layer.xs[occupied],
+        layer.ys[occupied],
         s=sizes,
         cmap=None,
         facecolors="none",  # not filled
@@ -165,46 +247,157 @@ def make_graph_plot(model: SustainabilityModel):
         linewidths=2
     )
 
+    company_indices = layer.node_indices(model.company_nodes)
+    company_indices = company_indices[company_indices >= 0]
     ax.scatter(
-        [visualization_graph.nodes[company_node]["x"] for company_node in company_nodes],
-        [visualization_graph.nodes[company_node]["y"] for company_node in company_nodes],
+        layer.xs[company_indices],
+        layer.ys[company_indices],
         s=30,
         c="blue",
     )
     return convert_to_solara_figure(fig)
 
-def make_transport_usage_plot(model: SustainabilityModel):
+def make_transport_usage_plot(model: ModelSnapshot):
     return convert_to_solara_figure(
         get_current_transport_usage_plot(model, figsize=(6, 4))
     )
 
-def make_co2_emissions_plot(model: SustainabilityModel):
+def make_co2_emissions_plot(model: ModelSnapshot):
     return convert_to_solara_figure(
         get_co2_emissions_plot(model, figsize=(6, 4))
     )
 
-def make_co2_budget_plot(model: SustainabilityModel):
+def make_co2_budget_plot(model: ModelSnapshot):
     return convert_to_solara_figure(
         get_co2_budget_plot(model, figsize=(6, 4))
     )
 
-def make_co2_budget_per_company_type_plot(model: SustainabilityModel):
+def make_co2_budget_per_company_type_plot(model: ModelSnapshot):
     return convert_to_solara_figure(
         get_co2_budget_per_company_type_plot(model, figsize=(6, 4))
     )
 
 @solara.component
-def Page():
-    solara.Title("Sustainability Model")    
-    SolaraViz(
-        model,
-        components=[
+def SimulationController(runner: SimulationRunner, snapshot: ModelSnapshot, running: bool, on_reset):
+    """Controls of the model, which is stepped by the runner in the background."""
+    steps_per_frame = solara.use_reactive(runner.steps_per_snapshot)
+
+    def set_steps_per_frame(value: int):
+        steps_per_frame.value = value
+        runner.steps_per_snapshot = value
+
+    with solara.Row(justify="space-between"):
+        solara.Button(label="Reset", color="primary", on_click=on_reset)
+        solara.Button(
+            label="▶" if not running else "❚❚",
+            color="primary",
+            on_click=runner.pause if running else runner.play,
+            disabled=snapshot.finished,
+        )
+        solara.Button(
+            label="Step",
+            color="primary",
+            on_click=lambda: runner.step(steps_per_frame.value),
+            disabled=running or snapshot.finished,
+        )
+    solara.Button(
+        label="Run to end of day",
+        color="primary",
+        on_click=runner.run_to_end_of_day,
+        disabled=running or snapshot.finished,
+        style={"width": "100%"},
+    )
+    solara.SliderInt(
+        "Steps per frame",
+        value=steps_per_frame.value,
+        min=1,
+        max=200,
+        on_value=set_steps_per_frame,
+    )
+
+
+@solara.component
+def SimulationView(resources: dict):
+    """
+    Same layout as `SolaraViz`, but the model is stepped by a `SimulationRunner` in the background,
+    and the plots draw its latest snapshot, at most once every `FRAME_INTERVAL` seconds.
+    """
+    # Each session runs its own copy of the initial model, which is shared by all of them
+    initial_model = solara.use_memo(
+        lambda: fork_model(resources["model"], shared=[resources["visualization_graph"]]),
+        dependencies=[resources["model"]],
+    )
+    model_params = solara.use_memo(lambda: get_model_params(resources), dependencies=[resources["model"]])
+    model = solara.use_reactive(initial_model)
+    model_parameters = solara.use_reactive({})
+    runner = solara.use_memo(
+        lambda: SimulationRunner(model.value, make_snapshot=InterfaceModelSnapshot), dependencies=[model.value]
+    )
+    solara.use_effect(lambda: runner.close, dependencies=[runner])
+    snapshot, set_snapshot = solara.use_state(runner.snapshot)
+    running, set_running = solara.use_state(False)
+
+    def follow_runner():
+        version = runner.version
+        set_snapshot(runner.snapshot)
+        while True:
+            if runner.wait_for_snapshot(version, FRAME_INTERVAL):
+                version = runner.version
+                set_snapshot(runner.snapshot)
+            set_running(runner.running)
+            time.sleep(FRAME_INTERVAL)
+
+    solara.use_thread(follow_runner, dependencies=[runner])
+
+    def reset():
+        runner.close()
+        model.value = InterfaceSustainabilityModel(**model_parameters.value)
+
+    with solara.AppBar():
+        solara.AppBarTitle("Sustainability Model")
+
+    with solara.Sidebar(), solara.Column():
+        with solara.Card("Controls"):
+            SimulationController(runner, snapshot, running, reset)
+        with solara.Card("Model Parameters"):
+            ModelCreator(model, model_params, model_parameters=model_parameters)
+        with solara.Card("Information"):
+            solara.Text(f"Step: {snapshot.steps}, days completed: {len(snapshot.new_day_steps)}")
+
+    ComponentsView(
+        [
             make_graph_plot,
             make_co2_emissions_plot,
             make_transport_usage_plot,
             make_co2_budget_per_company_type_plot,
             make_co2_budget_plot,
         ],
-        model_params=model_params,
-        name="Sustainability Model",
+        snapshot,
     )
+
+
+@solara.component
+def Page():
+    solara.Title("Sustainability Model")
+    loader = solara.use_memo(get_app_loader, dependencies=[])
+    stage, set_stage = solara.use_state((loader.progress, loader.message))
+
+    def wait_for_loader():
+        # Polls the stage of the loader until it finishes, rendering the page again on every change
+        while not loader.wait(0.25):
+            set_stage((loader.progress, loader.message))
+        set_stage((loader.progress, loader.message))
+
+    solara.use_thread(wait_for_loader, dependencies=[loader])
+
+    if loader.error is not None:
+        solara.Error(f"Could not load the simulation: {loader.error}")
+        return
+    if loader.resources is None:
+        progress, message = stage
+        with solara.Column(style={"padding": "2em"}):
+            solara.Text(message)
+            solara.ProgressLinear(value=100 * progress)
+        return
+
+    SimulationView(loader.resources)
@@ -0,0 +1,22 @@
+"""
+State of the app shared by all sessions of the server process, and kept on hot reloads.
+
+Solara's hot reload runs every module of the app again (this one too), which would start over
+with new globals. So the state lives in a module object registered under a name that no file has,
+which the reloader never drops, and this module only refers to it.
+"""
+import sys
+import threading
+import types
+
+_STATE_MODULE_NAME = "_sustainability_app_state"
+
+if _STATE_MODULE_NAME not in sys.modules:
+    _state = types.ModuleType(_STATE_MODULE_NAME)
+    _state.values = {}
+    _state.lock = threading.Lock()
+    sys.modules[_STATE_MODULE_NAME] = _state
+
+# Shared values (e.g., the loader of the graphs and initial model), and the lock to access them
+values: dict = sys.modules[_STATE_MODULE_NAME].values
+lock: threading.Lock = sys.modules[_STATE_MODULE_NAME].lock
@@ -0,0 +1,376 @@
+"""
+Benchmarks the model on synthetic street graphs (see synthetic_graphs.py), so that it runs
+offline and on the same graphs every time.
+
+For every graph and every combination of engine, number of companies and workers per company,
+it times the graph merge and routing graph construction, the model construction, the stepping,
+the metric collection and the plots, and appends a row per run to a CSV file.
+With `--baseline`, the times are compared against those of an earlier results file,
+and it exits with an error if any of them got slower than the tolerance.
+
+Example:
+    python benchmark.py --graph_kinds grid random --graph_sizes 30 60 --num_companies 5 20 --num_workers_per_company 10 50
+"""
+import argparse
+import csv
+import io
+import itertools
+import os
+import subprocess
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from graph_utils import merge_graphs
+from csr_graph import build_routing_graphs
+from company_agent import POSSIBLE_COMPANY_POLICIES
+from model import *
+from sharded_model import ShardedSustainabilityModel
+from synthetic_graphs import SYNTHETIC_GRAPH_KINDS, make_synthetic_graphs
+from run_utils import CENTER
+
+DEFAULT_BENCHMARK_OUTPUT = "benchmark_results.csv"
+DEFAULT_BENCHMARK_SHARDS = 2
+DEFAULT_TOLERANCE = 0.2
+
+TIMINGS = ["graph_time", "merge_time", "routing_graphs_time", "construction_time", "stepping_time", "collection_time", "plotting_time"]
+
+# Columns identifying the same benchmark across results files
+BENCHMARK_KEY = ["engine", "graph_kind", "graph_size", "num_companies", "num_workers_per_company", "days"]
+
+PLOTS = [
+    get_current_transport_usage_plot,
+    get_total_transport_usage_plot,
+    get_total_transport_usage_plot_per_company_type,
+    get_co2_emissions_plot,
+    get_co2_budget_plot,
+    get_co2_budget_per_company_type_plot,
+    get_transport_costs_plot,
+    get_emissions_plot_company_comparison,
+    get_costs_plot_company_comparison,
+]
+
+
+def _sharded_engine(**model_arguments):
+    return ShardedSustainabilityModel(DEFAULT_BENCHMARK_SHARDS, **model_arguments)
+
+
+# Functions creating a model from the `SustainabilityModel` arguments. Other engines are benchmarked
+# by adding them here: the model needs `step`, `finished`, `new_day_steps`, `data_collector`
+# and the reporters used by the plots (see `WorkerStateReporters`).
+ENGINES = {
+    "model": SustainabilityModel,
+    "fast_forward": lambda **model_arguments: SustainabilityModel(**model_arguments, fast_forward=True),
+    "event": lambda **model_arguments: SustainabilityModel(**model_arguments, scheduler="event"),
+    "sharded": _sharded_engine,
+}
+
+
+def parse_benchmark_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the model on synthetic street graphs."
+    )
+
+    parser.add_argument(
+        "--engines",
+        choices=list(ENGINES),
+        nargs="+",
+        default=["model"],
+        help="Engines to benchmark (default: model)",
+    )
+
+    parser.add_argument(
+        "--graph_kinds",
+        choices=SYNTHETIC_GRAPH_KINDS,
+        nargs="+",
+        default=["grid"],
+        help="Kinds of synthetic graphs (default: grid)",
+    )
+
+    parser.add_argument(
+        "--graph_sizes",
+        type=int,
+        nargs="+",
+        default=[40],
+        help="Numbers of intersections on each side of the synthetic graphs (default: 40)",
+    )
+
+    parser.add_argument(
+        "--graph_spacing",
+        type=float,
+        default=120,
+        help="Mean distance between neighbouring intersections in meters (default: 120)",
+    )
+
+    parser.add_argument(
+        "--num_companies",
+        type=int,
+        nargs="+",
+        default=[5],
+        help="Numbers of companies, spread over the policies (default: 5)",
+    )
+
+    parser.add_argument(
+        "--num_workers_per_company",
+        type=int,
+        nargs="+",
+        default=[10],
+        help="Numbers of workers per company (default: 10)",
+    )
+
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=30,
+        help="Days simulated by each run (default: 30, the whole run)",
+    )
+
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=1,
+        help="Runs of each benchmark (default: 1)",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Seed of the graphs and the models (default: 42)",
+    )
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_BENCHMARK_OUTPUT,
+        help=f"CSV file where the results are appended (default: {DEFAULT_BENCHMARK_OUTPUT})",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="CSV file with earlier results to compare the times against",
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help=f"Relative slowdown against the baseline reported as a regression (default: {DEFAULT_TOLERANCE})",
+    )
+
+    return parser.parse_args()
+
+
+def get_benchmark_companies(num_companies: int) -> dict[str, int]:
+    """Companies spread as evenly as possible over the policies."""
+    return {
+        policy: len(range(index, num_companies, len(POSSIBLE_COMPANY_POLICIES)))
+        for index, policy in enumerate(POSSIBLE_COMPANY_POLICIES)
+    }
+
+
+def get_commit() -> str:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def prepare_graphs(kind: str, size: int, spacing_meters: float, seed: int) -> dict:
+    """Synthetic graphs, merged graph and routing graphs, with the time taken by each."""
+    before = time.perf_counter()
+    graphs = make_synthetic_graphs(CENTER, kind=kind, size=size, spacing_meters=spacing_meters, seed=seed)
+    after_graphs = time.perf_counter()
+    merged_graph = merge_graphs(graphs)
+    after_merge = time.perf_counter()
+    routing_graphs = build_routing_graphs(graphs)
+    after_routing_graphs = time.perf_counter()
+
+    return {
+        "graphs": graphs,
+        "merged_graph": merged_graph,
+        "routing_graphs": routing_graphs,
+        "num_nodes": merged_graph.number_of_nodes(),
+        "num_edges": merged_graph.number_of_edges(),
+        "graph_time": after_graphs - before,
+        "merge_time": after_merge - after_graphs,
+        "routing_graphs_time": after_routing_graphs - after_merge,
+    }
+
+
+def _time_collection(model) -> list[float]:
+    """Time every metric collection of a model, returning the list the times are added to."""
+    collection_times = []
+    collect = model.data_collector.collect
+
+    def timed_collect(*args, **kwargs):
+        before = time.perf_counter()
+        collect(*args, **kwargs)
+        collection_times.append(time.perf_counter() - before)
+
+    model.data_collector.collect = timed_collect
+    return collection_times
+
+
+def time_plots(model) -> float:
+    before = time.perf_counter()
+    for plot in PLOTS:
+        figure = plot(model)
+        figure.savefig(io.BytesIO(), format="png")
+        plt.close(figure)
+    return time.perf_counter() - before
+
+
+def run_benchmark(
+    engine: str,
+    prepared_graphs: dict,
+    graph_size: int,
+    spacing_meters: float,
+    num_companies: int,
+    num_workers_per_company: int,
+    days: int,
+    seed: int,
+) -> dict:
+    """Run a model for `days` days on prepared graphs, returning its times."""
+    half_side = graph_size * spacing_meters / 2
+    before = time.perf_counter()
+    model = ENGINES[engine](
+        num_workers_per_company=num_workers_per_company,
+        companies=get_benchmark_companies(num_companies),
+        graphs=prepared_graphs["graphs"],
+        merged_graph=prepared_graphs["merged_graph"],
+        center_position=CENTER,
+        company_location_radius=half_side / 4,
+        agent_home_radius=half_side,
+        seed=seed,
+        routing_graphs=prepared_graphs["routing_graphs"],
+    )
+    construction_time = time.perf_counter() - before
+
+    collection_times = _time_collection(model)
+    before = time.perf_counter()
+    while not model.finished and len(model.new_day_steps) < days:
+        model.step()
+    run_time = time.perf_counter() - before
+    if not model.finished and hasattr(model, "close"):
+        model.close()
+
+    collection_time = sum(collection_times)
+    return {
+        "construction_time": construction_time,
+        "stepping_time": run_time - collection_time,
+        "collection_time": collection_time,
+        "plotting_time": time_plots(model),
+        "steps": model.steps,
+        "collections": len(collection_times),
+        "co2_total": sum(model.calculate_CO2_emissions().values()),
+    }
+
+
+def read_results(path: str) -> list[dict]:
+    with open(path, newline="") as file:
+        return list(csv.DictReader(file))
+
+
+def get_best_times(rows: list[dict]) -> dict[tuple, dict[str, float]]:
+    """Lowest time of each benchmark over its runs (the least disturbed by the rest of the machine)."""
+    best_times = {}
+    for row in rows:
+        key = tuple(str(row[column]) for column in BENCHMARK_KEY)
+        times = best_times.setdefault(key, {})
+        for timing in TIMINGS:
+            times[timing] = min(times.get(timing, float("inf")), float(row[timing]))
+    return best_times
+
+
+def compare_results(rows: list[dict], baseline_rows: list[dict], tolerance: float) -> list[str]:
+    """Print the relative change of each time against the baseline, returning the regressions."""
+    baseline_times = get_best_times(baseline_rows)
+    regressions = []
+    for key, times in get_best_times(rows).items():
+        if key not in baseline_times:
+            continue
+        changes = []
+        for timing in TIMINGS:
+            baseline_time = baseline_times[key][timing]
+            if baseline_time <= 0:
+                continue
+            change = times[timing] / baseline_time - 1
+            changes.append(f"{timing} {change:+.0%}")
+            if change > tolerance:
+                regressions.append(f"{dict(zip(BENCHMARK_KEY, key))}: {timing} {baseline_time:.3f}s -> {times[timing]:.3f}s")
+        print(f"{dict(zip(BENCHMARK_KEY, key))}: " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    args = parse_benchmark_arguments()
+    commit = get_commit()
+    rows = []
+
+    new_file = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+    with open(args.output, "a", newline="") as file:
+        writer = None
+        for graph_kind, graph_size in itertools.product(args.graph_kinds, args.graph_sizes):
+            prepared_graphs = prepare_graphs(graph_kind, graph_size, args.graph_spacing, args.seed)
+            print(f"{graph_kind} graph of size {graph_size}: {prepared_graphs['num_nodes']} nodes, "
+                  f"{prepared_graphs['num_edges']} edges")
+
+            benchmarks = itertools.product(args.engines, args.num_companies, args.num_workers_per_company, range(args.repeats))
+            for engine, num_companies, num_workers_per_company, _ in benchmarks:
+                result = run_benchmark(
+                    engine,
+                    prepared_graphs,
+                    graph_size,
+                    args.graph_spacing,
+                    num_companies,
+                    num_workers_per_company,
+                    args.days,
+                    args.seed,
+                )
+                row = {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "commit": commit,
+                    "engine": engine,
+                    "graph_kind": graph_kind,
+                    "graph_size": graph_size,
+                    "num_nodes": prepared_graphs["num_nodes"],
+                    "num_edges": prepared_graphs["num_edges"],
+                    "num_companies": num_companies,
+                    "num_workers_per_company": num_workers_per_company,
+                    "days": args.days,
+                    "seed": args.seed,
+                    **{timing: prepared_graphs[timing] for timing in TIMINGS[:3]},
+                    **result,
+                }
+                print(f"{engine}, {num_companies} companies of {num_workers_per_company} workers: " +
+                      ", ".join(f"{timing} {row[timing]:.3f}s" for timing in TIMINGS[3:]))
+
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames=list(row))
+                    if new_file:
+                        writer.writeheader()
+                writer.writerow(row)
+                file.flush()
+                rows.append(row)
+
+    print(f"Results appended to {args.output}")
+
+    if args.baseline is not None:
+        regressions = compare_results(rows, read_results(args.baseline), args.tolerance)
+        if regressions:
+            print(f"Slower than the baseline by more than {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
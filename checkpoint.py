@@ -0,0 +1,158 @@
+import copy
+import gzip
+import pickle
+
+import networkx as nx
+from mesa.space import NetworkGrid
+
+from typing import Iterable, Optional
+
+from csr_graph import CSRGraph, build_routing_graphs
+from route_cache import RouteCache
+from model import SustainabilityModel
+
+# Bump this whenever the model attributes change in a way that breaks older checkpoints
+CHECKPOINT_VERSION = 2
+
+
+def _static_objects(model: SustainabilityModel) -> list[tuple[tuple, object]]:
+    """
+    Objects a model shares with other models (graphs, routing graphs, route cache and grid),
+    with the key they are saved as instead of their contents.
+    """
+    static_objects = [
+        (("graphs",), model.graphs),
+        (("routing_graphs",), model.routing_graphs),
+        (("grid",), model.grid),
+        (("merged_graph",), model.grid.G),
+    ]
+    for type, graph in model.graphs.items():
+        static_objects.append((("graph", type), graph))
+    for type, routing_graph in model.routing_graphs.items():
+        static_objects.append((("routing_graph", type), routing_graph))
+    if model.route_cache is not None:
+        static_objects.append((("route_cache",), model.route_cache))
+    return static_objects
+
+
+def _route_objects(model: SustainabilityModel) -> list:
+    """
+    Paths of the workers and their edge distances, which never change once computed,
+    and with `lazy_paths`, the pool of paths and the company trees they are built from.
+    """
+    route_objects = [model.path_pool] if model.path_pool is not None else []
+    for agent in model.worker_agents:
+        for information in (*agent.information_to_work.values(), *agent.information_to_home.values()):
+            route_objects += [information, information.path]
+        route_objects += agent.paths.values()
+        route_objects += agent.path_distances.values()
+        if model.path_pool is not None:
+            route_objects.append(agent.company_trees)
+    return route_objects
+
+
+def _place_agents(model: SustainabilityModel, merged_graph: nx.Graph) -> None:
+    """
+    Give the model its own grid with its agents on their current nodes.
+    `NetworkGrid` keeps the agents on the nodes of its graph, so the grid is on a copy of
+    the nodes of the merged graph (without the edges), instead of the graph other models may be using.
+    """
+    occupancy_graph = type(merged_graph)()
+    occupancy_graph.add_nodes_from(merged_graph.nodes(data=True))
+    model.grid = NetworkGrid(occupancy_graph)
+    for agent in model.agents:
+        node, agent.pos = agent.pos, None
+        model.grid.place_agent(agent, node)
+
+
+class _CheckpointPickler(pickle.Pickler):
+    def __init__(self, file, static_objects: list[tuple[tuple, object]]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.static_keys = {id(obj): key for key, obj in static_objects}
+
+    def persistent_id(self, obj):
+        return self.static_keys.get(id(obj))
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, file, resources: dict):
+        super().__init__(file)
+        self.resources = resources
+
+    def persistent_load(self, pid):
+        kind, *keys = pid
+        if kind == "grid":
+            # Rebuilt once the agents are loaded
+            return None
+        if kind in ("graph", "routing_graph"):
+            return self.resources[f"{kind}s"][keys[0]]
+        return self.resources[kind]
+
+
+def save_checkpoint(model: SustainabilityModel, path: str) -> None:
+    """
+    Save the state of a model (agents, worker state, random number generators, schedule,
+    days and legs completed and collected metrics) to a compressed file.
+
+    The graphs, routing graphs and route cache are not saved. They are given again to `load_checkpoint`.
+    """
+    header = {
+        "version": CHECKPOINT_VERSION,
+        "fingerprints": {type: routing_graph.fingerprint for type, routing_graph in model.routing_graphs.items()},
+    }
+    with gzip.open(path, "wb", compresslevel=6) as file:
+        pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+        _CheckpointPickler(file, _static_objects(model)).dump(model)
+
+
+def load_checkpoint(
+    path: str,
+    graphs: dict[str, nx.Graph],
+    merged_graph: nx.Graph,
+    routing_graphs: Optional[dict[str, CSRGraph]] = None,
+    route_cache: Optional[RouteCache] = None,
+) -> SustainabilityModel:
+    """
+    Restore a model saved with `save_checkpoint`, on the same graphs it was created with.
+    """
+    if routing_graphs is None:
+        routing_graphs = build_routing_graphs(graphs)
+
+    with gzip.open(path, "rb") as file:
+        header = pickle.load(file)
+        if header["version"] != CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint version {header['version']} is not supported (expected {CHECKPOINT_VERSION})")
+        fingerprints = {type: routing_graph.fingerprint for type, routing_graph in routing_graphs.items()}
+        if header["fingerprints"] != fingerprints:
+            raise ValueError("The checkpoint was saved with different graphs")
+
+        resources = {
+            "graphs": graphs,
+            "routing_graphs": routing_graphs,
+            "merged_graph": merged_graph,
+            "route_cache": route_cache,
+        }
+        model = _CheckpointUnpickler(file, resources).load()
+
+    _place_agents(model, merged_graph)
+    return model
+
+
+def fork_model(model: SustainabilityModel, shared: Iterable = ()) -> SustainabilityModel:
+    """
+    Independent copy of a model, to run variants of it from its current state.
+
+    The graphs, routing graphs, route cache and the workers' paths are shared with the original model,
+    as well as the objects in `shared` (e.g., attributes of subclasses that are never changed).
+    """
+    # Objects in the memo are taken as already copied, so they are shared instead
+    memo = {}
+    for key, obj in _static_objects(model):
+        # The grid is rebuilt after copying the agents
+        memo[id(obj)] = None if key[0] in ("grid", "merged_graph") else obj
+    memo.update({id(obj): obj for obj in (*_route_objects(model), *shared)})
+    merged_graph = model.grid.G
+
+    fork = copy.deepcopy(model, memo)
+    _place_agents(fork, merged_graph)
+    return fork
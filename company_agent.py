@@ -1,6 +1,6 @@
 from mesa import Agent
 
-from graph_utils import get_closest_node
+from graph_utils import SnappedPosition
 
 POSSIBLE_COMPANY_POLICIES = [f"policy{x}" for x in range(5)]
 
@@ -12,14 +12,28 @@ def obtain_budget(policy: str, company_budget: int) -> float:
     return company_budget
 
 class CompanyAgent(Agent):
-    def __init__(self, model, policy: str, location_position: tuple[float, float], company_budget: int):
+    def __init__(
+        self,
+        model,
+        policy: str,
+        location_position: tuple[float, float],
+        company_budget: int,
+        location_snaps: dict[str, SnappedPosition],
+        company_index: int,
+    ):
+        """
+        `location_snaps` has the closest node of each graph type to the company location.
+        `company_index` is the position of the company in the model's list of companies.
+        """
         super().__init__(model=model)
+        self.company_index = company_index
         self.location_position = location_position
         self.workers = []
         self.policy = policy
+        self.location_snaps = location_snaps
         self.location_nodes: dict[str, int] = {
-            type: get_closest_node(graph, location_position)[0]
-            for type, graph in self.model.graphs.items()
+            type: snap.node
+            for type, snap in location_snaps.items()
         }
         self.company_budget: float = obtain_budget(self.policy, company_budget)
         self.previous_sum_CO2: float = 0
@@ -28,13 +42,19 @@ class CompanyAgent(Agent):
         self.model.grid.place_agent(self, self.visualization_node)
 
 
+    def set_policy(self, policy: str) -> None:
+        """
+        Change the policy of the company from now on (e.g., in a fork of a model).
+        The metrics per company type still count the company under its initial policy.
+        """
+        self.policy = policy
+        self.company_budget = obtain_budget(policy, self.model.base_company_budget)
+
     def add_worker(self, worker):
         self.workers.append(worker)
 
     def check_policies(self):
-        sum_CO2 = 0
-        for agent in self.workers:
-            sum_CO2 += self.model.get_total_co2(agent)
+        sum_CO2 = float(self.model.worker_state.company_co2[self.company_index])
 
         curr_day_sum_CO2 = sum_CO2 - self.previous_sum_CO2
         budget_diff_percent = (curr_day_sum_CO2 / self.company_budget - 1) * 100
@@ -0,0 +1,231 @@
+import hashlib
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from typing import Optional
+
+from spatial_index import NodeSpatialIndex
+from profiler import profiled
+
+
+class CSRGraph:
+    """
+    Compact, array-backed (CSR) copy of a street graph, used in the routing hot paths.
+
+    Nodes are stored sorted by their OSM id, so a node id maps to its index with a binary search.
+    Parallel edges are collapsed into a single edge with the minimum length (in meters),
+    which is the only edge information the simulation uses.
+    """
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        offsets: np.ndarray,
+        targets: np.ndarray,
+        lengths: np.ndarray,
+        lats: np.ndarray,
+        lons: np.ndarray,
+    ):
+        self.node_ids = node_ids    # Sorted OSM node ids
+        self.offsets = offsets      # Outgoing edges of node i are in [offsets[i], offsets[i + 1])
+        self.targets = targets      # Target node index of each edge, sorted within each node
+        self.lengths = lengths      # Minimum length (meters) of each edge
+        self.lats = lats            # Latitude ("y") of each node
+        self.lons = lons            # Longitude ("x") of each node
+        self._spatial_index: Optional[NodeSpatialIndex] = None
+        self._fingerprint: Optional[str] = None
+        self._matrix: Optional[csr_matrix] = None
+        self._reverse_matrix: Optional[csr_matrix] = None
+        self._edge_keys: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_networkx(cls, graph: nx.MultiDiGraph) -> "CSRGraph":
+        node_ids = np.array(sorted(graph.nodes), dtype=np.int64)
+
+        edges = np.array(
+            [(u, v, length) for u, v, length in graph.edges(data="length")],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+        sources = np.searchsorted(node_ids, edges[:, 0].astype(np.int64))
+        targets = np.searchsorted(node_ids, edges[:, 1].astype(np.int64))
+        lengths = edges[:, 2]
+
+        # Sort by (source, target, length) so that the first edge of each (source, target)
+        # group is the one with the minimum length
+        order = np.lexsort((lengths, targets, sources))
+        sources, targets, lengths = sources[order], targets[order], lengths[order]
+        first_of_group = np.ones(len(sources), dtype=bool)
+        first_of_group[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        sources, targets, lengths = sources[first_of_group], targets[first_of_group], lengths[first_of_group]
+
+        offsets = np.zeros(len(node_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=len(node_ids)), out=offsets[1:])
+
+        lats = np.array([graph.nodes[node]["y"] for node in node_ids.tolist()], dtype=np.float64)
+        lons = np.array([graph.nodes[node]["x"] for node in node_ids.tolist()], dtype=np.float64)
+
+        return cls(node_ids, offsets, targets.astype(np.int32), lengths, lats, lons)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def matrix(self) -> csr_matrix:
+        """Sparse adjacency matrix view (shares the arrays), as used by scipy's graph algorithms."""
+        if self._matrix is None:
+            self._matrix = csr_matrix(
+                (self.lengths, self.targets, self.offsets),
+                shape=(self.num_nodes, self.num_nodes),
+            )
+        return self._matrix
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the graph contents, used to identify it in persistent caches."""
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for array in (self.node_ids, self.offsets, self.targets, self.lengths):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @property
+    def spatial_index(self) -> NodeSpatialIndex:
+        """KD-tree over the node coordinates, built on first use."""
+        if self._spatial_index is None:
+            self._spatial_index = NodeSpatialIndex(self.node_ids, self.lats, self.lons)
+        return self._spatial_index
+
+    def node_index(self, node: int) -> int:
+        index = int(np.searchsorted(self.node_ids, node))
+        if index == self.num_nodes or self.node_ids[index] != node:
+            raise KeyError(f"Node {node} is not in the graph")
+        return index
+
+    @property
+    def edge_keys(self) -> np.ndarray:
+        """`source * num_nodes + target` of each edge, which is sorted because of the CSR layout."""
+        if self._edge_keys is None:
+            sources = np.repeat(np.arange(self.num_nodes, dtype=np.int64), np.diff(self.offsets))
+            self._edge_keys = sources * self.num_nodes + self.targets
+        return self._edge_keys
+
+    def _edge_indices(self, start_nodes, end_nodes) -> np.ndarray:
+        start_indices = np.searchsorted(self.node_ids, start_nodes)
+        end_indices = np.searchsorted(self.node_ids, end_nodes)
+        keys = start_indices.astype(np.int64) * self.num_nodes + end_indices
+        edges = np.searchsorted(self.edge_keys, keys)
+        if np.any(edges == len(self.edge_keys)) or np.any(self.edge_keys[np.minimum(edges, len(self.edge_keys) - 1)] != keys):
+            raise KeyError("There is no edge between some of the given nodes")
+        return edges
+
+    def edge_length(self, start_node: int, end_node: int) -> float:
+        """Minimum length (meters) of the edges from `start_node` to `end_node`."""
+        edge = self._edge_indices(np.array([start_node]), np.array([end_node]))[0]
+        return float(self.lengths[edge])
+
+    def path_edge_lengths(self, path: list[int]) -> np.ndarray:
+        """Length (meters) of each edge along the path."""
+        path = np.asarray(path, dtype=np.int64)
+        return self.lengths[self._edge_indices(path[:-1], path[1:])]
+
+    def path_length(self, path: list[int]) -> float:
+        """Total length (meters) of the path."""
+        if len(path) < 2:
+            return 0.0
+        return float(self.path_edge_lengths(path).sum())
+
+    def shortest_path(self, source_node: int, target_node: int) -> Optional[list[int]]:
+        """Shortest path by length, or None if the target is unreachable (same as osmnx)."""
+        source_index = self.node_index(source_node)
+        target_index = self.node_index(target_node)
+        _, predecessors = dijkstra(self.matrix, indices=source_index, return_predecessors=True)
+        return self._build_path(predecessors, source_index, target_index)
+
+    def shortest_path_tree(self, root_node: int, *, reverse: bool = False) -> "ShortestPathTree":
+        """
+        Single Dijkstra run that gives the shortest paths from the root to every node,
+        or from every node to the root if `reverse` is set.
+        The search itself only runs when the first path is read from the tree.
+        """
+        return ShortestPathTree(self, self.node_index(root_node), reverse)
+
+    @property
+    def reverse_matrix(self) -> csr_matrix:
+        """Adjacency matrix with every edge reversed, to search paths towards a node."""
+        if self._reverse_matrix is None:
+            self._reverse_matrix = self.matrix.transpose().tocsr()
+        return self._reverse_matrix
+
+    def _build_path(self, predecessors: np.ndarray, source_index: int, target_index: int) -> Optional[list[int]]:
+        path_indices = _follow_predecessors(predecessors, target_index, source_index)
+        if path_indices is None:
+            return None
+        path_indices.reverse()
+        return self.node_ids[path_indices].tolist()
+
+
+class ShortestPathTree:
+    """
+    Shortest paths between a root node and every other node of a CSRGraph,
+    obtained from a single Dijkstra run.
+    If `reverse` is set, the paths go from every node to the root, otherwise from the root to every node.
+    """
+
+    def __init__(self, graph: CSRGraph, root_index: int, reverse: bool):
+        self.graph = graph
+        self.root_index = root_index
+        self.reverse = reverse
+        self._predecessors: Optional[np.ndarray] = None
+
+    def __getstate__(self) -> dict:
+        # The search is run again if needed, instead of saving the predecessors
+        return {**self.__dict__, "_predecessors": None}
+
+    @property
+    def predecessors(self) -> np.ndarray:
+        if self._predecessors is None:
+            matrix = self.graph.reverse_matrix if self.reverse else self.graph.matrix
+            _, self._predecessors = dijkstra(matrix, indices=self.root_index, return_predecessors=True)
+        return self._predecessors
+
+    @property
+    def root_node(self) -> int:
+        return int(self.graph.node_ids[self.root_index])
+
+    def path(self, source_node: int, target_node: int) -> Optional[list[int]]:
+        """Shortest path between two nodes, one of which must be the root of the tree."""
+        other_node = source_node if self.reverse else target_node
+        root_node = target_node if self.reverse else source_node
+        if root_node != self.root_node:
+            raise ValueError(f"Path from {source_node} to {target_node} does not start or end in the tree root")
+
+        path_indices = _follow_predecessors(self.predecessors, self.graph.node_index(other_node), self.root_index)
+        if path_indices is None:
+            return None
+        if not self.reverse:
+            # Predecessors lead back to the root, while the path must start on it
+            path_indices.reverse()
+        return self.graph.node_ids[path_indices].tolist()
+
+
+def _follow_predecessors(predecessors: np.ndarray, start_index: int, root_index: int) -> Optional[list[int]]:
+    """Node indices from start_index until root_index, or None if the root is not reachable."""
+    path_indices = [start_index]
+    while path_indices[-1] != root_index:
+        previous = predecessors[path_indices[-1]]
+        if previous < 0:
+            return None
+        path_indices.append(previous)
+    return path_indices
+
+
+@profiled("setup.build_routing_graphs")
+def build_routing_graphs(graphs: dict[str, nx.MultiDiGraph]) -> dict[str, CSRGraph]:
+    return {
+        graph_name: CSRGraph.from_networkx(graph)
+        for graph_name, graph in graphs.items()
+    }
@@ -0,0 +1,62 @@
+import heapq
+import itertools
+
+SCHEDULER_OPTIONS = ["random", "event"]
+
+# Time of the day (hours) at which the workers leave for each path
+DEPARTURE_HOURS = {
+    "to_work": 8,
+    "to_home": 17,
+}
+
+# Simulated time processed by each step (hours)
+DEFAULT_EVENT_TIME_STEP = 1 / 60
+
+
+class EventScheduler:
+    """
+    Discrete-event alternative to `RandomActivation` for the workers.
+
+    Each moving worker has one pending event in a priority queue: the time at which it reaches
+    the next node of its path, given the edge length and the speed of its transport.
+    Each step advances the clock by `time_step` (or straight to the next event, if there is none before),
+    and only activates the workers with an event due, which move through all the nodes they reach
+    in that time. Long edges cost no work while they are travelled, and runs of short edges cost one activation.
+    """
+
+    def __init__(self, model, time_step: float = DEFAULT_EVENT_TIME_STEP):
+        self.model = model
+        self.time_step = time_step
+        self._queue: list[tuple[float, int, object]] = []
+        # Tie breaker, so that events at the same time are processed in the order they were added
+        self._sequence = itertools.count()
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._queue)
+
+    @staticmethod
+    def get_departure_time(path_switches: int, time: float) -> float:
+        """Time of departure of the next leg, after `path_switches` legs and at the earliest at `time`."""
+        day = path_switches // 2
+        path_name = "to_work" if path_switches % 2 == 0 else "to_home"
+        return max(time, day * 24 + DEPARTURE_HOURS[path_name])
+
+    def start_leg(self, agents, departure_time: float) -> None:
+        for agent in agents:
+            self.__push(agent.depart(departure_time), agent)
+
+    def step(self) -> None:
+        """Advance the clock and process the events due."""
+        if not self._queue:
+            return
+        # Jump over the time in which nothing happens (e.g., the night)
+        self.model.time = max(self.model.time + self.time_step, self._queue[0][0])
+        while self._queue and self._queue[0][0] <= self.model.time:
+            _, _, agent = heapq.heappop(self._queue)
+            next_event_time = agent.advance(self.model.time)
+            if next_event_time is not None:
+                self.__push(next_event_time, agent)
+
+    def __push(self, event_time: float, agent) -> None:
+        heapq.heappush(self._queue, (event_time, next(self._sequence), agent))
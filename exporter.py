@@ -0,0 +1,231 @@
+"""
+Writes the results of a run to columnar files as it runs, in chunks, so that they can be analysed
+without running the simulation again, and without keeping the whole run in memory.
+
+Two tables are written to the output directory:
+- `metrics`: model metrics every step, at the end of every leg or at the end of every day.
+- `workers`: one record per worker and day, with the transport chosen that day, the kms travelled,
+  the CO2 emitted and the cost of the day, and the sustainability factor at the end of the day.
+
+Files are in the Arrow IPC format (`.arrow`), which can be memory-mapped without copying
+(`pyarrow.ipc.open_file(pyarrow.memory_map(path))`), or in Parquet (`.parquet`), which is smaller.
+Requires pyarrow.
+"""
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from typing import Optional
+
+from metrics import COLLECT_EVERY_OPTIONS
+from transport_choice import TRANSPORTS
+
+EXPORT_FORMATS = ["arrow", "parquet"]
+DEFAULT_EXPORT_CHUNK_ROWS = 65536
+
+
+class _TableWriter:
+    """Buffers the columns of a table, writing them as a record batch (or row group) every `chunk_rows` rows."""
+
+    def __init__(
+        self,
+        path: str,
+        schema: pa.Schema,
+        export_format: str,
+        chunk_rows: int,
+        dictionaries: Optional[dict[str, pa.Array]] = None,
+    ):
+        """Dictionary columns are appended as indices into their values in `dictionaries`."""
+        self.schema = schema
+        self.dictionaries = dictionaries or {}
+        self.chunk_rows = chunk_rows
+        self.num_rows = 0
+        self._columns: dict[str, list] = {name: [] for name in schema.names}
+        self._buffered_rows = 0
+        if export_format == "parquet":
+            self._writer = pq.ParquetWriter(path, schema)
+        else:
+            self._writer = ipc.new_file(path, schema)
+
+    def append(self, columns: dict, num_rows: int) -> None:
+        """Add rows, given as a scalar or an array per column."""
+        for name, values in columns.items():
+            self._columns[name].append(np.broadcast_to(values, num_rows))
+        self._buffered_rows += num_rows
+        if self._buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffered_rows == 0:
+            return
+        arrays = []
+        for field in self.schema:
+            values = np.concatenate(self._columns[field.name])
+            if pa.types.is_dictionary(field.type):
+                # The same dictionary in every batch, as required by the Arrow IPC file format
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(values, type=field.type.index_type), self.dictionaries[field.name]
+                ))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.num_rows += self._buffered_rows
+        self._columns = {name: [] for name in self.schema.names}
+        self._buffered_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.close()
+
+
+class ResultsExporter:
+    """
+    Exports the results of a model (`SustainabilityModel` or `ShardedSustainabilityModel`) while it runs.
+    Call `update` after every step of the model, and `close` at the end (or use it as a context manager).
+
+    Everything is read from the worker state store and the reporters of the model,
+    so the run itself is not changed.
+    """
+
+    def __init__(
+        self,
+        model,
+        directory: str,
+        every: str = "day",
+        export_format: str = "arrow",
+        chunk_rows: int = DEFAULT_EXPORT_CHUNK_ROWS,
+    ):
+        if every not in COLLECT_EVERY_OPTIONS:
+            raise ValueError(f"Invalid export cadence '{every}'")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid export format '{export_format}'")
+        self.model = model
+        self.every = every
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.policies: list[str] = list(model.policies)
+        metrics_fields = [
+            ("step", pa.int64()),
+            ("time", pa.float64()),
+            ("days_completed", pa.int32()),
+            ("co2_car", pa.float64()),
+            ("co2_electric_scooter", pa.float64()),
+            ("co2_total", pa.float64()),
+            ("transport_costs_mean", pa.float64()),
+            ("transport_costs_std", pa.float64()),
+        ]
+        metrics_fields += [(f"co2_avg_{policy}", pa.float64()) for policy in self.policies]
+        self.metrics_writer = _TableWriter(
+            os.path.join(directory, f"metrics.{export_format}"), pa.schema(metrics_fields), export_format, chunk_rows
+        )
+
+        workers_schema = pa.schema([
+            ("day", pa.int32()),
+            ("worker", pa.int32()),
+            ("company", pa.int32()),
+            ("policy", pa.dictionary(pa.int8(), pa.string())),
+            ("transport", pa.dictionary(pa.int8(), pa.string())),
+            ("kms", pa.float64()),
+            ("co2", pa.float64()),
+            ("cost", pa.float64()),
+            ("sustainability_factor", pa.float64()),
+        ])
+        self.workers_writer = _TableWriter(
+            os.path.join(directory, f"workers.{export_format}"),
+            workers_schema,
+            export_format,
+            chunk_rows,
+            dictionaries={
+                "policy": pa.array(self.policies, type=pa.string()),
+                "transport": pa.array(TRANSPORTS, type=pa.string()),
+            },
+        )
+
+        state = model.worker_state
+        num_workers = state.num_workers
+        self._path_switches = model.path_switches
+        self._days = len(model.new_day_steps)
+        # Totals at the end of the previous day, to get those of each day
+        self._kms = np.zeros(num_workers)
+        self._co2 = np.zeros(num_workers)
+        self._costs = np.zeros(num_workers)
+        # Transports are counted when chosen, at the start of each day
+        self._uses = state.uses[:num_workers].copy()
+        self._transports = np.argmax(self._uses, axis=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update(self) -> None:
+        """Write the records of the last step of the model."""
+        model = self.model
+        end_of_leg = model.path_switches != self._path_switches
+        end_of_day = len(model.new_day_steps) != self._days
+        self._path_switches = model.path_switches
+
+        if self.every == "step" or (self.every == "leg" and end_of_leg) or end_of_day:
+            self.__write_metrics()
+        if end_of_day:
+            self._days = len(model.new_day_steps)
+            self.__write_workers()
+
+    def __write_metrics(self) -> None:
+        model = self.model
+        co2_emissions = model.calculate_CO2_emissions()
+        co2_per_company_type = model.calculate_CO2_avg_per_company_type()
+        costs = model.get_workers_transport_costs()
+
+        row = {
+            "step": model.steps,
+            "time": model.time if model.time is not None else np.nan,
+            "days_completed": len(model.new_day_steps),
+            "co2_car": co2_emissions["car"],
+            "co2_electric_scooter": co2_emissions["electric_scooter"],
+            "co2_total": co2_emissions["car"] + co2_emissions["electric_scooter"],
+            "transport_costs_mean": np.mean(costs),
+            "transport_costs_std": np.std(costs),
+        }
+        for policy in self.policies:
+            row[f"co2_avg_{policy}"] = co2_per_company_type[policy]
+        self.metrics_writer.append(row, 1)
+
+    def __write_workers(self) -> None:
+        state = self.model.worker_state
+        num_workers = state.num_workers
+        kms = state.kms[:num_workers].sum(axis=1)
+        co2 = state.co2[:num_workers].copy()
+        costs = state.costs[:num_workers].copy()
+        company = state.company_index[:num_workers]
+
+        self.workers_writer.append(
+            {
+                "day": self._days,
+                "worker": np.arange(num_workers),
+                "company": company,
+                "policy": state.company_policy_index[company],
+                "transport": self._transports,
+                "kms": kms - self._kms,
+                "co2": co2 - self._co2,
+                "cost": costs - self._costs,
+                "sustainability_factor": state.sustainability_factors[:num_workers].copy(),
+            },
+            num_workers,
+        )
+
+        self._kms, self._co2, self._costs = kms, co2, costs
+        # The transports of the next day were chosen when the day ended
+        uses = state.uses[:num_workers].copy()
+        self._transports = np.argmax(uses - self._uses, axis=1)
+        self._uses = uses
+
+    def close(self) -> None:
+        self.metrics_writer.close()
+        self.workers_writer.close()
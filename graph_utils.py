@@ -1,50 +1,156 @@
 import networkx as nx
 import osmnx as ox
-import osmnx.distance as distance
-import osmnx.routing as routing
 import osmnx.truncate as truncate
 from osmnx.utils_geo import bbox_from_point
 
+from csr_graph import CSRGraph, ShortestPathTree
+from route_cache import RouteCache
+from profiler import profiled
+
 from collections import namedtuple
+import hashlib
+import os
+import pickle
+from typing import Optional
 
 # ox.settings.log_console = True    # Enable OSMnx debugging
 
-def load_graphs(center_point, *, distance_meters=5000) -> dict[str, nx.Graph]:
-    drive_graph = ox.graph_from_point(
-        center_point=center_point, dist=distance_meters, network_type="drive"
-    )
-    drive_graph = truncate.largest_component(drive_graph, strongly=True)
+NETWORK_TYPES = ("drive", "bike", "walk")
 
-    bike_graph = ox.graph_from_point(
-        center_point=center_point, dist=distance_meters, network_type="bike"
-    )
-    bike_graph = truncate.largest_component(bike_graph, strongly=True)
-
-    walk_graph = ox.graph_from_point(
-        center_point=center_point, dist=distance_meters, network_type="walk"
-    )
-    walk_graph = truncate.largest_component(walk_graph, strongly=True)
+# Bump this whenever the way graphs are downloaded or post-processed changes,
+# so that stale cache files are ignored instead of silently reused
+GRAPH_CACHE_VERSION = 1
+DEFAULT_GRAPH_CACHE_DIR = ".graph_cache"
+GRAPH_TRUNCATION = "largest_strong"
 
-    return {
-        "drive": drive_graph,
-        "bike": bike_graph,
-        "walk": walk_graph,
-    }
 
-
-def get_closest_node(G, point) -> tuple[int, float]:
-    """Get the node closest to the given point"""
-    closest_node, dist = distance.nearest_nodes(
-        G, X=point[1], Y=point[0], return_dist=True
+def _download_graph(center_point, distance_meters: int, network_type: str) -> nx.MultiDiGraph:
+    graph = ox.graph_from_point(
+        center_point=center_point, dist=distance_meters, network_type=network_type
+    )
+    return truncate.largest_component(graph, strongly=True)
+
+def _graph_cache_path(cache_dir: str, name: str, center_point, distance_meters: int) -> str:
+    lat, lon = center_point
+    filename = f"{name}_{lat:.7f}_{lon:.7f}_{int(distance_meters)}m_{GRAPH_TRUNCATION}_v{GRAPH_CACHE_VERSION}.pickle"
+    return os.path.join(cache_dir, filename)
+
+def _read_cached_graph(path: str) -> Optional[nx.MultiDiGraph]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+def _write_cached_graph(path: str, graph: nx.MultiDiGraph) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Write to a temporary file first so that an interrupted run never leaves a corrupted cache entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(graph, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def _cache_entries_digest(paths: list[str]) -> str:
+    """Hash of the contents of cache entries, so that an entry built from them is rebuilt when any of them changes."""
+    digest = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _missing_cache_error(path: str) -> FileNotFoundError:
+    return FileNotFoundError(
+        f"Graph cache entry '{path}' not found and offline mode is enabled. "
+        "Run once with network access (or copy a pre-seeded cache directory) first."
     )
-    return closest_node, _convert_m_to_km(dist)
 
-def calculate_distance(graph: nx.MultiDiGraph, start_node: int, end_node: int) -> float:
-    edges = graph[start_node][end_node]
-    return _convert_m_to_km(min(edge["length"] for edge in edges.values()))
+def load_graphs(
+    center_point,
+    *,
+    distance_meters=5000,
+    cache_dir: Optional[str] = DEFAULT_GRAPH_CACHE_DIR,
+    offline: bool = False,
+) -> dict[str, nx.Graph]:
+    """
+    Load the drive, bike and walk graphs around the center point.
 
-def get_shortest_path(graph: nx.Graph, source_id: int, target_id: int) -> list[int]:
-    return routing.shortest_path(graph, source_id, target_id, weight="length")
+    Graphs are cached on disk in `cache_dir`, keyed by center point, distance, network type
+    and truncation, so only the first run downloads them from OpenStreetMap.
+    Use `cache_dir=None` to disable the cache and `offline=True` to never touch the network.
+    """
+    graphs = {}
+    for network_type in NETWORK_TYPES:
+        if cache_dir is None:
+            if offline:
+                raise ValueError("Offline mode requires a graph cache directory")
+            graphs[network_type] = _download_graph(center_point, distance_meters, network_type)
+            continue
+
+        path = _graph_cache_path(cache_dir, network_type, center_point, distance_meters)
+        graph = _read_cached_graph(path)
+        if graph is None:
+            if offline:
+                raise _missing_cache_error(path)
+            graph = _download_graph(center_point, distance_meters, network_type)
+            _write_cached_graph(path, graph)
+        graphs[network_type] = graph
+    return graphs
+
+@profiled("setup.load_graphs")
+def load_graphs_and_merged_graph(
+    center_point,
+    *,
+    distance_meters=5000,
+    cache_dir: Optional[str] = DEFAULT_GRAPH_CACHE_DIR,
+    offline: bool = False,
+) -> tuple[dict[str, nx.MultiDiGraph], nx.MultiDiGraph]:
+    """
+    Same as `load_graphs`, but also returns the merged graph (see `merge_graphs`),
+    which is cached as well to avoid rebuilding it on every run.
+    Its entry is keyed by the contents of the entries of the graphs it merges, so it is rebuilt
+    whenever any of them is downloaded again, and always has the same nodes as the graphs returned with it.
+    """
+    graphs = load_graphs(center_point, distance_meters=distance_meters, cache_dir=cache_dir, offline=offline)
+    if cache_dir is None:
+        return graphs, merge_graphs(graphs)
+
+    graph_paths = [
+        _graph_cache_path(cache_dir, network_type, center_point, distance_meters)
+        for network_type in sorted(graphs.keys())
+    ]
+    merged_name = "merged-" + "-".join(sorted(graphs.keys())) + "-" + _cache_entries_digest(graph_paths)
+    path = _graph_cache_path(cache_dir, merged_name, center_point, distance_meters)
+    merged_graph = _read_cached_graph(path)
+    if merged_graph is None:
+        merged_graph = merge_graphs(graphs)
+        _write_cached_graph(path, merged_graph)
+    return graphs, merged_graph
+
+
+SnappedPosition = namedtuple("SnappedPosition", ["node", "distance"])
+
+@profiled("routing.get_closest_nodes")
+def get_closest_nodes(graph: CSRGraph, points) -> list[SnappedPosition]:
+    """
+    Get the node closest to each of the given points with a single batched query.
+    Each point is a (latitude, longitude) pair, and is snapped to the nearest node of the graph,
+    with the great-circle distance (in kms) between them.
+    """
+    if len(points) == 0:
+        return []
+    nodes, distances = graph.spatial_index.nearest_nodes(points)
+    return [
+        SnappedPosition(node, _convert_m_to_km(dist))
+        for node, dist in zip(nodes.tolist(), distances.tolist())
+    ]
+
+@profiled("routing.calculate_path_distances")
+def calculate_path_distances(graph: CSRGraph, path: list[int]) -> list[float]:
+    """Distance (kms) of each edge along the path"""
+    return _convert_m_to_km(graph.path_edge_lengths(path)).tolist()
+
+def get_shortest_path(graph: CSRGraph, source_id: int, target_id: int) -> list[int]:
+    return graph.shortest_path(source_id, target_id)
 
 def create_subgraph_within_radius(G: nx.MultiDiGraph, center_position, *, distance_meters: int):
     """
@@ -57,28 +163,44 @@ def create_subgraph_within_radius(G: nx.MultiDiGraph, center_position, *, distan
 def _convert_m_to_km(distance: float) -> float:
     return distance / 1000
 
-def _get_path_distance_meters(graph: nx.Graph, path: list[int]) -> float:
-    total_distance = 0.0
-
-    # Iterate over consecutive pairs in the path
-    for u, v in zip(path[:-1], path[1:]):
-        mn_edge = min(graph[u][v].values(), key=lambda edge: edge["length"])
-        total_distance += mn_edge["length"]
-    return total_distance
+def _get_path_distance_meters(graph: CSRGraph, path: list[int]) -> float:
+    return graph.path_length(path)
 
 
 PathInformation = namedtuple("PathInformation", ["path", "transport_distance", "additional_distance"])
 
+@profiled("routing.get_path_information")
 def get_path_information(
-    graph: nx.Graph,
-    source_position: tuple[float, float],
-    target_pos: tuple[float, float],
+    routing_graph: CSRGraph,
+    source: SnappedPosition,
+    target: SnappedPosition,
+    shortest_path_tree: Optional[ShortestPathTree] = None,
+    route_cache: Optional[RouteCache] = None,
 ) -> PathInformation:
-    source_node, source_distance = get_closest_node(graph, source_position)
-    target_node, target_distance = get_closest_node(graph, target_pos)
-    path = get_shortest_path(graph, source_node, target_node)
+    """
+    Path between the closest nodes to two positions (see `get_closest_nodes`).
+    The route cache is consulted first, if given. Otherwise, if a shortest path tree rooted at
+    one of those nodes is given, the path is read from it instead of running a new search.
+    """
+    source_node, source_distance = source
+    target_node, target_distance = target
+
+    cached_route = (
+        route_cache.get(routing_graph.fingerprint, source_node, target_node)
+        if route_cache is not None
+        else None
+    )
+    if cached_route is not None:
+        path, transport_distance = cached_route
+    else:
+        if shortest_path_tree is None:
+            path = get_shortest_path(routing_graph, source_node, target_node)
+        else:
+            path = shortest_path_tree.path(source_node, target_node)
+        transport_distance = _convert_m_to_km(_get_path_distance_meters(routing_graph, path))
+        if route_cache is not None:
+            route_cache.put(routing_graph.fingerprint, source_node, target_node, path, transport_distance)
 
-    transport_distance = _convert_m_to_km(_get_path_distance_meters(graph, path))
     additional_distance = _convert_m_to_km(source_distance + target_distance)
 
     return PathInformation(path, transport_distance, additional_distance)
@@ -102,6 +224,7 @@ def random_position_within_bouding_box(rng, center_position: tuple[float, float]
     return random_lat, random_lon
 
 
+@profiled("setup.merge_graphs")
 def merge_graphs(graphs: dict[str, nx.MultiDiGraph]) -> nx.MultiDiGraph:
     graph_names = sorted(graphs.keys())
     merged_graph = graphs[graph_names[0]].copy()
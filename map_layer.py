@@ -0,0 +1,99 @@
+from weakref import WeakKeyDictionary
+
+import matplotlib as mpl
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+import networkx as nx
+import numpy as np
+
+from typing import Optional
+
+# Space around the nodes, as a fraction of the extent of the graph
+MAP_MARGIN = 0.05
+
+# Layers of the graphs drawn so far, dropped with their graphs
+_map_layers: "WeakKeyDictionary[nx.Graph, StreetMapLayer]" = WeakKeyDictionary()
+
+
+class StreetMapLayer:
+    """
+    Street network of a graph rasterized once into an image, so that drawing the map
+    only draws the image and the agents over it, instead of every node and edge again.
+
+    The image covers the whole figure, so it is drawn on axes covering the whole figure
+    (see `create_figure`) to keep its resolution.
+    """
+
+    def __init__(self, graph: nx.Graph, figsize: tuple[float, float] = None, dpi: Optional[float] = None):
+        self.figsize = figsize if figsize is not None else tuple(mpl.rcParams["figure.figsize"])
+        self.dpi = dpi if dpi is not None else mpl.rcParams["figure.dpi"]
+
+        self.node_ids = np.array(sorted(graph.nodes), dtype=np.int64)
+        self.xs = np.array([graph.nodes[node]["x"] for node in self.node_ids.tolist()], dtype=np.float64)
+        self.ys = np.array([graph.nodes[node]["y"] for node in self.node_ids.tolist()], dtype=np.float64)
+
+        edges = np.array(list(graph.edges()), dtype=np.int64).reshape(-1, 2)
+        start, end = self.node_indices(edges[:, 0]), self.node_indices(edges[:, 1])
+        self.segments = np.stack(
+            [np.column_stack([self.xs[start], self.ys[start]]), np.column_stack([self.xs[end], self.ys[end]])],
+            axis=1,
+        )
+
+        x_margin = MAP_MARGIN * (self.xs.max() - self.xs.min())
+        y_margin = MAP_MARGIN * (self.ys.max() - self.ys.min())
+        # left, right, bottom, top
+        self.extent = (
+            self.xs.min() - x_margin,
+            self.xs.max() + x_margin,
+            self.ys.min() - y_margin,
+            self.ys.max() + y_margin,
+        )
+        self.image = self.__rasterize()
+
+    def __rasterize(self) -> np.ndarray:
+        figure = Figure(figsize=self.figsize, dpi=self.dpi)
+        canvas = FigureCanvasAgg(figure)
+        ax = figure.add_axes((0, 0, 1, 1))
+        # Same style as `nx.draw` with black nodes of size 1
+        ax.add_collection(LineCollection(self.segments, colors="black", linewidths=1))
+        ax.scatter(self.xs, self.ys, s=1, c="black")
+        self.__set_limits(ax)
+        canvas.draw()
+        return np.asarray(canvas.buffer_rgba()).copy()
+
+    def __set_limits(self, ax: Axes) -> None:
+        ax.set_xlim(self.extent[0], self.extent[1])
+        ax.set_ylim(self.extent[2], self.extent[3])
+        ax.set_axis_off()
+
+    def node_indices(self, nodes) -> np.ndarray:
+        """Index of each node in `node_ids`, or -1 for the nodes that are not in the graph."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        indices = np.searchsorted(self.node_ids, nodes)
+        indices[indices == len(self.node_ids)] = 0
+        return np.where(self.node_ids[indices] == nodes, indices, -1)
+
+    def count_nodes(self, nodes) -> np.ndarray:
+        """Times each node of the graph appears in `nodes` (nodes not in the graph are ignored)."""
+        indices = self.node_indices(nodes)
+        return np.bincount(indices[indices >= 0], minlength=len(self.node_ids))
+
+    def create_figure(self) -> tuple[Figure, Axes]:
+        """Figure and axes to draw the map on (with `draw`)."""
+        figure = Figure(figsize=self.figsize, dpi=self.dpi)
+        ax = figure.add_axes((0, 0, 1, 1))
+        return figure, ax
+
+    def draw(self, ax: Axes) -> None:
+        ax.imshow(self.image, extent=self.extent, aspect="auto", interpolation="antialiased")
+        self.__set_limits(ax)
+
+
+def get_map_layer(graph: nx.Graph) -> StreetMapLayer:
+    """Map layer of a graph, rasterized the first time it is drawn."""
+    layer = _map_layers.get(graph)
+    if layer is None:
+        layer = _map_layers[graph] = StreetMapLayer(graph)
+    return layer
@@ -0,0 +1,138 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+from profiler import profiled
+
+COLLECT_EVERY_OPTIONS = ["step", "leg", "day"]
+
+
+class ColumnBuffer:
+    """Growable NumPy buffer of rows with a fixed width, with zero-copy access to the filled rows."""
+
+    def __init__(self, width: int, dtype=np.float64, initial_capacity: int = 256):
+        self.width = width
+        self.num_rows = 0
+        self._data = np.zeros((initial_capacity, width), dtype=dtype)
+
+    def append(self, row) -> None:
+        if self.num_rows == len(self._data):
+            grown = np.zeros((2 * len(self._data), self.width), dtype=self._data.dtype)
+            grown[: self.num_rows] = self._data
+            self._data = grown
+        self._data[self.num_rows] = row
+        self.num_rows += 1
+
+    @property
+    def values(self) -> np.ndarray:
+        """View (not a copy) of the filled rows."""
+        return self._data[: self.num_rows]
+
+    def view(self) -> "ColumnBuffer":
+        """Buffer with the rows filled so far, sharing their memory (rows are never changed once appended)."""
+        view = copy.copy(self)
+        view._data = self.values
+        return view
+
+
+class MetricsCollector:
+    """
+    Collects the model metrics into preallocated, growable NumPy columns.
+
+    Samples are taken every step, at the end of every leg, or at the end of every day (`every`).
+    Instead of the cost of every worker at every sample, only the mean and standard deviation
+    of the costs are stored, which is all the plots need, so memory does not grow with the workers.
+    """
+
+    def __init__(self, model, every: str = "step"):
+        if every not in COLLECT_EVERY_OPTIONS:
+            raise ValueError(f"Invalid collection cadence '{every}'")
+        self.every = every
+        self.policies: list[str] = list(model.policies)
+        self.num_companies: int = model.num_companies
+
+        self.steps = ColumnBuffer(1, dtype=np.int64)
+        self.times = ColumnBuffer(1)                # simulated time (hours), NaN without the event scheduler
+        self.co2_emissions = ColumnBuffer(2)      # car, electric_scooter
+        self.co2_avg_per_company = ColumnBuffer(self.num_companies)
+        self.co2_avg_per_company_type = ColumnBuffer(len(self.policies))
+        self.transport_costs = ColumnBuffer(2)    # mean, standard deviation
+
+    @property
+    def num_samples(self) -> int:
+        return self.steps.num_rows
+
+    def view(self) -> "MetricsCollector":
+        """Collector with the samples collected so far, without copying them. Later samples are not added to it."""
+        view = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, ColumnBuffer):
+                setattr(view, name, value.view())
+        return view
+
+    def should_collect(self, end_of_leg: bool, end_of_day: bool) -> bool:
+        if self.every == "step":
+            return True
+        if self.every == "leg":
+            return end_of_leg
+        return end_of_day
+
+    @profiled("collecting.collect")
+    def collect(self, model) -> None:
+        self.steps.append(model.steps)
+        self.times.append(model.time if model.time is not None else np.nan)
+
+        co2_emissions = model.calculate_CO2_emissions()
+        self.co2_emissions.append((co2_emissions["car"], co2_emissions["electric_scooter"]))
+        self.co2_avg_per_company.append(model.calculate_CO2_avg_per_company())
+
+        co2_per_company_type = model.calculate_CO2_avg_per_company_type()
+        self.co2_avg_per_company_type.append([co2_per_company_type[policy] for policy in self.policies])
+
+        costs = model.get_workers_transport_costs()
+        self.transport_costs.append((np.mean(costs), np.std(costs)))
+
+    def get_steps(self) -> np.ndarray:
+        return self.steps.values[:, 0]
+
+    def get_times(self) -> np.ndarray:
+        return self.times.values[:, 0]
+
+    def get_co2_emissions(self, transport: str) -> np.ndarray:
+        """CO2 emissions (g) of a transport at each sample (zero for transports that do not emit)."""
+        if transport == "car":
+            return self.co2_emissions.values[:, 0]
+        if transport == "electric_scooter":
+            return self.co2_emissions.values[:, 1]
+        return np.zeros(self.num_samples)
+
+    def get_total_co2_emissions(self) -> np.ndarray:
+        return self.co2_emissions.values.sum(axis=1)
+
+    def get_co2_avg_per_company(self) -> np.ndarray:
+        """Matrix with a row per sample and a column per company."""
+        return self.co2_avg_per_company.values
+
+    def get_co2_avg_per_company_type(self, policy: str) -> np.ndarray:
+        return self.co2_avg_per_company_type.values[:, self.policies.index(policy)]
+
+    def get_transport_costs_mean(self) -> np.ndarray:
+        return self.transport_costs.values[:, 0]
+
+    def get_transport_costs_std(self) -> np.ndarray:
+        return self.transport_costs.values[:, 1]
+
+    def get_model_vars_dataframe(self) -> pd.DataFrame:
+        """All the collected metrics as a (copied) DataFrame, indexed by model step."""
+        columns = {
+            "CO2_car": self.get_co2_emissions("car"),
+            "CO2_electric_scooter": self.get_co2_emissions("electric_scooter"),
+        }
+        for policy in self.policies:
+            columns[f"CO2_avg_{policy}"] = self.get_co2_avg_per_company_type(policy)
+        for company_index in range(self.num_companies):
+            columns[f"CO2_avg_company_{company_index}"] = self.get_co2_avg_per_company()[:, company_index]
+        columns["transport_costs_mean"] = self.get_transport_costs_mean()
+        columns["transport_costs_std"] = self.get_transport_costs_std()
+        return pd.DataFrame(columns, index=pd.Index(self.get_steps(), name="step"))
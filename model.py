@@ -1,7 +1,8 @@
+import copy
+
 from mesa import Model
 from mesa.time import RandomActivation
 from mesa.space import NetworkGrid
-from mesa.datacollection import DataCollector
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 import networkx as nx
@@ -11,7 +12,15 @@ from typing import Optional
 
 from worker_agent import WorkerAgent
 from company_agent import CompanyAgent, obtain_budget
-from graph_utils import random_position_within_bouding_box
+from graph_utils import random_position_within_bouding_box, get_closest_nodes, SnappedPosition
+from csr_graph import CSRGraph, build_routing_graphs
+from route_cache import RouteCache
+from path_pool import PathPool
+from transport_choice import TransportChooser, TRANSPORTS, TRANSPORT_INDEX
+from worker_state import WorkerStateStore
+from metrics import MetricsCollector
+from event_scheduler import EventScheduler, SCHEDULER_OPTIONS
+from profiler import profiled
 
 # Values are in grams per kms
 CAR_CO2_G_KM = 250     # Value of reference found here: https://nought.tech/blogs/journal/are-e-scooters-good-for-the-environment#blog
@@ -22,7 +31,77 @@ CAR_EURO_KM = 0.09          # cars with a consume cost of -> 5.0L/100km; 1L of g
 ESCOOTER_EURO_KM = 0.003     # 25km -> 225Wh ; 1 KWh -> 0.312
 DEFAULT_CO2_BUDGET_PER_EMPLOYEE = int(1e3)   # Per employee
 
-class SustainabilityModel(Model):
+class WorkerStateReporters:
+    """
+    Reporters computed from the worker state store alone.
+    Used by the model, and by models whose workers run elsewhere (see sharded_model.py).
+    Requires the `worker_state` and `policies` attributes.
+    """
+
+    def calculate_times_each_transport_was_used_total(self):
+        return {
+            "car": int(self.worker_state.uses_of("car").sum()),
+            "bike": int(self.worker_state.uses_of("bike").sum()),
+            "eletric_scooter": int(self.worker_state.uses_of("electric_scooter").sum()),
+            "walk": int(self.worker_state.uses_of("walk").sum()),
+        }
+
+    def calculate_times_each_transport_was_used_per_company_type(self):
+        final_dict = {}
+        for policy in self.policies:
+            policy_uses = self.worker_state.uses[self.get_policy_workers(policy)].sum(axis=0)
+            final_dict[policy] = {
+                transport: int(policy_uses[TRANSPORT_INDEX[transport]])
+                for transport in TRANSPORTS
+            }
+        return final_dict
+
+    def get_policy_workers(self, policy: str) -> slice:
+        """Range of `WorkerAgent.worker_index` of the workers of all companies with the policy."""
+        if policy not in self.policies:
+            return slice(0, 0)
+        return self.worker_state.policy_workers(self.policies.index(policy))
+
+    def get_workers_co2(self) -> np.ndarray:
+        """Total CO2 (g) of each worker, indexed by `WorkerAgent.worker_index`."""
+        return self.worker_state.co2[: self.worker_state.num_workers]
+
+    def get_workers_transport_costs(self) -> np.ndarray:
+        """Total transport costs (€) of each worker, indexed by `WorkerAgent.worker_index`."""
+        return self.worker_state.costs[: self.worker_state.num_workers]
+
+    def get_companies_co2(self) -> np.ndarray:
+        """Total CO2 (g) of the workers of each company, indexed by `CompanyAgent.company_index`."""
+        return self.worker_state.company_co2
+
+    def calculate_CO2_emissions(self):
+        return {
+            "car": float(self.worker_state.transport_co2[TRANSPORT_INDEX["car"]]),
+            "electric_scooter": float(self.worker_state.transport_co2[TRANSPORT_INDEX["electric_scooter"]]),
+        }
+
+    def calculate_CO2_avg_per_company(self):
+        return [
+            co2 / count if count != 0 else 0
+            for co2, count in zip(
+                self.worker_state.company_co2.tolist(), self.worker_state.company_num_workers.tolist()
+            )
+        ]
+
+    def calculate_CO2_avg_per_company_type(self):
+        return {
+            policy: co2_sum / cnt_companies
+            for policy, co2_sum, cnt_companies in zip(
+                self.policies, self.worker_state.policy_co2.tolist(), self.worker_state.policy_num_companies.tolist()
+            )
+        }
+
+    def calculate_transport_costs(self):
+        return self.get_workers_transport_costs().tolist()
+
+
+class SustainabilityModel(WorkerStateReporters, Model):
+    @profiled("setup.model_init")
     def __init__(
         self,
         num_workers_per_company: int = 10,
@@ -34,58 +113,173 @@ class SustainabilityModel(Model):
         agent_home_radius: int = 5000,
         company_budget_per_employee: int = DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
         seed: Optional[int] = None,
+        routing_graphs: Optional[dict[str, CSRGraph]] = None,
+        route_cache: Optional[RouteCache] = None,
+        fast_forward: bool = False,
+        transport_choice: str = "vectorized",
+        collect_every: str = "step",
+        company_range: Optional[tuple[int, int]] = None,
+        scheduler: str = "random",
+        lazy_paths: bool = False,
     ):
         """
         Initialize the sustainability model with workers and companies.
+
+        With `fast_forward`, each step applies a whole leg (all workers going to work, or back home)
+        at once, instead of moving the workers one node per step. The results are the same,
+        but positions are only updated at the end of each leg.
+
+        `transport_choice` is "vectorized" (all workers' transports sampled at once with NumPy)
+        or "sequential" (one worker at a time, reproducing the original per-worker choices).
+
+        `collect_every` sets when the metrics are collected: every "step", at the end of every "leg"
+        or at the end of every "day". With `fast_forward`, "step" and "leg" are the same.
+
+        With `company_range` (start, stop), only the companies with those indices and their workers
+        are created (see sharded_model.py). The positions of all companies and workers are still drawn,
+        and the transport choices sampled, so they are the same as in the model with all companies.
+
+        `scheduler` is "random" (every step, all moving workers advance one node) or "event"
+        (workers move at the speed of their transport, and each step is a slice of simulated time,
+        see event_scheduler.py). With the "event" scheduler, `time` is the simulated time in hours.
+
+        With `lazy_paths`, workers only keep the distances of their paths to choose a transport.
+        The paths of the chosen transport are built when it is chosen, shared by the workers on the
+        same route, and dropped once no worker is on them (see path_pool.py). The results are the same.
         """
         super().__init__(seed=seed)
-        self.num_companies = sum(company_cnt for company_cnt in companies.values())
-        if self.num_companies == 0:
+        if scheduler not in SCHEDULER_OPTIONS:
+            raise ValueError(f"Invalid scheduler '{scheduler}'")
+        if fast_forward and scheduler == "event":
+            raise ValueError("The event scheduler can not fast forward the legs")
+        self.fast_forward = fast_forward
+
+        # Separate random stream for the transport choices, so that they do not depend on
+        # how many times the scheduler shuffled the agents (which differs with fast_forward)
+        transport_seed = self.random.getrandbits(64)
+
+        company_policies = [
+            company_policy
+            for company_policy, company_count in companies.items()
+            for _ in range(company_count)
+        ]
+        if len(company_policies) == 0:
             raise ValueError("There must be at least one company")
+        self.company_range = company_range if company_range is not None else (0, len(company_policies))
+        if not 0 <= self.company_range[0] < self.company_range[1] <= len(company_policies):
+            raise ValueError(f"Invalid range of companies {self.company_range}")
+        self.num_companies = self.company_range[1] - self.company_range[0]
         print(f"Init model with {num_workers_per_company} workers per company, with a total of {self.num_companies} companies")
 
         self.num_workers_per_company = num_workers_per_company
         self.num_agents = self.num_workers_per_company * self.num_companies + self.num_companies
+        num_workers = self.num_workers_per_company * self.num_companies
+        self.policies = list(dict.fromkeys(company_policies[self.company_range[0] : self.company_range[1]]))
+        self.worker_state = WorkerStateStore(
+            num_workers,
+            self.num_companies,
+            len(self.policies),
+            co2_per_km={"car": CAR_CO2_G_KM, "electric_scooter": ESCOOTER_CO2_G_KM},
+            cost_per_km={"car": CAR_EURO_KM, "electric_scooter": ESCOOTER_EURO_KM},
+        )
+        self.transport_chooser = TransportChooser(
+            self.worker_state.sustainability_factors, transport_seed, transport_choice,
+            sample_offset=self.company_range[0] * num_workers_per_company,
+            num_samples=len(company_policies) * num_workers_per_company,
+        )
 
         self.company_budget_per_employee = company_budget_per_employee
         self.base_company_budget = self.company_budget_per_employee * self.num_workers_per_company
 
         self.graphs = graphs
+        # Array-backed copies of the graphs, used for routing and distances.
+        # They can be passed in to avoid rebuilding them for every model instance.
+        self.routing_graphs: dict[str, CSRGraph] = (
+            routing_graphs if routing_graphs is not None else build_routing_graphs(graphs)
+        )
+        # Optional persistent store of routes, shared across model instances
+        self.route_cache = route_cache
+        # Paths of the chosen transports, with `lazy_paths`
+        self.path_pool: Optional[PathPool] = PathPool() if lazy_paths else None
         self.grid = NetworkGrid(merged_graph)
 
         # Use one of the graphs for company location visualization
         self.visualization_graph_type = sorted(self.graphs.keys())[0]
 
         self.schedule = RandomActivation(self)
-        self.data_collector = DataCollector(
-            model_reporters={
-                "CO2_emissions": self.calculate_CO2_emissions, 
-                "CO2_avg_per_company": self.calculate_CO2_avg_per_company,
-                "CO2_avg_per_company_type": self.calculate_CO2_avg_per_company_type,
-                "transport_costs": self.calculate_transport_costs,
-            },
-        )
+        self.event_scheduler: Optional[EventScheduler] = EventScheduler(self) if scheduler == "event" else None
+        self.time: Optional[float] = 0.0 if self.event_scheduler is not None else None
+        self.data_collector = MetricsCollector(self, every=collect_every)
         self.new_day_steps: list[int] = []
+        self.new_day_times: list[float] = []
 
-        self.company_agents: list[CompanyAgent] = self.__init_companies(center_position, companies, company_location_radius)
-        self.worker_agents: list[WorkerAgent] = self.__init_agents(center_position, agent_home_radius)
+        self.company_agents: list[CompanyAgent] = self.__init_companies(center_position, company_policies, company_location_radius)
+        self.worker_agents: list[WorkerAgent] = self.__init_agents(center_position, len(company_policies), agent_home_radius)
+        for agent, transport_chosen in zip(self.worker_agents, self.transport_chooser.choose()):
+            agent.set_transport_chosen(transport_chosen)
+        if self.route_cache is not None:
+            self.route_cache.flush()
 
         self.path_switches = 0
+        if self.event_scheduler is not None:
+            self.event_scheduler.start_leg(
+                self.worker_agents, EventScheduler.get_departure_time(self.path_switches, self.time)
+            )
+        # Workers that arrived at the end of the current leg are taken out of the schedule
+        # until the next leg, so that each step only activates the workers still moving
+        self.num_arrived_workers = 0
         self.finished = False
 
-    def __init_companies(self, center_position: tuple[float, float], companies: dict[str, int], possible_radius: int):
-        for company_policy, company_count in companies.items():
-            for _ in range(company_count):
-                position = random_position_within_bouding_box(self.random, center_position, bbox_distance_meters=possible_radius)
-                company = CompanyAgent(self, company_policy, position, self.base_company_budget)
-                self.schedule.add(company)
+    def __snap_positions(self, positions: list[tuple[float, float]]) -> list[dict[str, SnappedPosition]]:
+        """Closest node of each graph to each position, with one batched query per graph."""
+        snaps_per_graph = {
+            type: get_closest_nodes(routing_graph, positions)
+            for type, routing_graph in self.routing_graphs.items()
+        }
+        return [
+            {type: snaps[i] for type, snaps in snaps_per_graph.items()}
+            for i in range(len(positions))
+        ]
+
+    def __init_companies(self, center_position: tuple[float, float], company_policies: list[str], possible_radius: int):
+        positions = [
+            random_position_within_bouding_box(self.random, center_position, bbox_distance_meters=possible_radius)
+            for _ in company_policies
+        ]
+        start, stop = self.company_range
+        company_policies = company_policies[start:stop]
+        positions = positions[start:stop]
+        all_snaps = self.__snap_positions(positions)
+        for company_policy, position, snaps in zip(company_policies, positions, all_snaps):
+            company_index = self.worker_state.add_company(self.policies.index(company_policy))
+            company = CompanyAgent(self, company_policy, position, self.base_company_budget, snaps, company_index)
+            self.schedule.add(company)
         return self.schedule.agents[: self.num_companies]
 
-    def __init_agents(self, center_position: tuple[float, float], possible_radius):
+    def __init_agents(self, center_position: tuple[float, float], total_num_companies: int, possible_radius):
+        # Home positions are all generated first so that they can be snapped to the graphs at once
+        positions = [
+            random_position_within_bouding_box(self.random, center_position, bbox_distance_meters=possible_radius)
+            for _ in range(self.num_workers_per_company * total_num_companies)
+        ]
+        start, stop = self.company_range
+        positions = positions[start * self.num_workers_per_company : stop * self.num_workers_per_company]
+        home_snaps = iter(self.__snap_positions(positions))
+        positions = iter(positions)
+
         for company in self.company_agents:
+            # All workers of a company share one end of their paths, so a single search
+            # from (and towards) the company gives the paths of all of them.
+            # The searches only run if some path is not in the route cache.
+            company_trees = {
+                type: {
+                    "to_work": routing_graph.shortest_path_tree(company.location_nodes[type], reverse=True),
+                    "to_home": routing_graph.shortest_path_tree(company.location_nodes[type]),
+                }
+                for type, routing_graph in self.routing_graphs.items()
+            }
             for _ in range(self.num_workers_per_company):
-                position = random_position_within_bouding_box(self.random, center_position, bbox_distance_meters=possible_radius)
-                worker = WorkerAgent(self, company, position)
+                worker = WorkerAgent(self, company, next(positions), next(home_snaps), company_trees)
                 company.add_worker(worker)
                 self.schedule.add(worker)
 
@@ -106,116 +300,110 @@ class SustainabilityModel(Model):
             final_dict[agent.transport_chosen] += 1
         return final_dict
 
-    def calculate_times_each_transport_was_used_total(self):
-        final_dict = {"car": 0, "bike": 0, "eletric_scooter": 0, "walk": 0}       
-        for agent in self.schedule.agents:
-            if isinstance(agent, WorkerAgent):
-                final_dict["car"] += agent.kms_car[0]
-                final_dict["bike"] += agent.kms_bycicle[0]
-                final_dict["eletric_scooter"] += agent.kms_electric_scooter[0]
-                final_dict["walk"] += agent.kms_walk[0]
-        return final_dict
-
-    def calculate_times_each_transport_was_used_per_company_type(self):
-        final_dict = {}
-        for company in self.company_agents:
-            policy = company.policy
-            final_dict[policy] = final_dict.get(policy, {})
-            final_dict[policy]["car"] = final_dict[policy].get("car", 0)
-            final_dict[policy]["bike"] = final_dict[policy].get("bike", 0)
-            final_dict[policy]["electric_scooter"] = final_dict[policy].get("electric_scooter", 0)
-            final_dict[policy]["walk"] = final_dict[policy].get("walk", 0)
-            for worker in company.workers:
-                final_dict[policy]["car"] += worker.kms_car[0]
-                final_dict[policy]["bike"] += worker.kms_bycicle[0]
-                final_dict[policy]["electric_scooter"] += worker.kms_electric_scooter[0]
-                final_dict[policy]["walk"] += worker.kms_walk[0]
-        return final_dict
+    def get_company_workers(self, company: CompanyAgent) -> slice:
+        """Range of `WorkerAgent.worker_index` of the workers of the company."""
+        return self.worker_state.company_workers(company.company_index)
 
     def get_total_co2(self, agent: WorkerAgent) -> float:
-        return agent.kms_car[1] * CAR_CO2_G_KM + agent.kms_electric_scooter[1] * ESCOOTER_CO2_G_KM
+        return float(self.worker_state.co2[agent.worker_index])
 
-    def calculate_CO2_emissions(self):
-        CO2_kms_car = 0
-        CO2_kms_e_scooter = 0
-        for agent in self.worker_agents:
-            CO2_kms_car += agent.kms_car[1] * CAR_CO2_G_KM
-            CO2_kms_e_scooter += agent.kms_electric_scooter[1] * ESCOOTER_CO2_G_KM
+    def calculate_transport_costs_for_company(self, company):
+        return self.get_workers_transport_costs()[self.get_company_workers(company)].tolist()
 
-        return {
-            "car": CO2_kms_car,
-            "electric_scooter": CO2_kms_e_scooter,
-        }
+    @profiled("stepping.model_step")
+    def step(self):
+        if self.fast_forward:
+            self.__fast_forward_step()
+            return
 
-    def calculate_CO2_avg_per_company(self):
-        companies_co2 = []
-        for company in self.company_agents:
-            company_co2 = 0
-            for agent in company.workers:
-                company_co2 += self.get_total_co2(agent)
-            company_co2_avg = company_co2 / len(company.workers) if len(company.workers) != 0 else 0
-            companies_co2.append(company_co2_avg)
-        return companies_co2
+        if self.event_scheduler is not None:
+            self.event_scheduler.step()
+        else:
+            self.schedule.step()
 
-    def calculate_CO2_avg_per_company_type(self):
-        companies_co2 = {}
-        for company in self.company_agents:
-            policy = company.policy
-            company_co2 = 0
-            for agent in company.workers:
-                company_co2 += self.get_total_co2(agent)
+        partial_finish = self.num_arrived_workers == len(self.worker_agents)
+        self.__collect(end_of_leg=partial_finish)
+        if partial_finish:
+            # Wait until all agents have arrived at their destination before
+            # making them go somewhere else (go back)
+            self.__finish_leg()
 
-            curr_sum, curr_cnt = companies_co2.get(policy, (0, 0))
-            companies_co2[policy] = (curr_sum + company_co2, curr_cnt + 1)
+    def __fast_forward_step(self):
+        # The whole leg is applied in one step, so every agent arrives at its destination
+        for agent in self.worker_agents:
+            agent.fast_forward_leg()
+
+        self.__collect(end_of_leg=True)
+        self.__finish_leg()
+
+    def __collect(self, end_of_leg: bool):
+        # The day ends when the workers arrive home (second leg of the day)
+        end_of_day = end_of_leg and self.path_switches % 2 == 1
+        if self.data_collector.should_collect(end_of_leg, end_of_day):
+            self.data_collector.collect(self)
+
+    def worker_arrived(self, agent: WorkerAgent):
+        """Called by a worker when it reaches the end of its current path."""
+        self.num_arrived_workers += 1
+        # Only the random scheduler steps the schedule, and only the workers still moving
+        if not self.fast_forward and self.event_scheduler is None:
+            self.schedule.remove(agent)
+
+    def __finish_leg(self):
+        self.path_switches += 1
+        self.num_arrived_workers = 0
+        if not self.fast_forward and self.event_scheduler is None:
+            for agent in self.worker_agents:
+                self.schedule.add(agent)
+        if self.path_switches % 2 == 0:
+            # Going back to work, so choose the transport of the new day
+            transports_chosen = self.transport_chooser.choose()
+        else:
+            transports_chosen = [None] * len(self.worker_agents)
+        for agent, transport_chosen in zip(self.worker_agents, transports_chosen):
+            agent.switch_path(transport_chosen)
+        if self.event_scheduler is not None:
+            self.event_scheduler.start_leg(
+                self.worker_agents, EventScheduler.get_departure_time(self.path_switches, self.time)
+            )
 
-        for policy, (co2_sum, cnt_companies) in companies_co2.items():
-            companies_co2[policy] = co2_sum / cnt_companies
-        return companies_co2
+        if self.path_switches % 2 == 0:
+            self.new_day_steps.append(self.steps)
+            if self.time is not None:
+                self.new_day_times.append(self.time)
+            for company in self.company_agents:
+                if company.policy != "policy0" and company.policy != "policy1":
+                    company.check_policies()
 
-    def calculate_transport_costs(self):
-        transport_costs = []
-        for agent in self.schedule.agents:
-            if isinstance(agent, WorkerAgent):
-                cost_car = agent.kms_car[1] * CAR_EURO_KM
-                cost_electric_scooter = agent.kms_electric_scooter[1] * ESCOOTER_EURO_KM
-                total_cost = cost_car + cost_electric_scooter 
-                transport_costs.append(total_cost)
-        return transport_costs
-    
-    def calculate_transport_costs_for_company(self,company):
-        cost_per_km_car = 0.09  # cars with a consume cost of -> 5.0L/100km; 1L of gasoline -> 1.70; VALOR EM EUROS
-        cost_per_km_electric_scooter = 0.003 # 25km -> 225Wh ; 1 KWh -> 0.312 ; VALOR EM EUROS  
-
-        transport_costs = []
-        for agent in self.schedule.agents:
-            if isinstance(agent, WorkerAgent) and agent.company == company:
-                cost_car = agent.kms_car[1] * cost_per_km_car
-                cost_electric_scooter = agent.kms_electric_scooter[1] * cost_per_km_electric_scooter
-                total_cost = cost_car + cost_electric_scooter 
-                transport_costs.append(total_cost)
-        return transport_costs
+            if len(self.new_day_steps) == 30:
+                self.finished = True
 
-    def step(self):
-        self.schedule.step()
-        self.data_collector.collect(self)
+class ModelSnapshot(WorkerStateReporters):
+    """
+    Everything the plot functions read from a model (`SustainabilityModel` or `ShardedSustainabilityModel`):
+    the collected metrics, the worker state and the days, without the agents and graphs.
+    Later steps of the model do not change it, so it can be plotted while the model runs.
+    """
 
-        partial_finish = all(agent.partial_finish for agent in self.worker_agents)
-        if partial_finish:
-            # Wait until all agents have arrived at their destination before
-            # making them go somewhere else (go back)
-            self.path_switches += 1
-            for agent in self.worker_agents:
-                agent.switch_path()
+    def __init__(self, model):
+        self.worker_state = copy.deepcopy(model.worker_state)
+        self.policies: list[str] = list(model.policies)
+        self.data_collector = model.data_collector.view()
+        self.steps: int = model.steps
+        self.time: Optional[float] = model.time
+        self.new_day_steps: list[int] = list(model.new_day_steps)
+        self.new_day_times: list[float] = list(getattr(model, "new_day_times", []))
+        self.finished: bool = model.finished
+        self.company_budget_per_employee = model.company_budget_per_employee
+        self.base_company_budget = model.base_company_budget
+        # Read from the agents, which are not kept
+        self._times_each_transport_was_used = model.calculate_times_each_transport_was_used()
 
-            if self.path_switches % 2 == 0:
-                self.new_day_steps.append(self.steps)
-                for company in self.company_agents:
-                    if company.policy != "policy0" and company.policy != "policy1":
-                        company.check_policies()
+    def calculate_times_each_transport_was_used(self):
+        return self._times_each_transport_was_used
 
-                if len(self.new_day_steps) == 30:
-                    self.finished = True
 
+@profiled("plotting.get_current_transport_usage_plot")
 def get_current_transport_usage_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
@@ -239,6 +427,7 @@ def get_current_transport_usage_plot(
     fig.tight_layout()
     return fig
 
+@profiled("plotting.get_total_transport_usage_plot")
 def get_total_transport_usage_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
@@ -262,6 +451,7 @@ def get_total_transport_usage_plot(
     fig.tight_layout()
     return fig
 
+@profiled("plotting.get_total_transport_usage_plot_per_company_type")
 def get_total_transport_usage_plot_per_company_type(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
@@ -293,23 +483,23 @@ def get_total_transport_usage_plot_per_company_type(
     return fig
 
 
+@profiled("plotting.get_co2_emissions_plot")
 def get_co2_emissions_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     set_title: bool = True,
 ) -> Figure:
     transports = ["car", "bike", "walk", "electric_scooter"]
-    co2_emissions = model.data_collector.get_model_vars_dataframe()["CO2_emissions"]
-    timesteps = co2_emissions.index
+    timesteps, _, _, time_label = _get_time_axis(model)
 
-    total_co2_emissions = co2_emissions.apply(lambda co2: sum(co2.values()))
+    total_co2_emissions = model.data_collector.get_total_co2_emissions()
 
     fig, ax = plt.subplots(figsize=figsize)
 
     for transport in transports:
         ax.plot(
             timesteps,
-            co2_emissions.apply(lambda co2: co2.get(transport, 0)),
+            model.data_collector.get_co2_emissions(transport),
             label=transport,
             linestyle="dashed",
         )
@@ -317,12 +507,26 @@ def get_co2_emissions_plot(
 
     if set_title:
         ax.set_title("Total Carbon Dioxide emissions over time")
-    ax.set_xlabel("Time Step")
+    ax.set_xlabel(time_label)
     ax.set_ylabel("Carbon Dioxide emissions (g)")
     ax.legend()
     fig.tight_layout()
     return fig
 
+def _get_time_axis(model: SustainabilityModel) -> tuple[np.ndarray, list[float], float, str]:
+    """
+    X coordinates of the collected samples, of the start of each day and of the current time, and their label.
+    They are the simulated days with the event scheduler, and the model steps otherwise.
+    """
+    if model.time is None:
+        return model.data_collector.get_steps(), model.new_day_steps, model.steps, "Time Step"
+    return (
+        model.data_collector.get_times() / 24,
+        [time / 24 for time in model.new_day_times],
+        model.time / 24,
+        "Day",
+    )
+
 def _get_budget_plot_line_points(
     new_day_steps: list[int], curr_day_step, budget_per_day: float,
 ) -> tuple[list[int], list[float]]:
@@ -343,19 +547,17 @@ def _get_budget_plot_line_points(
     return xl, yl
 
 
+@profiled("plotting.get_co2_budget_per_company_type_plot")
 def get_co2_budget_per_company_type_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     plot_budget_lines: bool = True,
     set_title: bool = True,
 ) -> Figure:
-    co2_emissions_per_company_type = model.data_collector \
-        .get_model_vars_dataframe()["CO2_avg_per_company_type"]
-
-    timesteps = co2_emissions_per_company_type.index
+    timesteps, new_day_xs, current_x, time_label = _get_time_axis(model)
     all_policies = (
-        list(co2_emissions_per_company_type.iat[0].keys())
-        if not co2_emissions_per_company_type.empty
+        list(model.data_collector.policies)
+        if model.data_collector.num_samples > 0
         else []
     )
 
@@ -375,7 +577,7 @@ def get_co2_budget_per_company_type_plot(
     policy_nr = 0
     for budget, policies in budgets.items():
         if plot_budget_lines:
-            budget_xs, budget_ys = _get_budget_plot_line_points(model.new_day_steps, model.steps, budget)
+            budget_xs, budget_ys = _get_budget_plot_line_points(new_day_xs, current_x, budget)
             ax.plot(
                 budget_xs, budget_ys,
                 linestyle="--", color=colors[policy_nr], drawstyle='steps-post',
@@ -383,9 +585,7 @@ def get_co2_budget_per_company_type_plot(
             )
 
         for policy in policies:
-            policy_co2_emissions = co2_emissions_per_company_type.apply(
-                lambda co2: co2[policy]
-            )
+            policy_co2_emissions = model.data_collector.get_co2_avg_per_company_type(policy)
             ax.plot(
                 timesteps,
                 policy_co2_emissions,
@@ -396,30 +596,31 @@ def get_co2_budget_per_company_type_plot(
 
     if set_title:
         ax.set_title("Carbon Dioxide emissions per company type over time")
-    ax.set_xlabel("Time Step")
+    ax.set_xlabel(time_label)
     ax.set_ylabel("Carbon Dioxide emissions per company type (g)")
     ax.legend()
     fig.tight_layout()
     return fig
 
 
+@profiled("plotting.get_co2_budget_plot")
 def get_co2_budget_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     set_title: bool = True,
 ) -> Figure:
     budget = model.company_budget_per_employee
-    co2_avgs = model.data_collector.get_model_vars_dataframe()["CO2_avg_per_company"]
-    timesteps = co2_avgs.index
-    co2_mean = co2_avgs.apply(np.mean)
-    co2_std = co2_avgs.apply(np.std)
+    co2_avgs = model.data_collector.get_co2_avg_per_company()
+    timesteps, new_day_xs, current_x, time_label = _get_time_axis(model)
+    co2_mean = co2_avgs.mean(axis=1)
+    co2_std = co2_avgs.std(axis=1)
 
     fig, ax = plt.subplots(figsize=figsize)
 
     ax.plot(timesteps, co2_mean, label="Mean of CO2 emissions", color="blue")
     ax.fill_between(timesteps, co2_mean - co2_std, co2_mean + co2_std, color="blue", alpha=0.2, label="Standard deviation of CO2 emissions")
 
-    budget_xs, budget_ys = _get_budget_plot_line_points(model.new_day_steps, model.steps, budget)
+    budget_xs, budget_ys = _get_budget_plot_line_points(new_day_xs, current_x, budget)
     ax.plot(
         budget_xs, budget_ys,
         linestyle="--", color="red", drawstyle='steps-post',
@@ -428,21 +629,21 @@ def get_co2_budget_plot(
 
     if set_title:
         ax.set_title("Carbon Dioxide emissions per employee over time")
-    ax.set_xlabel("Time Step")
+    ax.set_xlabel(time_label)
     ax.set_ylabel("Carbon Dioxide emissions per employee (g)")
     ax.legend()
     fig.tight_layout()
     return fig
 
+@profiled("plotting.get_transport_costs_plot")
 def get_transport_costs_plot(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     set_title: bool = True,
 ) -> Figure:
-    transport_costs = model.data_collector.get_model_vars_dataframe()["transport_costs"]
-    timesteps = transport_costs.index
-    cost_mean = transport_costs.apply(np.mean)
-    cost_std = transport_costs.apply(np.std)
+    timesteps, _, _, time_label = _get_time_axis(model)
+    cost_mean = model.data_collector.get_transport_costs_mean()
+    cost_std = model.data_collector.get_transport_costs_std()
 
     fig, ax = plt.subplots(figsize=figsize)
 
@@ -451,22 +652,21 @@ def get_transport_costs_plot(
 
     if set_title:
         ax.set_title("Transport costs per employee over time")
-    ax.set_xlabel("Time Step")
+    ax.set_xlabel(time_label)
     ax.set_ylabel("Transport costs per employee (€)")
     ax.legend()
     fig.tight_layout()
     return fig
 
+@profiled("plotting.get_emissions_plot_company_comparison")
 def get_emissions_plot_company_comparison(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     set_title: bool = True,
 ) -> Figure:
-    sustainable_companies = [company for company in model.company_agents if company.policy in ["policy1"]]
-    non_sustainable_companies = [company for company in model.company_agents if company.policy in ["policy0"]]
-
-    sustainable_emissions = np.mean([model.get_total_co2(agent) for company in sustainable_companies for agent in company.workers])
-    non_sustainable_emissions = np.mean([model.get_total_co2(agent) for company in non_sustainable_companies for agent in company.workers])
+    workers_co2 = model.get_workers_co2()
+    sustainable_emissions = np.mean(workers_co2[model.get_policy_workers("policy1")])
+    non_sustainable_emissions = np.mean(workers_co2[model.get_policy_workers("policy0")])
 
     fig, ax = plt.subplots(figsize=figsize)
     ax.bar(["Sustainable", "Non-Sustainable"], [sustainable_emissions, non_sustainable_emissions])
@@ -477,16 +677,15 @@ def get_emissions_plot_company_comparison(
     fig.tight_layout()
     return fig
 
+@profiled("plotting.get_costs_plot_company_comparison")
 def get_costs_plot_company_comparison(
     model: SustainabilityModel,
     figsize: Optional[tuple[float, float]] = None,
     set_title: bool = True,
 ) -> Figure:
-    sustainable_companies = [company for company in model.company_agents if company.policy in ["policy1"]]
-    non_sustainable_companies = [company for company in model.company_agents if company.policy in ["policy0"]]
-
-    sustainable_costs = np.mean([model.calculate_transport_costs_for_company(company) for company in sustainable_companies])
-    non_sustainable_costs = np.mean([model.calculate_transport_costs_for_company(company) for company in non_sustainable_companies])
+    workers_costs = model.get_workers_transport_costs()
+    sustainable_costs = np.mean(workers_costs[model.get_policy_workers("policy1")])
+    non_sustainable_costs = np.mean(workers_costs[model.get_policy_workers("policy0")])
 
     fig, ax = plt.subplots(figsize=figsize)
     ax.bar(["Sustainable", "Non-Sustainable"], [sustainable_costs, non_sustainable_costs])
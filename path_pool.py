@@ -0,0 +1,70 @@
+from weakref import WeakValueDictionary
+
+from typing import Optional
+
+from csr_graph import CSRGraph, ShortestPathTree
+from route_cache import RouteCache
+
+
+class PooledPath(list):
+    """Node path of a route, which (unlike a plain list) can be referenced weakly by the pool."""
+
+
+class PathPool:
+    """
+    Node paths of the routes the workers are taking, built on demand and shared by all the workers
+    (and models) on the same route.
+
+    The pool only references the paths weakly, so a path is dropped as soon as no worker
+    holds it (e.g., when its workers choose a transport on another graph), and built again when needed.
+    """
+
+    def __init__(self):
+        self._paths: "WeakValueDictionary[tuple[str, int, int], PooledPath]" = WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __getstate__(self) -> dict:
+        # Paths are weakly referenced, so they are not saved (the pool is filled again as they are used)
+        return {"hits": self.hits, "misses": self.misses}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.__dict__.update(state)
+
+    def get(
+        self,
+        routing_graph: CSRGraph,
+        source_node: int,
+        target_node: int,
+        shortest_path_tree: Optional[ShortestPathTree] = None,
+        route_cache: Optional[RouteCache] = None,
+    ) -> PooledPath:
+        """
+        Shortest path between two nodes, from the pool if some worker holds it.
+        Otherwise, it is read from the route cache, or the shortest path tree (rooted at one of the nodes),
+        or found with a new search, in this order, as in `get_path_information`.
+        """
+        key = (routing_graph.fingerprint, source_node, target_node)
+        path = self._paths.get(key)
+        if path is not None:
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        cached_route = (
+            route_cache.get(routing_graph.fingerprint, source_node, target_node)
+            if route_cache is not None
+            else None
+        )
+        if cached_route is not None:
+            nodes = cached_route[0]
+        elif shortest_path_tree is not None:
+            nodes = shortest_path_tree.path(source_node, target_node)
+        else:
+            nodes = routing_graph.shortest_path(source_node, target_node)
+        path = self._paths[key] = PooledPath(nodes)
+        return path
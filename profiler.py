@@ -0,0 +1,163 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_PROFILE_OUTPUT = "profile.json"
+
+
+class PhaseStats:
+    """Calls, time (seconds) and net allocated memory (bytes) of a phase, with and without its sub-phases."""
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.total_allocated = 0
+        self.self_allocated = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_time": self.total_time,
+            "self_time": self.self_time,
+            "total_allocated": self.total_allocated,
+            "self_allocated": self.self_allocated,
+        }
+
+
+class Profiler:
+    """
+    Records the calls, time and allocations of the instrumented phases of a run.
+
+    Phases are named "<category>.<name>" (e.g., "routing.get_path_information"), and are instrumented
+    with the `profiled` decorator or the `phase` context manager. When the profiler is disabled (the default),
+    they only cost an attribute check. Phases can be nested: the "self" time and allocations of a phase
+    exclude those of the phases run inside it, so they add up to the totals of the run.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.track_allocations = False
+        self.stats: dict[str, PhaseStats] = {}
+        # Time and allocations of the sub-phases of each running phase
+        self._stack: list[list] = []
+
+    def enable(self, track_allocations: bool = True) -> None:
+        """Start recording. Tracking allocations (with tracemalloc) slows down the run."""
+        self.enabled = True
+        self.track_allocations = track_allocations
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.track_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self) -> None:
+        self.stats = {}
+        self._stack = []
+
+    def _start(self) -> tuple[float, int]:
+        self._stack.append([0.0, 0])
+        allocated = tracemalloc.get_traced_memory()[0] if self.track_allocations else 0
+        return time.perf_counter(), allocated
+
+    def _stop(self, name: str, start: tuple[float, int]) -> None:
+        elapsed = time.perf_counter() - start[0]
+        allocated = tracemalloc.get_traced_memory()[0] - start[1] if self.track_allocations else 0
+        children_time, children_allocated = self._stack.pop()
+
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = PhaseStats()
+        stats.calls += 1
+        stats.total_time += elapsed
+        stats.self_time += elapsed - children_time
+        stats.total_allocated += allocated
+        stats.self_allocated += allocated - children_allocated
+
+        if self._stack:
+            self._stack[-1][0] += elapsed
+            self._stack[-1][1] += allocated
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = self._start()
+        try:
+            yield
+        finally:
+            self._stop(name, start)
+
+    def profiled(self, name: str):
+        """Decorator recording every call of a function as the phase `name`."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = self._start()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._stop(name, start)
+            return wrapper
+        return decorator
+
+    def get_categories(self) -> dict[str, PhaseStats]:
+        """Self time and allocations added up per category (the part of the phase names before the first dot)."""
+        categories: dict[str, PhaseStats] = {}
+        for name, stats in self.stats.items():
+            category = categories.setdefault(name.split(".")[0], PhaseStats())
+            category.calls += stats.calls
+            category.self_time += stats.self_time
+            category.self_allocated += stats.self_allocated
+        for category in categories.values():
+            category.total_time = category.self_time
+            category.total_allocated = category.self_allocated
+        return categories
+
+    def to_dict(self) -> dict:
+        return {
+            "track_allocations": self.track_allocations,
+            "categories": {name: stats.to_dict() for name, stats in self.get_categories().items()},
+            "phases": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+    def dump_json(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def report(self) -> str:
+        """Table of the categories and phases, sorted by time."""
+        categories = self.get_categories()
+        profiled_time = sum(stats.self_time for stats in categories.values()) or 1.0
+
+        def mb(allocated: int) -> str:
+            return f"{allocated / 2**20:.1f}" if self.track_allocations else "-"
+
+        lines = [f"{'Category':<40} {'calls':>10} {'self s':>10} {'%':>6} {'self MB':>9}"]
+        for name, stats in sorted(categories.items(), key=lambda item: -item[1].self_time):
+            lines.append(
+                f"{name:<40} {stats.calls:>10} {stats.self_time:>10.3f} "
+                f"{100 * stats.self_time / profiled_time:>6.1f} {mb(stats.self_allocated):>9}"
+            )
+        lines.append("")
+        lines.append(f"{'Phase':<40} {'calls':>10} {'total s':>10} {'self s':>10} {'total MB':>9} {'self MB':>9}")
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total_time):
+            lines.append(
+                f"{name:<40} {stats.calls:>10} {stats.total_time:>10.3f} {stats.self_time:>10.3f} "
+                f"{mb(stats.total_allocated):>9} {mb(stats.self_allocated):>9}"
+            )
+        return "\n".join(lines)
+
+
+# Profiler of the process, used by the instrumented functions
+PROFILER = Profiler()
+profiled = PROFILER.profiled
+profile_phase = PROFILER.phase
@@ -0,0 +1,304 @@
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import numpy as np
+from scipy.stats import t as student_t
+
+from typing import Optional
+
+from company_agent import obtain_budget
+from graph_utils import DEFAULT_GRAPH_CACHE_DIR
+from route_cache import DEFAULT_ROUTE_CACHE_PATH
+from model import SustainabilityModel
+from sweep import create_pool, run_model
+
+# Series compared against the target width of the confidence interval, for early stopping
+DEFAULT_STOP_SERIES = "co2_total"
+
+
+class RunningStatistics:
+    """Running mean and variance of arrays (element-wise), updated one sample at a time (Welford's algorithm)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean: Optional[np.ndarray] = None
+        self._m2: Optional[np.ndarray] = None
+
+    def update(self, values) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        if self.count == 0:
+            self.mean = np.zeros_like(values)
+            self._m2 = np.zeros_like(values)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance (zero until there are two samples)."""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    def confidence_interval_half_width(self, confidence: float = 0.95) -> np.ndarray:
+        """Half width of the Student's t confidence interval of the mean (infinite until there are two samples)."""
+        if self.count < 2:
+            return np.full_like(self.mean, np.inf)
+        quantile = student_t.ppf((1 + confidence) / 2, self.count - 1)
+        return quantile * self.std / np.sqrt(self.count)
+
+
+def get_replicate_series(model: SustainabilityModel) -> dict[str, np.ndarray]:
+    """Daily series of a finished run (collected at the end of every day) that are aggregated across replicates."""
+    collector = model.data_collector
+    series = {
+        "co2_car": collector.get_co2_emissions("car"),
+        "co2_electric_scooter": collector.get_co2_emissions("electric_scooter"),
+        "co2_total": collector.get_total_co2_emissions(),
+        "co2_avg_per_employee": collector.get_co2_avg_per_company().mean(axis=1),
+        "transport_costs_mean": collector.get_transport_costs_mean(),
+    }
+    for policy in collector.policies:
+        series[f"co2_avg_{policy}"] = collector.get_co2_avg_per_company_type(policy)
+    return series
+
+
+def _run_replicate(configuration: dict) -> dict[str, np.ndarray]:
+    return get_replicate_series(run_model(configuration))
+
+
+class ReplicateStatistics:
+    """
+    Statistics of the daily series across the replicates of a configuration,
+    aggregated as the replicates finish, without keeping the replicates themselves.
+    """
+
+    def __init__(self, configuration: dict, base_company_budget: float, confidence: float = 0.95):
+        self.configuration = configuration
+        self.policies = [
+            policy for policy, company_cnt in configuration["companies"].items() if company_cnt > 0
+        ]
+        self.company_budget_per_employee = configuration["company_budget_per_employee"]
+        self.base_company_budget = base_company_budget
+        self.confidence = confidence
+        self.seeds: list[int] = []
+        self.series: dict[str, RunningStatistics] = {}
+
+    @property
+    def num_replicates(self) -> int:
+        return len(self.seeds)
+
+    def update(self, seed: int, series: dict[str, np.ndarray]) -> None:
+        self.seeds.append(seed)
+        for name, values in series.items():
+            self.series.setdefault(name, RunningStatistics()).update(values)
+
+    def get_days(self) -> np.ndarray:
+        return np.arange(1, len(self.get_mean(DEFAULT_STOP_SERIES)) + 1)
+
+    def get_mean(self, name: str) -> np.ndarray:
+        return self.series[name].mean
+
+    def get_std(self, name: str) -> np.ndarray:
+        return self.series[name].std
+
+    def get_confidence_interval(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        mean = self.get_mean(name)
+        half_width = self.series[name].confidence_interval_half_width(self.confidence)
+        return mean - half_width, mean + half_width
+
+    def get_relative_ci_width(self, name: str = DEFAULT_STOP_SERIES) -> float:
+        """Largest width of the confidence interval over the days, relative to the mean."""
+        mean = np.abs(self.get_mean(name))
+        width = 2 * self.series[name].confidence_interval_half_width(self.confidence)
+        nonzero = mean > 0
+        if not np.any(nonzero):
+            return 0.0
+        return float(np.max(width[nonzero] / mean[nonzero]))
+
+
+def run_replicates(
+    num_workers_per_company: int,
+    companies: dict[str, int],
+    company_budget_per_employee: float,
+    max_replicates: int,
+    processes: int,
+    base_seed: int = 42,
+    min_replicates: int = 3,
+    target_ci_width: Optional[float] = None,
+    confidence: float = 0.95,
+    stop_series: str = DEFAULT_STOP_SERIES,
+    graph_cache_dir: str = DEFAULT_GRAPH_CACHE_DIR,
+    offline: bool = False,
+    route_cache_path: Optional[str] = DEFAULT_ROUTE_CACHE_PATH,
+    fast_forward: bool = False,
+    transport_choice: str = "vectorized",
+    scheduler: str = "random",
+    lazy_paths: bool = False,
+) -> ReplicateStatistics:
+    """
+    Run the configuration with the seeds `base_seed`, `base_seed + 1`, ... on a pool of processes,
+    aggregating the daily series of each replicate as it finishes.
+
+    With `target_ci_width`, stops early (after at least `min_replicates`) once the confidence interval
+    of `stop_series` is narrower than that fraction of its mean on every day.
+    Replicates are aggregated in order of seed, so the same replicates are used on every run.
+    """
+    options = {
+        "fast_forward": fast_forward,
+        "transport_choice": transport_choice,
+        "scheduler": scheduler,
+        "lazy_paths": lazy_paths,
+        # Days are aligned across replicates, while steps are not
+        "collect_every": "day",
+    }
+    configurations = [
+        {
+            **companies,
+            "num_workers_per_company": num_workers_per_company,
+            "company_budget_per_employee": company_budget_per_employee,
+            "seed": base_seed + replicate,
+        }
+        for replicate in range(max_replicates)
+    ]
+    statistics = ReplicateStatistics(
+        {
+            "companies": companies,
+            "num_workers_per_company": num_workers_per_company,
+            "company_budget_per_employee": company_budget_per_employee,
+        },
+        base_company_budget=company_budget_per_employee * num_workers_per_company,
+        confidence=confidence,
+    )
+
+    # Leaving the pool terminates the replicates still running after an early stop
+    with create_pool(processes, graph_cache_dir, offline, route_cache_path, options) as pool:
+        for configuration, series in zip(configurations, pool.imap(_run_replicate, configurations)):
+            statistics.update(configuration["seed"], series)
+            ci_width = statistics.get_relative_ci_width(stop_series)
+            print(f"Finished replicate {statistics.num_replicates}/{max_replicates} (seed {configuration['seed']}), "
+                  f"relative CI width of {stop_series}: {ci_width:.4f}")
+            if (
+                target_ci_width is not None
+                and statistics.num_replicates >= min_replicates
+                and ci_width <= target_ci_width
+            ):
+                print(f"Stopping after {statistics.num_replicates} replicates")
+                break
+
+    return statistics
+
+
+def _plot_band(ax, statistics: ReplicateStatistics, name: str, label: str, color: str) -> None:
+    days = statistics.get_days()
+    low, high = statistics.get_confidence_interval(name)
+    ax.plot(days, statistics.get_mean(name), label=label, color=color)
+    ax.fill_between(days, low, high, color=color, alpha=0.2)
+
+
+def _plot_budget_line(ax, statistics: ReplicateStatistics, budget_per_day: float, label: str, color: str) -> None:
+    # Same budget lines as in the single run plots, with days instead of steps
+    days = np.arange(0, len(statistics.get_days()) + 1)
+    ax.plot(days, budget_per_day * (days + 1), linestyle="--", color=color, drawstyle="steps-post", label=label)
+
+
+def _get_band_title(statistics: ReplicateStatistics) -> str:
+    return f"{statistics.num_replicates} replicates, {statistics.confidence:.0%} CI"
+
+
+def get_co2_emissions_band_plot(
+    statistics: ReplicateStatistics,
+    figsize: Optional[tuple[float, float]] = None,
+    set_title: bool = True,
+) -> Figure:
+    fig, ax = plt.subplots(figsize=figsize)
+
+    _plot_band(ax, statistics, "co2_car", "car", "tab:blue")
+    _plot_band(ax, statistics, "co2_electric_scooter", "electric_scooter", "tab:orange")
+    _plot_band(ax, statistics, "co2_total", "Total", "tab:green")
+
+    if set_title:
+        ax.set_title(f"Total Carbon Dioxide emissions over time ({_get_band_title(statistics)})")
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Carbon Dioxide emissions (g)")
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def get_co2_budget_band_plot(
+    statistics: ReplicateStatistics,
+    figsize: Optional[tuple[float, float]] = None,
+    set_title: bool = True,
+) -> Figure:
+    fig, ax = plt.subplots(figsize=figsize)
+
+    _plot_band(ax, statistics, "co2_avg_per_employee", "Mean of CO2 emissions", "blue")
+    _plot_budget_line(ax, statistics, statistics.company_budget_per_employee, "Base Budget Per Employee", "red")
+
+    if set_title:
+        ax.set_title(f"Carbon Dioxide emissions per employee over time ({_get_band_title(statistics)})")
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Carbon Dioxide emissions per employee (g)")
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def get_co2_budget_per_company_type_band_plot(
+    statistics: ReplicateStatistics,
+    figsize: Optional[tuple[float, float]] = None,
+    plot_budget_lines: bool = True,
+    set_title: bool = True,
+) -> Figure:
+    colors = ["green", "red", "blue", "purple", "orange"]
+    if len(statistics.policies) > len(colors):
+        raise NotImplementedError(
+            "Add a new color for the additional policy (company type)"
+        )
+
+    budgets = {}
+    for policy in statistics.policies:
+        budget = obtain_budget(policy, statistics.base_company_budget)
+        budgets[budget] = budgets.get(budget, [])
+        budgets[budget].append(policy)
+
+    fig, ax = plt.subplots(figsize=figsize)
+    policy_nr = 0
+    for budget, policies in budgets.items():
+        if plot_budget_lines:
+            _plot_budget_line(ax, statistics, budget, "Budget for " + ", ".join(policies), colors[policy_nr])
+
+        for policy in policies:
+            _plot_band(ax, statistics, f"co2_avg_{policy}", policy, colors[policy_nr])
+            policy_nr += 1
+
+    if set_title:
+        ax.set_title(f"Carbon Dioxide emissions per company type over time ({_get_band_title(statistics)})")
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Carbon Dioxide emissions per company type (g)")
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def get_transport_costs_band_plot(
+    statistics: ReplicateStatistics,
+    figsize: Optional[tuple[float, float]] = None,
+    set_title: bool = True,
+) -> Figure:
+    fig, ax = plt.subplots(figsize=figsize)
+
+    _plot_band(ax, statistics, "transport_costs_mean", "Mean of transport costs", "blue")
+
+    if set_title:
+        ax.set_title(f"Transport costs per employee over time ({_get_band_title(statistics)})")
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Transport costs per employee (€)")
+    ax.legend()
+    fig.tight_layout()
+    return fig
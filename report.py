@@ -0,0 +1,80 @@
+"""
+Renders the plots of a finished run to image files, without a display.
+
+The plots only read a snapshot of the results (`ModelSnapshot`), which is small and is taken once,
+so they can be rendered in parallel, by processes that inherit it, instead of one after another.
+"""
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from typing import Optional
+
+from model import *
+from profiler import profiled
+from sweep import get_fork_context
+
+# File name, plot function and its arguments, of each plot saved by `render_report`
+REPORT_PLOTS = [
+    ("total_transport_usage.png", get_total_transport_usage_plot, {}),
+    ("co2_emissions.png", get_co2_emissions_plot, {}),
+    ("co2_budget.png", get_co2_budget_plot, {}),
+    ("co2_budget_policy_type.png", get_co2_budget_per_company_type_plot, {}),
+    ("co2_policy_type.png", get_co2_budget_per_company_type_plot, {"plot_budget_lines": False}),
+    ("cost_benefit_per_employee.png", get_transport_costs_plot, {}),
+    ("transport_usage_per_type_plot.png", get_total_transport_usage_plot_per_company_type, {}),
+    ("emissions_comparison.png", get_emissions_plot_company_comparison, {}),
+    ("costs_comparison.png", get_costs_plot_company_comparison, {}),
+]
+
+# Snapshot rendered by the current process, set by the pool initializer
+_snapshot = None
+
+
+@profiled("plotting.savefig")
+def _save_plot(figure: Figure, path: str) -> None:
+    figure.savefig(path)
+    # Figures are kept by pyplot until closed
+    plt.close(figure)
+
+
+def _render_plot(plot_index: int, directory: str, set_title: bool) -> str:
+    file_name, plot, plot_arguments = REPORT_PLOTS[plot_index]
+    path = os.path.join(directory, file_name)
+    _save_plot(plot(_snapshot, set_title=set_title, **plot_arguments), path)
+    return path
+
+
+def _init_process(snapshot: ModelSnapshot) -> None:
+    global _snapshot
+    _snapshot = snapshot
+
+
+def render_report(
+    model,
+    directory: str = ".",
+    processes: Optional[int] = None,
+    set_title: bool = False,
+) -> list[str]:
+    """
+    Save all the plots of `REPORT_PLOTS` of a model to `directory`, returning their paths.
+    With more than one process (by default, one per CPU), the plots are rendered in parallel.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    processes = min(processes, len(REPORT_PLOTS))
+    os.makedirs(directory, exist_ok=True)
+    snapshot = ModelSnapshot(model)
+    tasks = [(plot_index, directory, set_title) for plot_index in range(len(REPORT_PLOTS))]
+
+    if processes <= 1:
+        _init_process(snapshot)
+        return [_render_plot(*task) for task in tasks]
+
+    # With fork, the processes inherit the snapshot instead of receiving a copy
+    context = get_fork_context()
+    with context.Pool(processes, initializer=_init_process, initargs=(snapshot,)) as pool:
+        return pool.starmap(_render_plot, tasks)
@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+import numpy as np
+
+from typing import Optional
+
+DEFAULT_ROUTE_CACHE_PATH = ".route_cache.sqlite"
+DEFAULT_ROUTE_CACHE_MAX_ENTRIES = 1_000_000
+
+# Bump this whenever the way routes are computed or stored changes
+ROUTE_CACHE_VERSION = 1
+
+
+class RouteCache:
+    """
+    Persistent store of shortest paths, shared across runs, app sessions and model rebuilds.
+
+    Routes are keyed by (graph fingerprint, source node, target node) and hold the path
+    and its transport distance (kms). The walking distance to and from the nodes depends on
+    the exact positions, not only on the nodes, so it is not stored.
+
+    Writes and recency updates are buffered and only applied on `flush`, which also evicts
+    the least recently used routes once there are more than `max_entries`.
+    """
+
+    def __init__(self, path: str = DEFAULT_ROUTE_CACHE_PATH, max_entries: int = DEFAULT_ROUTE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # The app may use the cache from several threads, and batch runs from several processes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS routes (
+                graph TEXT NOT NULL,
+                source INTEGER NOT NULL,
+                target INTEGER NOT NULL,
+                path BLOB NOT NULL,
+                transport_distance REAL NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (graph, source, target)
+            ) WITHOUT ROWID
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS routes_last_used ON routes (last_used)")
+        self._connection.commit()
+
+        row = self._connection.execute("SELECT MAX(last_used) FROM routes").fetchone()
+        self._clock = row[0] or 0
+        self._pending_routes: dict[tuple[str, int, int], tuple[bytes, float]] = {}
+        self._pending_uses: dict[tuple[str, int, int], int] = {}
+
+    @staticmethod
+    def graph_key(graph_fingerprint: str) -> str:
+        return f"v{ROUTE_CACHE_VERSION}:{graph_fingerprint}"
+
+    def get(self, graph_fingerprint: str, source_node: int, target_node: int) -> Optional[tuple[list[int], float]]:
+        """Cached (path, transport distance) between the nodes, or None if it is not cached."""
+        key = (self.graph_key(graph_fingerprint), source_node, target_node)
+        with self._lock:
+            pending = self._pending_routes.get(key)
+            if pending is not None:
+                path_blob, transport_distance = pending
+            else:
+                row = self._connection.execute(
+                    "SELECT path, transport_distance FROM routes WHERE graph = ? AND source = ? AND target = ?",
+                    key,
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                path_blob, transport_distance = row
+                self._clock += 1
+                self._pending_uses[key] = self._clock
+            self.hits += 1
+        return np.frombuffer(path_blob, dtype=np.int64).tolist(), transport_distance
+
+    def put(self, graph_fingerprint: str, source_node: int, target_node: int, path: list[int], transport_distance: float) -> None:
+        key = (self.graph_key(graph_fingerprint), source_node, target_node)
+        with self._lock:
+            self._pending_routes[key] = (np.asarray(path, dtype=np.int64).tobytes(), transport_distance)
+
+    def flush(self) -> None:
+        """Write buffered routes and recency updates, evicting the least recently used routes."""
+        with self._lock:
+            if not self._pending_routes and not self._pending_uses:
+                return
+            rows = []
+            for key, (path_blob, transport_distance) in self._pending_routes.items():
+                self._clock += 1
+                rows.append((*key, path_blob, transport_distance, self._clock))
+
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._connection.executemany(
+                    "UPDATE routes SET last_used = ? WHERE graph = ? AND source = ? AND target = ?",
+                    [(last_used, *key) for key, last_used in self._pending_uses.items()],
+                )
+                count = self._connection.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+                if count > self.max_entries:
+                    self._connection.execute(
+                        "DELETE FROM routes WHERE (graph, source, target) IN "
+                        "(SELECT graph, source, target FROM routes ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+            self._pending_routes.clear()
+            self._pending_uses.clear()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._connection.close()
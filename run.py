@@ -1,12 +1,16 @@
+import sys
 import time
 
-from graph_utils import (
-    load_graphs,
-    merge_graphs,
-)
+from graph_utils import load_graphs_and_merged_graph
+from csr_graph import build_routing_graphs
+from route_cache import RouteCache
 from company_agent import POSSIBLE_COMPANY_POLICIES
 from model import *
-from run_utils import parse_arguments, get_companies
+from replicates import *
+from sharded_model import ShardedSustainabilityModel
+from profiler import PROFILER
+from report import render_report
+from run_utils import parse_arguments, get_companies, GRAPH_DISTANCE, CENTER
 
 args = parse_arguments(POSSIBLE_COMPANY_POLICIES, DEFAULT_CO2_BUDGET_PER_EMPLOYEE)
 
@@ -21,71 +25,134 @@ print(f"Company budget per employee: {args.company_budget_per_employee} grams")
 
 
 # Non-modifiable parameters
-GRAPH_DISTANCE = 5000
-center = 41.1664384, -8.6016
+center = CENTER
+seed = 42
 
 # Print time taken to complete a task
 def print_time_taken(before: float, after: float, task: str) -> None:
     print(f"Time taken to complete '{task}': {after - before:.3f} seconds")
 
 
+if args.profile:
+    PROFILER.enable()
+
+
+if args.replicates > 1:
+    before = time.time()
+    statistics = run_replicates(
+        num_workers_per_company,
+        companies,
+        company_budget_per_employee,
+        max_replicates=args.replicates,
+        processes=args.processes,
+        base_seed=seed,
+        target_ci_width=args.target_ci_width,
+        confidence=args.confidence,
+        graph_cache_dir=args.graph_cache_dir,
+        offline=args.offline,
+        route_cache_path=None if args.no_route_cache else args.route_cache,
+        fast_forward=args.fast_forward,
+        transport_choice=args.transport_choice,
+        scheduler=args.scheduler,
+        lazy_paths=args.lazy_paths,
+    )
+    after = time.time()
+    print_time_taken(before, after, f"{statistics.num_replicates} replicates")
+
+    get_co2_emissions_band_plot(statistics, set_title=False).savefig("co2_emissions.png")
+    get_co2_budget_band_plot(statistics, set_title=False).savefig("co2_budget.png")
+    get_co2_budget_per_company_type_band_plot(statistics, set_title=False).savefig("co2_budget_policy_type.png")
+    get_co2_budget_per_company_type_band_plot(statistics, plot_budget_lines=False, set_title=False).savefig("co2_policy_type.png")
+    get_transport_costs_band_plot(statistics, set_title=False).savefig("cost_benefit_per_employee.png")
+    sys.exit()
+
 before = time.time()
 
-graphs = load_graphs(center, distance_meters=GRAPH_DISTANCE)
-merged_graph = merge_graphs(graphs)
+graphs, merged_graph = load_graphs_and_merged_graph(
+    center,
+    distance_meters=GRAPH_DISTANCE,
+    cache_dir=args.graph_cache_dir,
+    offline=args.offline,
+)
+
+routing_graphs = build_routing_graphs(graphs)
 
 after = time.time()
 print_time_taken(before, after, "load and merge graphs")
 
 
+route_cache = None if args.no_route_cache else RouteCache(args.route_cache)
+
 before = time.time()
 
-model = SustainabilityModel(
-    num_workers_per_company,
-    companies,
-    graphs,
-    merged_graph,
-    center_position=center,
-    company_location_radius=GRAPH_DISTANCE // 5,
-    agent_home_radius=GRAPH_DISTANCE,
-    company_budget_per_employee=DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
-    seed=42,
-)
+if args.shards > 1:
+    # Always fast-forwards the legs
+    model = ShardedSustainabilityModel(
+        args.shards,
+        num_workers_per_company,
+        companies,
+        graphs,
+        merged_graph,
+        center_position=center,
+        company_location_radius=GRAPH_DISTANCE // 5,
+        agent_home_radius=GRAPH_DISTANCE,
+        company_budget_per_employee=company_budget_per_employee,
+        seed=seed,
+        routing_graphs=routing_graphs,
+        route_cache_path=None if args.no_route_cache else args.route_cache,
+        transport_choice=args.transport_choice,
+        collect_every=args.collect_every,
+        lazy_paths=args.lazy_paths,
+    )
+else:
+    model = SustainabilityModel(
+        num_workers_per_company,
+        companies,
+        graphs,
+        merged_graph,
+        center_position=center,
+        company_location_radius=GRAPH_DISTANCE // 5,
+        agent_home_radius=GRAPH_DISTANCE,
+        company_budget_per_employee=company_budget_per_employee,
+        seed=seed,
+        routing_graphs=routing_graphs,
+        route_cache=route_cache,
+        fast_forward=args.fast_forward,
+        transport_choice=args.transport_choice,
+        collect_every=args.collect_every,
+        scheduler=args.scheduler,
+        lazy_paths=args.lazy_paths,
+    )
 
 after = time.time()
 print_time_taken(before, after, "create the model")
 
+exporter = None
+if args.export is not None:
+    # Requires pyarrow, so only imported when exporting
+    from exporter import ResultsExporter
+    exporter = ResultsExporter(model, args.export, every=args.export_every, export_format=args.export_format)
+
 before = time.time()
 while not model.finished:
     model.step()
+    if exporter is not None:
+        exporter.update()
 after = time.time()
+if exporter is not None:
+    exporter.close()
+    print(f"Results exported to {args.export}")
 print_time_taken(before, after, "simulation")
 
 print(f"Total number of model steps before finishing (one month): {model.steps}")
 
-transport_total_usage_plot = get_total_transport_usage_plot(model, set_title=False)
-transport_total_usage_plot.savefig("total_transport_usage.png")
-
-co2_emissions_plot = get_co2_emissions_plot(model, set_title=False)
-co2_emissions_plot.savefig("co2_emissions.png")
-
-co2_budget_plot = get_co2_budget_plot(model, set_title=False)
-co2_budget_plot.savefig("co2_budget.png")
-
-co2_budget_policy_type_plot = get_co2_budget_per_company_type_plot(model, set_title=False)
-co2_budget_policy_type_plot.savefig("co2_budget_policy_type.png")
-
-co2_policy_type_plot = get_co2_budget_per_company_type_plot(model, plot_budget_lines=False, set_title=False)
-co2_policy_type_plot.savefig("co2_policy_type.png")
-
-cost_benefit_per_employee_plot = get_transport_costs_plot(model, set_title=False)
-cost_benefit_per_employee_plot.savefig("cost_benefit_per_employee.png")
-
-transport_usage_per_type_plot = get_total_transport_usage_plot_per_company_type(model, set_title=False)
-transport_usage_per_type_plot.savefig("transport_usage_per_type_plot.png")
-
-comparison_emissions_plot = get_emissions_plot_company_comparison(model, set_title=False)
-comparison_emissions_plot.savefig("emissions_comparison.png")
+before = time.time()
+# The phases of the processes rendering the plots are not profiled
+render_report(model, processes=1 if args.profile else args.processes)
+after = time.time()
+print_time_taken(before, after, "render the plots")
 
-comparison_costs_plot = get_costs_plot_company_comparison(model, set_title=False)
-comparison_costs_plot.savefig("costs_comparison.png")
+if args.profile:
+    print(PROFILER.report())
+    PROFILER.dump_json(args.profile_output)
+    print(f"Profile saved to {args.profile_output}")
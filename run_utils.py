@@ -1,4 +1,13 @@
 import argparse
+import os
+
+from graph_utils import DEFAULT_GRAPH_CACHE_DIR
+from route_cache import DEFAULT_ROUTE_CACHE_PATH
+from profiler import DEFAULT_PROFILE_OUTPUT
+
+# Non-modifiable parameters
+GRAPH_DISTANCE = 5000
+CENTER = 41.1664384, -8.6016
 
 
 def parse_arguments(policies: list[str], default_co2: int):
@@ -29,7 +38,150 @@ def parse_arguments(policies: list[str], default_co2: int):
         help=f"Default CO2 budget per employee in grams (default: {default_co2})",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "--fast_forward",
+        action="store_true",
+        help="Apply each half-day leg in a single step instead of moving workers node by node",
+    )
+
+    parser.add_argument(
+        "--scheduler",
+        choices=["random", "event"],
+        default="random",
+        help="Move every worker one node per step, or move workers at the speed of their transport with a discrete-event scheduler (default: random)",
+    )
+
+    parser.add_argument(
+        "--collect_every",
+        choices=["step", "leg", "day"],
+        default="step",
+        help="Collect the data every step, at the end of every leg or of every day (default: step)",
+    )
+
+    parser.add_argument(
+        "--transport_choice",
+        choices=["vectorized", "sequential"],
+        default="vectorized",
+        help="Sample the transports of all workers at once, or one worker at a time as originally done (default: vectorized)",
+    )
+
+    parser.add_argument(
+        "--lazy_paths",
+        action="store_true",
+        help="Only keep the distances of the workers' paths, and build the paths of the chosen transport when it is chosen",
+    )
+
+    parser.add_argument(
+        "--graph_cache_dir",
+        type=str,
+        default=DEFAULT_GRAPH_CACHE_DIR,
+        help=f"Directory where the street graphs are cached (default: {DEFAULT_GRAPH_CACHE_DIR})",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only load the street graphs from the cache directory, never from the network",
+    )
+
+    parser.add_argument(
+        "--route_cache",
+        type=str,
+        default=DEFAULT_ROUTE_CACHE_PATH,
+        help=f"SQLite file where the computed routes are cached across runs (default: {DEFAULT_ROUTE_CACHE_PATH})",
+    )
+
+    parser.add_argument(
+        "--no_route_cache",
+        action="store_true",
+        help="Always compute the routes, without reading or writing the route cache",
+    )
+
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        help="Directory where the metrics and the daily records of each worker are written during the run (requires pyarrow)",
+    )
+
+    parser.add_argument(
+        "--export_format",
+        choices=["arrow", "parquet"],
+        default="arrow",
+        help="Format of the exported files: Arrow IPC, which can be memory-mapped, or Parquet (default: arrow)",
+    )
+
+    parser.add_argument(
+        "--export_every",
+        choices=["step", "leg", "day"],
+        default="day",
+        help="Export the metrics every step, at the end of every leg or at the end of every day (default: day)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record the calls, time and allocations of each phase (routing, stepping, collecting, plotting) and print a report",
+    )
+
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        default=DEFAULT_PROFILE_OUTPUT,
+        help=f"JSON file where the profile is saved with --profile (default: {DEFAULT_PROFILE_OUTPUT})",
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the companies across this many processes, fast-forwarding the legs (default: 1)",
+    )
+
+    parser.add_argument(
+        "--replicates",
+        type=int,
+        default=1,
+        help="Run up to this many seeds of the configuration in parallel and plot bands across them (default: 1)",
+    )
+
+    parser.add_argument(
+        "--target_ci_width",
+        type=float,
+        default=None,
+        help="Stop the replicates once the confidence interval of the total CO2 is narrower than this fraction of its mean",
+    )
+
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals across replicates (default: 0.95)",
+    )
+
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes running the replicates, or rendering the plots (default: number of CPUs)",
+    )
+
+    args = parser.parse_args()
+    if args.shards > 1 and args.replicates > 1:
+        parser.error("--shards can not be used with --replicates (the replicates already run in parallel)")
+    if args.shards > 1 and args.transport_choice != "vectorized":
+        parser.error("--shards only supports --transport_choice vectorized")
+    if args.profile and args.replicates > 1:
+        parser.error("--profile can not be used with --replicates (the replicates run in other processes)")
+    if args.export is not None and args.replicates > 1:
+        parser.error("--export can not be used with --replicates (only single runs are exported)")
+    if args.export is not None and args.shards > 1 and args.export_every != "day":
+        parser.error("--shards only exports the results at the end of every day (--export_every day)")
+    if args.scheduler == "event" and args.fast_forward:
+        parser.error("--scheduler event can not be used with --fast_forward")
+    if args.scheduler == "event" and args.shards > 1:
+        parser.error("--scheduler event can not be used with --shards (the shards always fast forward the legs)")
+    return args
 
 
 def get_companies(args, policies):
@@ -0,0 +1,254 @@
+import numpy as np
+import networkx as nx
+
+from typing import Optional
+
+from csr_graph import CSRGraph, build_routing_graphs
+from metrics import MetricsCollector
+from model import (
+    SustainabilityModel,
+    WorkerStateReporters,
+    CAR_CO2_G_KM,
+    ESCOOTER_CO2_G_KM,
+    CAR_EURO_KM,
+    ESCOOTER_EURO_KM,
+    DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
+)
+from route_cache import RouteCache
+from sweep import get_fork_context
+from transport_choice import TRANSPORTS, TRANSPORT_INDEX
+from worker_state import WorkerStateStore
+
+
+def get_shard_ranges(num_companies: int, num_shards: int) -> list[tuple[int, int]]:
+    """Contiguous (start, stop) ranges of company indices, as even as possible."""
+    num_shards = min(num_shards, num_companies)
+    bounds = [shard * num_companies // num_shards for shard in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _get_shard_state(model: SustainabilityModel) -> dict:
+    """
+    State of the workers and companies of a shard, as needed to merge the metrics.
+    The arrays are copied, since they are only sent at the end of the day.
+    """
+    state = model.worker_state
+    num_workers = state.num_workers
+    return {
+        "steps": model.steps,
+        "sustainability_factors": state.sustainability_factors[:num_workers].copy(),
+        "uses": state.uses[:num_workers].copy(),
+        "kms": state.kms[:num_workers].copy(),
+        "co2": state.co2[:num_workers].copy(),
+        "costs": state.costs[:num_workers].copy(),
+        "company_co2": state.company_co2.copy(),
+        "company_costs": state.company_costs.copy(),
+        "transport_co2": state.transport_co2.copy(),
+        "policy_co2": dict(zip(model.policies, state.policy_co2.tolist())),
+        "transports_chosen": np.array([TRANSPORT_INDEX[agent.transport_chosen] for agent in model.worker_agents]),
+    }
+
+
+def _run_shard(connection, model_arguments: dict, company_range: tuple[int, int], route_cache_path: Optional[str]) -> None:
+    """Run the companies of a shard one day at a time, sending the state at the end of each leg."""
+    route_cache = RouteCache(route_cache_path) if route_cache_path is not None else None
+    model = SustainabilityModel(
+        **model_arguments,
+        route_cache=route_cache,
+        fast_forward=True,
+        collect_every="day",
+        company_range=company_range,
+    )
+    connection.send([_get_shard_state(model)])
+
+    while connection.recv():
+        states = []
+        for _ in range(2):  # Going to work and back home
+            model.step()
+            states.append(_get_shard_state(model))
+        connection.send(states)
+    connection.close()
+
+
+class ShardedSustainabilityModel(WorkerStateReporters):
+    """
+    Runs the model with the companies (and their workers) split across processes.
+
+    Workers only interact with their own company, so each process (shard) runs a contiguous
+    range of the companies on its own, and the shards only synchronize at the end of every day,
+    when their state is merged here to collect the metrics.
+
+    The results are the same as those of `SustainabilityModel` with `fast_forward`
+    (up to the rounding of the totals added across shards), and each step is one leg.
+    Only the "vectorized" transport choice is supported.
+    """
+
+    def __init__(
+        self,
+        num_shards: int,
+        num_workers_per_company: int = 10,
+        companies: dict[str, int] = None,
+        graphs: dict[str, nx.Graph] = None,
+        merged_graph: nx.Graph = None,
+        center_position: tuple[float, float] = None,
+        company_location_radius: int = 1000,
+        agent_home_radius: int = 5000,
+        company_budget_per_employee: int = DEFAULT_CO2_BUDGET_PER_EMPLOYEE,
+        seed: Optional[int] = None,
+        routing_graphs: Optional[dict[str, CSRGraph]] = None,
+        route_cache_path: Optional[str] = None,
+        transport_choice: str = "vectorized",
+        collect_every: str = "step",
+        lazy_paths: bool = False,
+    ):
+        """
+        Same arguments as `SustainabilityModel`, except for the route cache, which is given by its path
+        (each shard opens its own connection).
+        """
+        if transport_choice != "vectorized":
+            raise ValueError("The sharded model only supports the vectorized transport choice")
+        if seed is None:
+            # All shards must draw the same positions and transport choices
+            seed = int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+
+        company_policies = [
+            company_policy
+            for company_policy, company_count in companies.items()
+            for _ in range(company_count)
+        ]
+        if len(company_policies) == 0:
+            raise ValueError("There must be at least one company")
+
+        self.num_companies = len(company_policies)
+        self.num_workers_per_company = num_workers_per_company
+        self.policies = [policy for policy, company_cnt in companies.items() if company_cnt > 0]
+        self.company_budget_per_employee = company_budget_per_employee
+        self.base_company_budget = self.company_budget_per_employee * self.num_workers_per_company
+
+        num_workers = self.num_workers_per_company * self.num_companies
+        self.worker_state = WorkerStateStore(
+            num_workers,
+            self.num_companies,
+            len(self.policies),
+            co2_per_km={"car": CAR_CO2_G_KM, "electric_scooter": ESCOOTER_CO2_G_KM},
+            cost_per_km={"car": CAR_EURO_KM, "electric_scooter": ESCOOTER_EURO_KM},
+        )
+        for company_policy in company_policies:
+            company_index = self.worker_state.add_company(self.policies.index(company_policy))
+            for _ in range(self.num_workers_per_company):
+                # The sustainability factors are set from the shards
+                self.worker_state.add_worker(company_index, 0)
+        self.transports_chosen = np.zeros(num_workers, dtype=np.int64)
+
+        self.data_collector = MetricsCollector(self, every=collect_every)
+        self.steps = 0
+        # Legs are fast-forwarded, so there is no simulated time of day
+        self.time = None
+        self.new_day_steps: list[int] = []
+        self.path_switches = 0
+        self.finished = False
+
+        if routing_graphs is None:
+            routing_graphs = build_routing_graphs(graphs)
+        model_arguments = {
+            "num_workers_per_company": num_workers_per_company,
+            "companies": companies,
+            "graphs": graphs,
+            "merged_graph": merged_graph,
+            "center_position": center_position,
+            "company_location_radius": company_location_radius,
+            "agent_home_radius": agent_home_radius,
+            "company_budget_per_employee": company_budget_per_employee,
+            "seed": seed,
+            "routing_graphs": routing_graphs,
+            "lazy_paths": lazy_paths,
+        }
+
+        # With fork, the shards inherit the graphs instead of receiving a copy
+        context = get_fork_context()
+
+        self.shard_ranges = get_shard_ranges(self.num_companies, num_shards)
+        self._connections = []
+        self._processes = []
+        for company_range in self.shard_ranges:
+            connection, shard_connection = context.Pipe()
+            process = context.Process(
+                target=_run_shard,
+                args=(shard_connection, model_arguments, company_range, route_cache_path),
+                daemon=True,
+            )
+            process.start()
+            # Only the shard keeps its end open, so that a failed shard is detected
+            shard_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        self.__merge_states([states[0] for states in self.__receive_states()])
+
+    def __receive_states(self) -> list[list[dict]]:
+        try:
+            return [connection.recv() for connection in self._connections]
+        except EOFError:
+            self.close()
+            raise RuntimeError("A shard process failed")
+
+    def __merge_states(self, shard_states: list[dict]) -> None:
+        state = self.worker_state
+        for (start, stop), shard_state in zip(self.shard_ranges, shard_states):
+            workers = slice(start * self.num_workers_per_company, stop * self.num_workers_per_company)
+            state.sustainability_factors[workers] = shard_state["sustainability_factors"]
+            state.uses[workers] = shard_state["uses"]
+            state.kms[workers] = shard_state["kms"]
+            state.co2[workers] = shard_state["co2"]
+            state.costs[workers] = shard_state["costs"]
+            state.company_co2[start:stop] = shard_state["company_co2"]
+            state.company_costs[start:stop] = shard_state["company_costs"]
+            self.transports_chosen[workers] = shard_state["transports_chosen"]
+
+        state.transport_co2[:] = np.sum([shard_state["transport_co2"] for shard_state in shard_states], axis=0)
+        state.policy_co2[:] = 0
+        for shard_state in shard_states:
+            for policy, co2 in shard_state["policy_co2"].items():
+                state.policy_co2[self.policies.index(policy)] += co2
+        self.steps = shard_states[0]["steps"]
+
+    def step(self) -> None:
+        """Run a whole day (two legs, so two steps of the single process model with `fast_forward`)."""
+        if self.finished:
+            return
+        for connection in self._connections:
+            connection.send(True)
+        shard_day_states = self.__receive_states()
+
+        for leg in range(2):
+            self.__merge_states([states[leg] for states in shard_day_states])
+            # The day ends when the workers arrive home (second leg of the day)
+            end_of_day = leg == 1
+            if self.data_collector.should_collect(True, end_of_day):
+                self.data_collector.collect(self)
+            self.path_switches += 1
+
+        self.new_day_steps.append(self.steps)
+        if len(self.new_day_steps) == 30:
+            self.finished = True
+            self.close()
+
+    def close(self) -> None:
+        """Stop the shard processes."""
+        for connection in self._connections:
+            try:
+                connection.send(False)
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def calculate_times_each_transport_was_used(self):
+        counts = np.bincount(self.transports_chosen, minlength=len(TRANSPORTS))
+        return {
+            transport: int(counts[TRANSPORT_INDEX[transport]])
+            for transport in TRANSPORTS
+        }
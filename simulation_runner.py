@@ -0,0 +1,124 @@
+import threading
+
+from typing import Callable, Optional
+
+from model import ModelSnapshot
+
+
+class SimulationRunner:
+    """
+    Steps a model in a background thread, at its own pace, and publishes snapshots of it
+    (see `ModelSnapshot`) every `steps_per_snapshot` steps, and whenever it stops.
+
+    Only the runner thread touches the model once the runner is created, so other threads
+    (e.g., a UI) read the latest snapshot instead, as often as they want to draw it.
+    """
+
+    def __init__(
+        self,
+        model,
+        steps_per_snapshot: int = 1,
+        make_snapshot: Callable[[object], ModelSnapshot] = ModelSnapshot,
+    ):
+        self.steps_per_snapshot = steps_per_snapshot
+        self._model = model
+        self._make_snapshot = make_snapshot
+        self._condition = threading.Condition()
+        # Steps left to run (None to run until paused), and day to run until (number of days completed)
+        self._steps_left: Optional[int] = 0
+        self._until_day: Optional[int] = None
+        self._to_end_of_day = False
+        self._closed = False
+        self.snapshot = make_snapshot(model)
+        # Increased with every published snapshot
+        self.version = 0
+
+        self._thread = threading.Thread(target=self.__run, name="simulation-runner", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        """Whether the model is being stepped."""
+        with self._condition:
+            if self.snapshot.finished:
+                return False
+            return self._steps_left != 0 or self._until_day is not None or self._to_end_of_day
+
+    def play(self) -> None:
+        """Step the model until it finishes or `pause` is called."""
+        with self._condition:
+            self._steps_left = None
+            self._condition.notify_all()
+
+    def pause(self) -> None:
+        with self._condition:
+            self._steps_left = 0
+            self._until_day = None
+            self._to_end_of_day = False
+            self._condition.notify_all()
+
+    def step(self, num_steps: int = 1) -> None:
+        with self._condition:
+            if self._steps_left is not None:
+                self._steps_left += num_steps
+            self._condition.notify_all()
+
+    def run_to_end_of_day(self) -> None:
+        """Step the model until the current day ends."""
+        with self._condition:
+            self._to_end_of_day = True
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Stop the runner thread, after the current step."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def wait_for_snapshot(self, version: int, timeout: Optional[float] = None) -> bool:
+        """Wait until there is a snapshot newer than `version`, returning whether there is."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version > version or self._closed, timeout) and not self._closed
+
+    def __should_step(self) -> bool:
+        """Whether to run another step, called by the runner thread with the lock held."""
+        if self._to_end_of_day:
+            self._until_day = len(self._model.new_day_steps) + 1
+            self._to_end_of_day = False
+        if self._until_day is not None and len(self._model.new_day_steps) >= self._until_day:
+            self._until_day = None
+        if self._model.finished:
+            self._steps_left = 0
+            self._until_day = None
+        return self._steps_left != 0 or self._until_day is not None
+
+    def __publish(self) -> None:
+        snapshot = self._make_snapshot(self._model)
+        with self._condition:
+            self.snapshot = snapshot
+            self.version += 1
+            self._condition.notify_all()
+
+    def __run(self) -> None:
+        steps_since_snapshot = 0
+        while True:
+            with self._condition:
+                if steps_since_snapshot == 0:
+                    self._condition.wait_for(lambda: self._closed or self.__should_step())
+                if self._closed:
+                    return
+                step = self.__should_step()
+                if step and self._steps_left:
+                    self._steps_left -= 1
+
+            if step:
+                self._model.step()
+                steps_since_snapshot += 1
+                if self._model.finished:
+                    with self._condition:
+                        self.__should_step()
+            # Every `steps_per_snapshot` steps, and when the model stops
+            if steps_since_snapshot >= self.steps_per_snapshot or (not step and steps_since_snapshot > 0):
+                self.__publish()
+                steps_since_snapshot = 0
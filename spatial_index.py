@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from osmnx.distance import great_circle
+
+
+class NodeSpatialIndex:
+    """
+    KD-tree over the nodes of a graph, used to snap many (latitude, longitude) positions
+    to their closest nodes in a single vectorized query.
+
+    Coordinates are projected to a local equirectangular plane (in meters) around the graph,
+    which is accurate at city scale. The few closest candidates in that plane are then ranked
+    by great-circle distance, which gives the same nodes and distances as `osmnx.distance.nearest_nodes`.
+    """
+
+    # Number of candidates to rank by great-circle distance
+    NUM_CANDIDATES = 8
+    EARTH_RADIUS_M = 6_371_009
+
+    def __init__(self, node_ids: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        self.node_ids = node_ids
+        self.lats = lats
+        self.lons = lons
+        self.reference_lat = float(np.mean(lats)) if len(lats) > 0 else 0.0
+        self.tree = cKDTree(self._project(lats, lons))
+
+    def _project(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        cos_lat = np.cos(np.deg2rad(self.reference_lat))
+        return np.column_stack((
+            self.EARTH_RADIUS_M * np.deg2rad(lons) * cos_lat,
+            self.EARTH_RADIUS_M * np.deg2rad(lats),
+        ))
+
+    def nearest_nodes(self, positions) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Closest node to each (latitude, longitude) position.
+        Returns the node ids and the great-circle distances in meters.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        lats, lons = positions[:, 0], positions[:, 1]
+
+        k = min(self.NUM_CANDIDATES, len(self.node_ids))
+        _, candidates = self.tree.query(self._project(lats, lons), k=k)
+        candidates = candidates.reshape(len(positions), k)
+
+        distances = great_circle(
+            lats[:, None], lons[:, None],
+            self.lats[candidates], self.lons[candidates],
+            earth_radius=self.EARTH_RADIUS_M,
+        )
+        best = np.argmin(distances, axis=1)
+        rows = np.arange(len(positions))
+        return self.node_ids[candidates[rows, best]], distances[rows, best]
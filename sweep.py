@@ -0,0 +1,329 @@
+"""
+Runs a grid of model configurations on a pool of processes and writes a summary of each run
+to a single CSV file, one row per run, as the runs finish.
+
+The street graphs are loaded (and the routing graphs built) once, in the parent process,
+and the pool processes inherit them when they are forked, instead of loading them for every run.
+
+Example:
+    python sweep.py --policy0 0 2 --policy2 0 2 --num_workers_per_company 10 30 --seeds 1 2 3
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from graph_utils import load_graphs_and_merged_graph, DEFAULT_GRAPH_CACHE_DIR
+from csr_graph import build_routing_graphs
+from route_cache import RouteCache, DEFAULT_ROUTE_CACHE_PATH
+from company_agent import POSSIBLE_COMPANY_POLICIES
+from transport_choice import TRANSPORTS, TRANSPORT_CHOICE_MODES
+from metrics import COLLECT_EVERY_OPTIONS
+from model import SustainabilityModel, DEFAULT_CO2_BUDGET_PER_EMPLOYEE
+from run_utils import GRAPH_DISTANCE, CENTER
+
+DEFAULT_SWEEP_OUTPUT = "sweep_results.csv"
+
+# Graphs and run options of the current process, set before the pool is created
+# (and inherited by forked processes) or by the pool initializer
+_shared = {}
+
+
+def parse_sweep_arguments():
+    parser = argparse.ArgumentParser(
+        description="Run a grid of model configurations in parallel."
+    )
+
+    for policy in POSSIBLE_COMPANY_POLICIES:
+        parser.add_argument(
+            f"--{policy}",
+            type=int,
+            nargs="+",
+            default=[0],
+            help=f"Numbers of companies with {policy} (default: 0)",
+        )
+
+    parser.add_argument(
+        "--num_workers_per_company",
+        type=int,
+        nargs="+",
+        default=[30],
+        help="Numbers of workers per company (default: 30)",
+    )
+
+    parser.add_argument(
+        "--company_budget_per_employee",
+        type=float,
+        nargs="+",
+        default=[DEFAULT_CO2_BUDGET_PER_EMPLOYEE],
+        help=f"CO2 budgets per employee in grams (default: {DEFAULT_CO2_BUDGET_PER_EMPLOYEE})",
+    )
+
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=[42],
+        help="Seeds of the runs of each configuration (default: 42)",
+    )
+
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes running the simulations (default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_SWEEP_OUTPUT,
+        help=f"CSV file where the summary of each run is written (default: {DEFAULT_SWEEP_OUTPUT})",
+    )
+
+    parser.add_argument(
+        "--fast_forward",
+        action="store_true",
+        help="Apply each half-day leg in a single step instead of moving workers node by node",
+    )
+
+    parser.add_argument(
+        "--transport_choice",
+        choices=TRANSPORT_CHOICE_MODES,
+        default="vectorized",
+        help="Sample the transports of all workers at once, or one worker at a time as originally done (default: vectorized)",
+    )
+
+    parser.add_argument(
+        "--lazy_paths",
+        action="store_true",
+        help="Only keep the distances of the workers' paths, and build the paths of the chosen transport when it is chosen",
+    )
+
+    parser.add_argument(
+        "--graph_cache_dir",
+        type=str,
+        default=DEFAULT_GRAPH_CACHE_DIR,
+        help=f"Directory where the street graphs are cached (default: {DEFAULT_GRAPH_CACHE_DIR})",
+    )
+
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only load the street graphs from the cache directory, never from the network",
+    )
+
+    parser.add_argument(
+        "--route_cache",
+        type=str,
+        default=DEFAULT_ROUTE_CACHE_PATH,
+        help=f"SQLite file where the computed routes are cached across runs (default: {DEFAULT_ROUTE_CACHE_PATH})",
+    )
+
+    parser.add_argument(
+        "--no_route_cache",
+        action="store_true",
+        help="Always compute the routes, without reading or writing the route cache",
+    )
+
+    return parser.parse_args()
+
+
+def get_configurations(args) -> list[dict]:
+    """Every combination of the swept parameters, skipping the ones without companies."""
+    configurations = []
+    grid = itertools.product(
+        *(getattr(args, policy) for policy in POSSIBLE_COMPANY_POLICIES),
+        args.num_workers_per_company,
+        args.company_budget_per_employee,
+        args.seeds,
+    )
+    for *company_counts, num_workers_per_company, company_budget_per_employee, seed in grid:
+        if sum(company_counts) == 0:
+            continue
+        configuration = dict(zip(POSSIBLE_COMPANY_POLICIES, company_counts))
+        configuration["num_workers_per_company"] = num_workers_per_company
+        configuration["company_budget_per_employee"] = company_budget_per_employee
+        configuration["seed"] = seed
+        configurations.append(configuration)
+    return configurations
+
+
+def load_shared_graphs(graph_cache_dir: str, offline: bool) -> None:
+    graphs, merged_graph = load_graphs_and_merged_graph(
+        CENTER,
+        distance_meters=GRAPH_DISTANCE,
+        cache_dir=graph_cache_dir,
+        offline=offline,
+    )
+    routing_graphs = build_routing_graphs(graphs)
+    # Build the lazily created structures now, so that forked processes inherit them
+    for routing_graph in routing_graphs.values():
+        routing_graph.spatial_index
+        routing_graph.matrix
+        routing_graph.reverse_matrix
+
+    _shared["graphs"] = graphs
+    _shared["merged_graph"] = merged_graph
+    _shared["routing_graphs"] = routing_graphs
+
+
+def _init_process(graph_cache_dir: str, offline: bool, route_cache_path: str, options: dict) -> None:
+    if "graphs" not in _shared:
+        # Not forked from the parent (e.g. "spawn" start method), so load them from the cache
+        load_shared_graphs(graph_cache_dir, offline)
+    # SQLite connections must not be shared across processes, so each process opens its own
+    _shared["route_cache"] = RouteCache(route_cache_path) if route_cache_path is not None else None
+    _shared["options"] = options
+
+
+def summarize_model(model: SustainabilityModel) -> dict:
+    """Metrics of a finished run, as a flat dictionary."""
+    state = model.worker_state
+    co2_emissions = model.calculate_CO2_emissions()
+    co2_avg_per_company_type = model.calculate_CO2_avg_per_company_type()
+    workers_co2 = model.get_workers_co2()
+    workers_costs = model.get_workers_transport_costs()
+
+    summary = {
+        "steps": model.steps,
+        "days": len(model.new_day_steps),
+        "co2_car": co2_emissions["car"],
+        "co2_electric_scooter": co2_emissions["electric_scooter"],
+        "co2_total": sum(co2_emissions.values()),
+        "co2_mean_per_worker": float(np.mean(workers_co2)),
+        "transport_costs_mean": float(np.mean(workers_costs)),
+        "transport_costs_std": float(np.std(workers_costs)),
+    }
+    for policy in POSSIBLE_COMPANY_POLICIES:
+        summary[f"co2_avg_{policy}"] = co2_avg_per_company_type.get(policy, "")
+    for transport in TRANSPORTS:
+        summary[f"uses_{transport}"] = int(state.uses_of(transport).sum())
+    for transport in TRANSPORTS:
+        summary[f"kms_{transport}"] = float(state.kms_of(transport).sum())
+    return summary
+
+
+def run_model(configuration: dict) -> SustainabilityModel:
+    """Run the model with a configuration (in a pool process) until it finishes."""
+    options = _shared["options"]
+    companies = {policy: configuration.get(policy, 0) for policy in POSSIBLE_COMPANY_POLICIES}
+
+    model = SustainabilityModel(
+        configuration["num_workers_per_company"],
+        companies,
+        _shared["graphs"],
+        _shared["merged_graph"],
+        center_position=CENTER,
+        company_location_radius=GRAPH_DISTANCE // 5,
+        agent_home_radius=GRAPH_DISTANCE,
+        company_budget_per_employee=configuration["company_budget_per_employee"],
+        seed=configuration["seed"],
+        routing_graphs=_shared["routing_graphs"],
+        route_cache=_shared["route_cache"],
+        fast_forward=options["fast_forward"],
+        transport_choice=options["transport_choice"],
+        collect_every=options["collect_every"],
+        scheduler=options["scheduler"],
+        lazy_paths=options["lazy_paths"],
+    )
+    while not model.finished:
+        model.step()
+    return model
+
+
+def run_configuration(configuration: dict) -> dict:
+    """Run the model with a configuration until it finishes, returning the configuration and its summary."""
+    before = time.time()
+    model = run_model(configuration)
+    run_time = time.time() - before
+
+    return {**configuration, **summarize_model(model), "run_time": run_time}
+
+
+def get_fork_context():
+    """Context that forks the processes when possible, so that they inherit the memory of this one instead of receiving a copy."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def create_pool(
+    processes: int,
+    graph_cache_dir: str,
+    offline: bool,
+    route_cache_path: str,
+    options: dict,
+):
+    """
+    Pool of processes ready to run models, with the graphs loaded.
+    When processes can be forked, the graphs are loaded here, once, and inherited by all of them.
+    """
+    context = get_fork_context()
+    if context.get_start_method() == "fork" and "graphs" not in _shared:
+        load_shared_graphs(graph_cache_dir, offline)
+
+    initargs = (graph_cache_dir, offline, route_cache_path, options)
+    return context.Pool(processes, initializer=_init_process, initargs=initargs)
+
+
+def run_sweep(
+    configurations: list[dict],
+    output_path: str,
+    processes: int,
+    graph_cache_dir: str = DEFAULT_GRAPH_CACHE_DIR,
+    offline: bool = False,
+    route_cache_path: str = DEFAULT_ROUTE_CACHE_PATH,
+    fast_forward: bool = False,
+    transport_choice: str = "vectorized",
+    lazy_paths: bool = False,
+) -> None:
+    """
+    Run all configurations on `processes` processes, writing a row to `output_path` as each run finishes.
+    Rows are in order of completion, not of the configurations. `route_cache_path` may be None.
+    """
+    options = {
+        "fast_forward": fast_forward,
+        "transport_choice": transport_choice,
+        # Only the final state of each run is summarized
+        "collect_every": COLLECT_EVERY_OPTIONS[-1],
+        "scheduler": "random",
+        "lazy_paths": lazy_paths,
+    }
+
+    with open(output_path, "w", newline="") as output_file, \
+            create_pool(processes, graph_cache_dir, offline, route_cache_path, options) as pool:
+        writer = None
+        for run_index, row in enumerate(pool.imap_unordered(run_configuration, configurations), start=1):
+            if writer is None:
+                writer = csv.DictWriter(output_file, fieldnames=list(row.keys()))
+                writer.writeheader()
+            writer.writerow(row)
+            output_file.flush()
+            print(f"Finished run {run_index}/{len(configurations)} in {row['run_time']:.3f} seconds")
+
+
+if __name__ == "__main__":
+    args = parse_sweep_arguments()
+    configurations = get_configurations(args)
+    if len(configurations) == 0:
+        raise ValueError("There must be at least one configuration with companies")
+    print(f"Running {len(configurations)} configurations on {args.processes} processes")
+
+    before = time.time()
+    run_sweep(
+        configurations,
+        args.output,
+        args.processes,
+        graph_cache_dir=args.graph_cache_dir,
+        offline=args.offline,
+        route_cache_path=None if args.no_route_cache else args.route_cache,
+        fast_forward=args.fast_forward,
+        transport_choice=args.transport_choice,
+        lazy_paths=args.lazy_paths,
+    )
+    print(f"Time taken to complete 'sweep': {time.time() - before:.3f} seconds")
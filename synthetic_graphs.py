@@ -0,0 +1,113 @@
+"""
+Synthetic street graphs with the attributes the model uses from OSM graphs
+(node "x" and "y" in degrees, edge "length" in meters), to run the model without downloading graphs.
+
+All networks of a city share the same nodes (intersections), and each network keeps
+a different random subset of the streets, restricted to its largest strongly connected component,
+as with the graphs loaded from OSM.
+"""
+import math
+
+import networkx as nx
+import numpy as np
+from osmnx.distance import great_circle
+from scipy.spatial import cKDTree
+
+from graph_utils import NETWORK_TYPES
+
+SYNTHETIC_GRAPH_KINDS = ["grid", "random"]
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111_320
+
+# Fraction of the streets missing from each network (cars have fewer streets than pedestrians)
+DROPPED_STREETS = {
+    "drive": 0.25,
+    "bike": 0.1,
+    "walk": 0.02,
+}
+
+# Mean number of streets of each intersection of the random graphs
+RANDOM_GRAPH_MEAN_DEGREE = 6
+
+
+def _grid_positions(rng, size: int, spacing_meters: float) -> np.ndarray:
+    """Positions (meters from the center) of a size x size grid, slightly jittered."""
+    offsets = (np.arange(size) - (size - 1) / 2) * spacing_meters
+    positions = np.stack(np.meshgrid(offsets, offsets), axis=-1).reshape(-1, 2)
+    return positions + rng.uniform(-0.2, 0.2, positions.shape) * spacing_meters
+
+
+def _grid_streets(size: int) -> np.ndarray:
+    nodes = np.arange(size * size).reshape(size, size)
+    horizontal = np.stack([nodes[:, :-1].ravel(), nodes[:, 1:].ravel()], axis=1)
+    vertical = np.stack([nodes[:-1, :].ravel(), nodes[1:, :].ravel()], axis=1)
+    return np.concatenate([horizontal, vertical])
+
+
+def _random_positions(rng, size: int, spacing_meters: float) -> np.ndarray:
+    """Positions (meters from the center) of size * size intersections, uniform in the same square as the grid."""
+    half_side = size * spacing_meters / 2
+    return rng.uniform(-half_side, half_side, (size * size, 2))
+
+
+def _random_streets(positions: np.ndarray, spacing_meters: float) -> np.ndarray:
+    """Streets between the intersections closer than the radius giving the mean degree (random geometric graph)."""
+    radius = spacing_meters * math.sqrt(RANDOM_GRAPH_MEAN_DEGREE / math.pi)
+    return cKDTree(positions).query_pairs(radius, output_type="ndarray")
+
+
+def _build_network(
+    rng,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    streets: np.ndarray,
+    lengths: np.ndarray,
+    dropped: float,
+) -> nx.MultiDiGraph:
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    graph.add_nodes_from((node, {"y": lat, "x": lon}) for node, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())))
+
+    kept = rng.random(len(streets)) >= dropped
+    for (start, end), length in zip(streets[kept].tolist(), lengths[kept].tolist()):
+        graph.add_edge(start, end, length=length)
+        graph.add_edge(end, start, length=length)
+
+    largest_component = max(nx.strongly_connected_components(graph), key=len)
+    return graph.subgraph(largest_component).copy()
+
+
+def make_synthetic_graphs(
+    center_position: tuple[float, float],
+    kind: str = "grid",
+    size: int = 40,
+    spacing_meters: float = 120,
+    seed: int = 0,
+) -> dict[str, nx.MultiDiGraph]:
+    """
+    Drive, bike and walk graphs of size * size intersections around `center_position`,
+    `spacing_meters` apart on average (so they span size * spacing_meters on each side).
+
+    `kind` is "grid" (streets between neighbouring intersections of a grid)
+    or "random" (random geometric graph: streets between intersections closer than a radius).
+    """
+    if kind not in SYNTHETIC_GRAPH_KINDS:
+        raise ValueError(f"Invalid synthetic graph kind '{kind}'")
+    rng = np.random.default_rng(seed)
+
+    if kind == "grid":
+        positions = _grid_positions(rng, size, spacing_meters)
+        streets = _grid_streets(size)
+    else:
+        positions = _random_positions(rng, size, spacing_meters)
+        streets = _random_streets(positions, spacing_meters)
+
+    center_lat, center_lon = center_position
+    lats = center_lat + positions[:, 1] / METERS_PER_DEGREE
+    lons = center_lon + positions[:, 0] / (METERS_PER_DEGREE * math.cos(math.radians(center_lat)))
+    lengths = great_circle(lats[streets[:, 0]], lons[streets[:, 0]], lats[streets[:, 1]], lons[streets[:, 1]])
+
+    return {
+        network_type: _build_network(rng, lats, lons, streets, lengths, DROPPED_STREETS[network_type])
+        for network_type in NETWORK_TYPES
+    }
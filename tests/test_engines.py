@@ -0,0 +1,112 @@
+"""
+Regression tests of the engines: every way of running the model must give the same results
+as the model stepping the workers one node at a time, on a small synthetic grid (offline).
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from checkpoint import fork_model, load_checkpoint, save_checkpoint
+from csr_graph import build_routing_graphs
+from graph_utils import merge_graphs
+from model import SustainabilityModel
+from run_utils import CENTER
+from sharded_model import ShardedSustainabilityModel
+from synthetic_graphs import make_synthetic_graphs
+
+COMPANIES = {"policy0": 1, "policy1": 1, "policy2": 1, "policy3": 1, "policy4": 1}
+NUM_WORKERS_PER_COMPANY = 5
+SEED = 42
+
+
+class EngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.graphs = make_synthetic_graphs(CENTER, kind="grid", size=15)
+        cls.merged_graph = merge_graphs(cls.graphs)
+        cls.routing_graphs = build_routing_graphs(cls.graphs)
+        cls.reference = cls.run_model(cls.create_model())
+
+    @classmethod
+    def model_arguments(cls) -> dict:
+        return {
+            "num_workers_per_company": NUM_WORKERS_PER_COMPANY,
+            "companies": COMPANIES,
+            "graphs": cls.graphs,
+            "merged_graph": cls.merged_graph,
+            "center_position": CENTER,
+            "company_location_radius": 300,
+            "agent_home_radius": 800,
+            "seed": SEED,
+            "routing_graphs": cls.routing_graphs,
+        }
+
+    @classmethod
+    def create_model(cls, **kwargs) -> SustainabilityModel:
+        return SustainabilityModel(**cls.model_arguments(), **kwargs)
+
+    @staticmethod
+    def run_model(model):
+        while not model.finished:
+            model.step()
+        return model
+
+    def assert_same_results(self, model) -> None:
+        """Totals that do not depend on how many steps the model took."""
+        self.assertEqual(
+            model.calculate_times_each_transport_was_used_total(),
+            self.reference.calculate_times_each_transport_was_used_total(),
+        )
+        emissions = model.calculate_CO2_emissions()
+        reference_emissions = self.reference.calculate_CO2_emissions()
+        self.assertEqual(emissions.keys(), reference_emissions.keys())
+        for transport, co2 in emissions.items():
+            self.assertAlmostEqual(co2, reference_emissions[transport], delta=1e-9 * abs(co2))
+        np.testing.assert_allclose(
+            model.get_workers_transport_costs(), self.reference.get_workers_transport_costs(), rtol=1e-9
+        )
+
+    def test_fast_forward(self):
+        self.assert_same_results(self.run_model(self.create_model(fast_forward=True)))
+
+    def test_event_scheduler(self):
+        self.assert_same_results(self.run_model(self.create_model(scheduler="event")))
+
+    def test_lazy_paths(self):
+        model = self.run_model(self.create_model(lazy_paths=True))
+        self.assertGreater(len(model.path_pool), 0)
+        self.assert_same_results(model)
+
+    def test_sharded(self):
+        model = ShardedSustainabilityModel(2, **self.model_arguments())
+        try:
+            self.assert_same_results(self.run_model(model))
+        finally:
+            model.close()
+
+    def test_checkpoint(self):
+        model = self.create_model(fast_forward=True)
+        for _ in range(10):
+            model.step()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.gz")
+            save_checkpoint(model, path)
+            restored = load_checkpoint(path, self.graphs, self.merged_graph, self.routing_graphs)
+        self.assertEqual(restored.steps, model.steps)
+        self.assert_same_results(self.run_model(restored))
+
+    def test_fork(self):
+        model = self.create_model(lazy_paths=True)
+        for _ in range(100):
+            model.step()
+        fork = fork_model(model)
+        self.assert_same_results(self.run_model(fork))
+        # The original model is not changed by the fork
+        self.assertEqual(model.steps, 100)
+        self.assert_same_results(self.run_model(model))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import random
+import numpy as np
+
+from typing import Optional
+
+from profiler import profiled
+
+# Order of the transports in the arrays used by TransportChooser
+TRANSPORTS = ["car", "bike", "electric_scooter", "walk"]
+TRANSPORT_INDEX = {transport: index for index, transport in enumerate(TRANSPORTS)}
+
+# Graph used by each transport
+TRANSPORT_GRAPH = {
+    "bike": "bike",
+    "walk": "walk",
+    "car": "drive",
+    "electric_scooter": "bike",
+}
+
+# Average speed of each transport in the city (km/h), used by the event scheduler
+TRANSPORT_SPEED_KMH = {
+    "car": 30,
+    "bike": 15,
+    "electric_scooter": 18,
+    "walk": 5,
+}
+
+TRANSPORT_CHOICE_MODES = ["vectorized", "sequential"]
+
+
+# Dynamic adjustment functions based on distance.
+# They work both on single distances and on NumPy arrays of distances.
+def walking_probability(distance):
+    # Walking becomes less likely as distance grows, near zero at >10 km
+    return np.maximum(0, np.exp(-distance / 2))
+
+def bicycle_probability(distance):
+    # Bicycling is more viable for mid distances, tapers off at longer distances
+    return np.maximum(0, np.exp(-(distance - 5) ** 2 / 15))
+
+def electric_scooter_probability(distance):
+    # Scooters are most viable for shorter distances, tapering off after ~8 km
+    return np.maximum(0, np.exp(-(distance - 4) ** 2 / 8))
+
+def car_probability(distance):
+    # Car becomes more likely as distance increases
+    return np.minimum(1, distance / 10)
+
+
+def choose_transport(rng: random.Random, distances: dict[str, tuple[float, float]], sustainability_factor: float) -> str:
+    """
+    Choose the transport of a single worker, given the (transport, additional walking) distances
+    of each graph type. This is the original per-worker algorithm, used in "sequential" mode.
+    """
+    transport_distance_car, additional_walk_distance_car = distances["drive"]
+    transport_distance_walk, additional_walk_distance_walk = distances["walk"]
+    transport_distance_eScooter, additional_walk_distance_eScooter = distances["bike"]
+    transport_distance_bike, additional_walk_distance_bike = distances["bike"]
+
+    dynamic_weights = {
+        "car": float(car_probability(transport_distance_car + additional_walk_distance_car)),
+        "bike": float(bicycle_probability(transport_distance_bike + additional_walk_distance_bike)),
+        "electric_scooter": float(electric_scooter_probability(transport_distance_eScooter + additional_walk_distance_eScooter)),
+        "walk": float(walking_probability(transport_distance_walk + additional_walk_distance_walk)),
+    }
+
+    # Sustainability bias
+    dynamic_weights["bike"] *= 1 + sustainability_factor*2
+    dynamic_weights["walk"] *= 1 + sustainability_factor*2
+    dynamic_weights["electric_scooter"] *= 1 + sustainability_factor
+
+    # Normalize weights to form a proper probability distribution
+    total_weight = sum(dynamic_weights.values())
+    if total_weight > 0:
+        normalized_weights = {key: value / total_weight for key, value in dynamic_weights.items()}
+    else:
+        normalized_weights = {key: 0 for key in dynamic_weights}
+
+    transport_chosen = rng.choices(
+        list(normalized_weights.keys()),
+        weights=list(normalized_weights.values()),
+        k=1,
+    )[0]
+
+    return transport_chosen
+
+
+class TransportChooser:
+    """
+    Chooses the transport of all workers at once.
+
+    Holds the distance of each transport and the sustainability factor of every worker in arrays,
+    so that the weights of all workers are computed with NumPy and all choices are sampled
+    with a single call to a seeded Generator ("vectorized" mode).
+
+    The "sequential" mode reproduces the original per-worker choices,
+    drawing from a `random.Random` one worker at a time, in order.
+    """
+
+    def __init__(
+        self,
+        sustainability_factors: np.ndarray,
+        seed: int,
+        mode: str = "vectorized",
+        sample_offset: int = 0,
+        num_samples: Optional[int] = None,
+    ):
+        """
+        `sustainability_factors` is the (shared) array with the factor of each worker.
+
+        In vectorized mode, `num_samples` (by default, the number of workers) are drawn for every choice,
+        and the workers use the ones from `sample_offset` on. A chooser of a range of the workers
+        then makes the same choices for them as the chooser of all workers.
+        """
+        if mode not in TRANSPORT_CHOICE_MODES:
+            raise ValueError(f"Invalid transport choice mode '{mode}'")
+        self.num_workers = len(sustainability_factors)
+        self.sample_offset = sample_offset
+        self.num_samples = num_samples if num_samples is not None else self.num_workers
+        if mode == "sequential" and (self.sample_offset, self.num_samples) != (0, self.num_workers):
+            raise ValueError("Choosing the transports of a range of the workers requires the vectorized mode")
+        self.mode = mode
+        self.rng = np.random.default_rng(seed)
+        self.python_rng = random.Random(seed)
+
+        self.sustainability_factors = sustainability_factors
+        self.distances = np.zeros((self.num_workers, len(TRANSPORTS)), dtype=np.float64)
+        # Original (transport, additional) distances per graph type, used in sequential mode
+        self.graph_distances: list[dict[str, tuple[float, float]]] = [None] * self.num_workers
+
+    def set_worker_distances(self, index: int, graph_distances: dict[str, tuple[float, float]]) -> None:
+        self.distances[index] = [
+            sum(graph_distances[TRANSPORT_GRAPH[transport]])
+            for transport in TRANSPORTS
+        ]
+        self.graph_distances[index] = graph_distances
+
+    def weights(self) -> np.ndarray:
+        """Normalized probability of each transport (columns) for each worker (rows)."""
+        distances = self.distances
+        factors = self.sustainability_factors
+
+        weights = np.column_stack((
+            car_probability(distances[:, 0]),
+            bicycle_probability(distances[:, 1]) * (1 + factors * 2),
+            electric_scooter_probability(distances[:, 2]) * (1 + factors),
+            walking_probability(distances[:, 3]) * (1 + factors * 2),
+        ))
+        total_weights = weights.sum(axis=1, keepdims=True)
+        if np.any(total_weights <= 0):
+            raise ValueError("Total of weights must be greater than zero")
+        return weights / total_weights
+
+    @profiled("stepping.choose_transports")
+    def choose(self) -> list[str]:
+        """Choose the transport of every worker."""
+        if self.mode == "sequential":
+            return [
+                choose_transport(self.python_rng, graph_distances, factor)
+                for graph_distances, factor in zip(self.graph_distances, self.sustainability_factors.tolist())
+            ]
+
+        cumulative_weights = np.cumsum(self.weights(), axis=1)
+        samples = self.rng.random(self.num_samples)[self.sample_offset : self.sample_offset + self.num_workers]
+        choices = (cumulative_weights < samples[:, None]).sum(axis=1)
+        # Guard against floating point errors in the last cumulative weight
+        choices = np.minimum(choices, len(TRANSPORTS) - 1)
+        return [TRANSPORTS[choice] for choice in choices.tolist()]
@@ -1,51 +1,72 @@
 from mesa import Agent
 import networkx as nx
 
-import math
+from typing import Optional
 
-from graph_utils import get_path_information, calculate_distance
+from graph_utils import get_path_information, calculate_path_distances, SnappedPosition
+from csr_graph import CSRGraph, ShortestPathTree
 from company_agent import CompanyAgent
+from transport_choice import TRANSPORT_GRAPH, TRANSPORT_INDEX, TRANSPORT_SPEED_KMH
+from profiler import profiled
 
 
 class WorkerAgent(Agent):
-    transport_graph = {
-        "bike": "bike",
-        "walk": "walk",
-        "car": "drive",
-        "electric_scooter": "bike",
-    }
+    transport_graph = TRANSPORT_GRAPH
+    @profiled("setup.worker_init")
     def __init__(
         self,
         model,
         company: CompanyAgent,
         home_position: tuple[int, int],
+        home_snaps: dict[str, SnappedPosition],
+        company_trees: Optional[dict[str, dict[str, ShortestPathTree]]] = None,
     ):
+        """
+        `home_snaps` has the closest node of each graph type to the home position.
+        `company_trees` optionally has the shortest path trees rooted at the company
+        (for each graph type and path name), shared by all of its workers.
+
+        If the model has a path pool (see `SustainabilityModel` with `lazy_paths`), only the distances
+        of the paths are kept, and the paths of the chosen graph are taken from the pool when it is chosen.
+        """
         super().__init__(model=model)
         self.company = company
         
         self.sustainable_choice = False
 
-        # tuples so we can know the kms and how many times he used each transport
-        self.kms_car = (0, 0)
-        self.kms_bycicle = (0, 0)
-        self.kms_walk = (0, 0)
-        self.kms_electric_scooter = (0, 0)
+        # Counters (times used and kms of each transport) and sustainability factor
+        # live in the model's columnar store, at this index
+        self.worker_index: int = self.model.worker_state.add_worker(
+            company.company_index, self.get_initial_sustainability_factor()
+        )
         self.activities_during_day = []
         self.home_position = home_position
-        self.sustainability_factor = self.get_initial_sustainability_factor()
 
         self.information_to_work = {
             type: get_path_information(
-                graph, self.home_position, company.location_position
+                routing_graph, home_snaps[type], company.location_snaps[type],
+                company_trees[type]["to_work"] if company_trees is not None else None,
+                self.model.route_cache,
             )
-            for type, graph in self.model.graphs.items()
+            for type, routing_graph in self.model.routing_graphs.items()
         }
         self.information_to_home = {
             type: get_path_information(
-                graph, company.location_position, self.home_position
+                routing_graph, company.location_snaps[type], home_snaps[type],
+                company_trees[type]["to_home"] if company_trees is not None else None,
+                self.model.route_cache,
             )
-            for type, graph in self.model.graphs.items()
+            for type, routing_graph in self.model.routing_graphs.items()
         }
+        if self.model.path_pool is not None:
+            self.home_snaps = home_snaps
+            self.company_trees = company_trees
+            self.information_to_work = {
+                type: information._replace(path=None) for type, information in self.information_to_work.items()
+            }
+            self.information_to_home = {
+                type: information._replace(path=None) for type, information in self.information_to_home.items()
+            }
         self.distances_to_choose_transport = {
             type: (
                 (self.information_to_home[type].transport_distance + self.information_to_work[type].transport_distance) / 2,
@@ -53,8 +74,34 @@ class WorkerAgent(Agent):
             )
             for type in self.model.graphs.keys()
         }
-        self.transport_chosen: str = self.choose_transport(self.distances_to_choose_transport)
-        self.__setup_transport_chosen()
+        # The transport is chosen by the model for all workers at once (see set_transport_chosen)
+        self.model.transport_chooser.set_worker_distances(self.worker_index, self.distances_to_choose_transport)
+        self.transport_chosen: Optional[str] = None
+
+    @property
+    def sustainability_factor(self) -> float:
+        return float(self.model.worker_state.sustainability_factors[self.worker_index])
+
+    @sustainability_factor.setter
+    def sustainability_factor(self, value: float) -> None:
+        self.model.worker_state.sustainability_factors[self.worker_index] = value
+
+    # Tuples so we can know how many times he used each transport and the kms
+    @property
+    def kms_car(self) -> tuple[int, float]:
+        return self.model.worker_state.get_counter(self.worker_index, "car")
+
+    @property
+    def kms_bycicle(self) -> tuple[int, float]:
+        return self.model.worker_state.get_counter(self.worker_index, "bike")
+
+    @property
+    def kms_walk(self) -> tuple[int, float]:
+        return self.model.worker_state.get_counter(self.worker_index, "walk")
+
+    @property
+    def kms_electric_scooter(self) -> tuple[int, float]:
+        return self.model.worker_state.get_counter(self.worker_index, "electric_scooter")
 
     def get_initial_sustainability_factor(self) -> float:
         if self.company.policy == "policy0":
@@ -64,21 +111,20 @@ class WorkerAgent(Agent):
     def modify_sustainable_factor(self, raise_value) -> None:
         self.sustainability_factor *= raise_value
 
+    def set_transport_chosen(self, transport_chosen: str) -> None:
+        self.transport_chosen = transport_chosen
+        self.__setup_transport_chosen()
+
     def __setup_transport_chosen(self) -> None:
         # Allows choosing a different transport at a given step in the simulation
 
         # Count transport choice
-        if self.transport_chosen == "walk":
-            self.kms_walk = (self.kms_walk[0] + 1, self.kms_walk[1])
-        elif self.transport_chosen == "bike":
-            self.kms_bycicle = (self.kms_bycicle[0] + 1, self.kms_bycicle[1])
-        elif self.transport_chosen == "electric_scooter":
-            self.kms_electric_scooter = (self.kms_electric_scooter[0] + 1, self.kms_electric_scooter[1])
-        elif self.transport_chosen == "car":
-            self.kms_car = (self.kms_car[0] + 1, self.kms_car[1])
+        self.transport_index: int = TRANSPORT_INDEX[self.transport_chosen]
+        self.model.worker_state.uses[self.worker_index, self.transport_index] += 1
 
         self.chosen_graph_name: str = self.transport_graph[self.transport_chosen]
         self.graph: nx.MultiDiGraph = self.model.graphs[self.chosen_graph_name]
+        self.routing_graph: CSRGraph = self.model.routing_graphs[self.chosen_graph_name]
 
         chosen_information_to_work = self.information_to_work[self.chosen_graph_name]
         chosen_information_to_home = self.information_to_home[self.chosen_graph_name]
@@ -87,11 +133,17 @@ class WorkerAgent(Agent):
             "to_home": (chosen_information_to_home.transport_distance, chosen_information_to_home.additional_distance),
         }
         self.paths = {
-            "to_work": self.information_to_work[self.chosen_graph_name].path,
-            "to_home": self.information_to_home[self.chosen_graph_name].path,
+            "to_work": self.__get_path(chosen_information_to_work, "to_work"),
+            "to_home": self.__get_path(chosen_information_to_home, "to_home"),
+        }
+        # Distance of each edge along the paths, so that each step is just a lookup
+        self.path_distances = {
+            path_name: calculate_path_distances(self.routing_graph, path)
+            for path_name, path in self.paths.items()
         }
         self.current_path_name = "to_work"
         self.current_path: list[int] = self.paths[self.current_path_name]
+        self.current_path_distances: list[float] = self.path_distances[self.current_path_name]
 
         if self.pos is None:
             self.model.grid.place_agent(self, self.current_path[0])
@@ -101,74 +153,90 @@ class WorkerAgent(Agent):
         self.node_index = 0
         self.partial_finish = False
 
-    def switch_path(self) -> None:
+    def __get_path(self, information, path_name: str) -> list[int]:
+        if information.path is not None:
+            return information.path
+
+        home_node = self.home_snaps[self.chosen_graph_name][0]
+        company_node = self.company.location_nodes[self.chosen_graph_name]
+        source_node, target_node = (home_node, company_node) if path_name == "to_work" else (company_node, home_node)
+        return self.model.path_pool.get(
+            self.routing_graph, source_node, target_node,
+            self.company_trees[self.chosen_graph_name][path_name] if self.company_trees is not None else None,
+            self.model.route_cache,
+        )
+
+    def switch_path(self, transport_chosen: Optional[str] = None) -> None:
+        """`transport_chosen` is the transport for the next day, required when going back to work."""
         self.partial_finish = False
         if self.current_path_name == "to_work":
             self.current_path_name = "to_home"
         else:
             self.current_path_name = "to_work"
-            self.transport_chosen = self.choose_transport(self.distances_to_choose_transport)
-            self.__setup_transport_chosen()
+            self.set_transport_chosen(transport_chosen)
 
         self.current_path = self.paths[self.current_path_name]
+        self.current_path_distances = self.path_distances[self.current_path_name]
         self.node_index = 0
 
-    def choose_transport(self, distances) -> str:
-        transport_distance_car, additional_walk_distance_car = distances["drive"]
-        transport_distance_walk, additional_walk_distance_walk = distances["walk"]
-        transport_distance_eScooter, additional_walk_distance_eScooter = distances["bike"]
-        transport_distance_bike, additional_walk_distance_bike = distances["bike"]
-
-        # Dynamic adjustment functions based on distance
-        def walking_probability(distance):
-            # Walking becomes less likely as distance grows, near zero at >10 km
-            return max(0, math.exp(-distance / 2))
-
-        def bicycle_probability(distance):
-            # Bicycling is more viable for mid distances, tapers off at longer distances
-            return max(0, math.exp(-(distance - 5) ** 2 / 15))
-
-        def electric_scooter_probability(distance):
-            # Scooters are most viable for shorter distances, tapering off after ~8 km
-            return max(0, math.exp(-(distance - 4) ** 2 / 8))
-
-        def car_probability(distance):
-            # Car becomes more likely as distance increases
-            return min(1, distance / 10)
-
-        dynamic_weights = {
-            "car": car_probability(transport_distance_car + additional_walk_distance_car),
-            "bike": bicycle_probability(transport_distance_bike + additional_walk_distance_bike),
-            "electric_scooter": electric_scooter_probability(transport_distance_eScooter + additional_walk_distance_eScooter),
-            "walk": walking_probability(transport_distance_walk + additional_walk_distance_walk)
-        }
+    def finish_partial_path(self) -> None:
+        # Includes the contribution of the walk distances of moving from location (latitude, longitude)
+        # to the start node, as well as the end node.
+        additional_walk_distance = self.distances[self.current_path_name][1]
+        self.model.worker_state.add_kms(self.worker_index, TRANSPORT_INDEX["walk"], additional_walk_distance)
 
-        # Sustainability bias
-        dynamic_weights["bike"] *= 1 + self.sustainability_factor*2
-        dynamic_weights["walk"] *= 1 + self.sustainability_factor*2
-        dynamic_weights["electric_scooter"] *= 1 + self.sustainability_factor
+        # Wait for the other agents to arrive (the model stops activating this agent until then)
+        self.partial_finish = True
+        self.model.worker_arrived(self)
 
-        # Normalize weights to form a proper probability distribution
-        total_weight = sum(dynamic_weights.values())
-        if total_weight > 0:
-            normalized_weights = {key: value / total_weight for key, value in dynamic_weights.items()}
-        else:
-            normalized_weights = {key: 0 for key in dynamic_weights}
+    @profiled("stepping.worker_fast_forward_leg")
+    def fast_forward_leg(self) -> None:
+        """Travel the rest of the current path at once, instead of one node per step."""
+        if self.partial_finish:
+            return
 
-        transport_chosen = self.random.choices(
-            list(normalized_weights.keys()),
-            weights=list(normalized_weights.values()),
-            k=1,
-        )[0]
+        if self.node_index == 0:
+            distance_travelled = self.distances[self.current_path_name][0]
+        else:
+            distance_travelled = sum(self.current_path_distances[self.node_index:])
+        self.__add_distance_travelled(distance_travelled)
+
+        self.node_index = len(self.current_path) - 1
+        self.model.grid.move_agent(self, self.current_path[self.node_index])
+        self.finish_partial_path()
+
+    def depart(self, time: float) -> float:
+        """Start the current path at `time` (hours), returning the time at which the next node is reached."""
+        self.next_node_time = time + self.__time_to_next_node()
+        return self.next_node_time
+
+    @profiled("stepping.worker_advance")
+    def advance(self, time: float) -> Optional[float]:
+        """
+        Move through all the nodes of the current path reached by `time` (hours), used by the event scheduler.
+        Returns the time at which the next node is reached, or None when the worker arrived.
+        The walks to and from the path are not timed.
+        """
+        moved = False
+        while self.node_index < len(self.current_path) - 1 and self.next_node_time <= time:
+            self.__add_distance_travelled(self.current_path_distances[self.node_index])
+            self.node_index += 1
+            self.next_node_time += self.__time_to_next_node()
+            moved = True
+        if moved:
+            self.model.grid.move_agent(self, self.current_path[self.node_index])
 
-        return transport_chosen
+        if self.node_index == len(self.current_path) - 1:
+            self.finish_partial_path()
+            return None
+        return self.next_node_time
 
-    def finish_partial_path(self) -> None:
-        # Includes the contribution of the walk distances of moving from location (latitude, longitude)
-        # to the start node, as well as the end node.
-        additional_walk_distance = self.distances[self.current_path_name][1]
-        self.kms_walk = (self.kms_walk[0], self.kms_walk[1] + additional_walk_distance)
+    def __time_to_next_node(self) -> float:
+        if self.node_index == len(self.current_path) - 1:
+            return 0.0
+        return self.current_path_distances[self.node_index] / TRANSPORT_SPEED_KMH[self.transport_chosen]
 
+    @profiled("stepping.worker_step")
     def step(self):
         if self.partial_finish:
             # Do nothing while we wait for other agents to get to the desired locations
@@ -178,23 +246,14 @@ class WorkerAgent(Agent):
         if self.node_index == len(self.current_path) - 1:
             # On the last node, just finished path
             self.finish_partial_path()
-            self.partial_finish = True
             return
 
         self.node_index += 1
-        previous_node = self.current_path[self.node_index - 1]
         current_node = self.current_path[self.node_index]
-        distance_travelled = calculate_distance(self.graph, previous_node, current_node)
-
-        if self.transport_chosen == "walk":
-            self.kms_walk = (self.kms_walk[0], self.kms_walk[1] + distance_travelled)
-        elif self.transport_chosen == "bike":
-            self.kms_bycicle = (self.kms_bycicle[0], self.kms_bycicle[1] + distance_travelled)
-        elif self.transport_chosen == "electric_scooter":
-            self.kms_electric_scooter = (self.kms_electric_scooter[0], self.kms_electric_scooter[1] + distance_travelled)
-        elif self.transport_chosen == "car":
-            self.kms_car = (self.kms_car[0], self.kms_car[1] + distance_travelled)
-        else:
-            raise ValueError(f"Invalid transport chosen '{self.transport_chosen}'")
+        distance_travelled = self.current_path_distances[self.node_index - 1]
+        self.__add_distance_travelled(distance_travelled)
 
         self.model.grid.move_agent(self, current_node)
+
+    def __add_distance_travelled(self, distance_travelled: float) -> None:
+        self.model.worker_state.add_kms(self.worker_index, self.transport_index, distance_travelled)
@@ -0,0 +1,136 @@
+import numpy as np
+
+from transport_choice import TRANSPORTS, TRANSPORT_INDEX
+
+
+class WorkerStateStore:
+    """
+    Columnar store of the per-worker state, owned by the model.
+
+    Each counter is a NumPy array indexed by worker (`WorkerAgent.worker_index`),
+    with one column per transport (in the order of `TRANSPORTS`) where applicable,
+    so aggregations over all workers are single array reductions.
+
+    Companies must be added grouped by policy, and workers grouped by company, so that the
+    workers of each company (and of each policy) are a contiguous range of indices,
+    and company or policy aggregations are reductions over a slice.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        num_companies: int,
+        num_policies: int,
+        co2_per_km: dict[str, float],
+        cost_per_km: dict[str, float],
+    ):
+        """`co2_per_km` and `cost_per_km` have the CO2 (g) and cost (€) per km of each transport (0 if missing)."""
+        self.num_workers = 0
+        self.company_index = np.zeros(num_workers, dtype=np.int32)
+        self.sustainability_factors = np.zeros(num_workers, dtype=np.float64)
+        # Times each transport was chosen, and kms travelled with it
+        self.uses = np.zeros((num_workers, len(TRANSPORTS)), dtype=np.int64)
+        self.kms = np.zeros((num_workers, len(TRANSPORTS)), dtype=np.float64)
+
+        # Running totals of CO2 (g) and costs (€), updated as kms are added
+        self.co2_per_km = [co2_per_km.get(transport, 0) for transport in TRANSPORTS]
+        self.cost_per_km = [cost_per_km.get(transport, 0) for transport in TRANSPORTS]
+        self.co2 = np.zeros(num_workers, dtype=np.float64)
+        self.costs = np.zeros(num_workers, dtype=np.float64)
+        self.transport_co2 = np.zeros(len(TRANSPORTS), dtype=np.float64)
+
+        self.num_companies = 0
+        self.company_policy_index = np.zeros(num_companies, dtype=np.int32)
+        self.company_num_workers = np.zeros(num_companies, dtype=np.int64)
+        self.company_co2 = np.zeros(num_companies, dtype=np.float64)
+        self.company_costs = np.zeros(num_companies, dtype=np.float64)
+
+        self.policy_num_companies = np.zeros(num_policies, dtype=np.int64)
+        self.policy_co2 = np.zeros(num_policies, dtype=np.float64)
+
+        # [start, stop) ranges of the workers of each company, and of the companies of each policy
+        self.company_worker_start = np.zeros(num_companies, dtype=np.int64)
+        self.company_worker_stop = np.zeros(num_companies, dtype=np.int64)
+        self.policy_company_start = np.zeros(num_policies, dtype=np.int64)
+        self.policy_company_stop = np.zeros(num_policies, dtype=np.int64)
+
+        # Plain list copies of the indices, which are faster to read one at a time in add_kms
+        self._worker_company: list[int] = []
+        self._company_policy: list[int] = []
+
+    def add_company(self, policy_index: int) -> int:
+        """Register a company and return its index in the arrays."""
+        index = self.num_companies
+        if index > 0 and policy_index != self._company_policy[-1] and self.policy_num_companies[policy_index] > 0:
+            raise ValueError("Companies must be added grouped by policy")
+        if self.policy_num_companies[policy_index] == 0:
+            self.policy_company_start[policy_index] = index
+        self.policy_company_stop[policy_index] = index + 1
+        self.company_policy_index[index] = policy_index
+        self.policy_num_companies[policy_index] += 1
+        self._company_policy.append(policy_index)
+        self.num_companies += 1
+        return index
+
+    def add_worker(self, company_index: int, sustainability_factor: float) -> int:
+        """Register a worker and return its index in the arrays."""
+        index = self.num_workers
+        if index > 0 and company_index != self._worker_company[-1] and self.company_num_workers[company_index] > 0:
+            raise ValueError("Workers must be added grouped by company")
+        if self.company_num_workers[company_index] == 0:
+            self.company_worker_start[company_index] = index
+        self.company_worker_stop[company_index] = index + 1
+        self.company_index[index] = company_index
+        self.company_num_workers[company_index] += 1
+        self.sustainability_factors[index] = sustainability_factor
+        self._worker_company.append(company_index)
+        self.num_workers += 1
+        return index
+
+    def add_kms(self, index: int, transport_index: int, kms: float) -> None:
+        """Add kms travelled by a worker, updating all the running totals."""
+        self.kms[index, transport_index] += kms
+
+        co2 = kms * self.co2_per_km[transport_index]
+        cost = kms * self.cost_per_km[transport_index]
+        if co2 == 0 and cost == 0:
+            return
+
+        company_index = self._worker_company[index]
+        self.co2[index] += co2
+        self.costs[index] += cost
+        self.transport_co2[transport_index] += co2
+        self.company_co2[company_index] += co2
+        self.company_costs[company_index] += cost
+        self.policy_co2[self._company_policy[company_index]] += co2
+
+    def get_counter(self, index: int, transport: str) -> tuple[int, float]:
+        """(times used, kms) of a transport for a worker."""
+        column = TRANSPORT_INDEX[transport]
+        return int(self.uses[index, column]), float(self.kms[index, column])
+
+    def kms_of(self, transport: str) -> np.ndarray:
+        """Kms travelled by each worker with the transport."""
+        return self.kms[: self.num_workers, TRANSPORT_INDEX[transport]]
+
+    def uses_of(self, transport: str) -> np.ndarray:
+        """Times each worker chose the transport."""
+        return self.uses[: self.num_workers, TRANSPORT_INDEX[transport]]
+
+    def company_workers(self, company_index: int) -> slice:
+        """Range of the indices of the workers of a company."""
+        return slice(int(self.company_worker_start[company_index]), int(self.company_worker_stop[company_index]))
+
+    def policy_companies(self, policy_index: int) -> slice:
+        """Range of the indices of the companies with a policy."""
+        return slice(int(self.policy_company_start[policy_index]), int(self.policy_company_stop[policy_index]))
+
+    def policy_workers(self, policy_index: int) -> slice:
+        """Range of the indices of the workers of all companies with a policy."""
+        companies = self.policy_companies(policy_index)
+        if companies.start == companies.stop:
+            return slice(0, 0)
+        return slice(
+            int(self.company_worker_start[companies.start]),
+            int(self.company_worker_stop[companies.stop - 1]),
+        )